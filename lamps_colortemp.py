@@ -32,6 +32,10 @@ LAMPS_BEDROOM = [
  'bedroom 2'
 ]
 
+# How many seconds the properties read from a lamp are used for, instead of
+# asking the lamp again
+MAX_PROPERTY_AGE = 10
+
 LAMPS = dict(
   kitchen = LAMPS_KITCHEN,
   bathroom = LAMPS_BATHROOM,
@@ -77,16 +81,12 @@ if args.listrooms:
 
 
 # Get bulb by name
-def get_bulb(name, bulbs):
-    match = [b for b in bulbs if b['capabilities']['name'] == name]
-    if len(match) == 1:
-        return Bulb(match[0]['ip'], auto_on=True)
-    else:
-        return None
+def get_bulb(name, registry):
+    return registry.get(name)
 
-def get_bulbs(names, bulbs):
+def get_bulbs(names, registry):
     for name in names:
-        yield get_bulb(name, bulbs)
+        yield get_bulb(name, registry)
 
 def get_power (bulb):
     return int(bulb.get_properties()['current_brightness'])
@@ -94,10 +94,38 @@ def get_power (bulb):
 def get_ct (bulb):
     return int(bulb.get_properties()['ct'])
 
+def set_lamp(bulb, power, ct):
+    action = Flow.actions.stay
 
-if __name__ == "__main__":
-    all_bulbs = discover_bulbs()
+    # Power is set and is not zero - clip to 1..100 range
+    if power:
+        p = _clamp(power, 1, 100)
+
+    # If power is zero, then the lamp must be turned off
+    elif power == 0:
+        if bulb.get_properties()['power'] == 'on':
+            # gradually turn off the lamp
+            p = 1
+            action = Flow.actions.off
+        else:
+            # Nothing to be done
+            return
+
+    # If power is None, get it from the lamp
+    else:
+        p = get_power(bulb)
+
+    t = ct if ct    else get_ct(bulb)
 
+    bulb.start_flow(Flow(
+        count=1,
+        action=action,
+        transitions=[TemperatureTransition(t, args.duration*1000, p)]))
+
+    print(bulb.get_properties()['name'], t, p, action)
+
+
+if __name__ == "__main__":
     if 'room' not in args:
         parser.print_help()
         sys.exit(0)
@@ -106,40 +134,29 @@ if __name__ == "__main__":
         parser.print_help()
         sys.exit(0)
 
+    registry = BulbRegistry.from_cache(
+        DiscoveryCache(),
+        expected_names=[lamp for room in args.room for lamp in LAMPS[room[0]]],
+        auto_on=True,
+        max_property_age=MAX_PROPERTY_AGE)
+
+    # Settings of every lamp in the requested rooms
+    settings = {}
     for room in args.room:
         name = room.pop(0)
         power = int(room.pop(0)) if len(room) > 0 else None
         ct    = int(room.pop(0)) if len(room) > 0 else None
 
-        for bulb in get_bulbs(LAMPS[name], all_bulbs):
-            try:
-                action = Flow.actions.stay
-
-                # Power is set and is not zero - clip to 1..100 range
-                if power:
-                    p = _clamp(power, 1, 100)
-
-                # If power is zero, then the lamp must be turned off
-                elif power == 0:
-                    if bulb.get_properties()['power'] == 'on':
-                        # gradually turn off the lamp
-                        p = 1
-                        action = Flow.actions.off
-                    else:
-                        # Nothing to be done, move to the next lamp
-                        continue
-
-                # If power is None, get it from the lamp
-                else:
-                    p = get_power(bulb)
-                
-                t = ct if ct    else get_ct(bulb)
-
-                bulb.start_flow(Flow(
-                    count=1,
-                    action=action,
-                    transitions=[TemperatureTransition(t, args.duration*1000, p)]))
-
-                print(bulb.get_properties()['name'], t, p, action)
-            except AttributeError as e:
-                print('Problem with ', name, 'bulb', )
+        for lamp in LAMPS[name]:
+            bulb = get_bulb(lamp, registry)
+            if bulb is None:
+                print('Problem with ', lamp, 'bulb', )
+            else:
+                settings[bulb] = (power, ct)
+
+    # Apply the settings to all lamps at once
+    with BulbGroup(settings) as group:
+        result = group.map(lambda bulb: set_lamp(bulb, *settings[bulb]))
+
+    for bulb, error in result.errors.items():
+        print('Problem with ', bulb, 'bulb:', error)
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import argparse
-from concurrent.futures import ThreadPoolExecutor
 import logging
 import time
 from yeelight import *
@@ -62,47 +61,39 @@ alarm_transitions = [
 #####################################################
 
 
-# Sleep function with argument in ms
-sleep = lambda t: time.sleep(t / 1000.0)
+# Time of the action t ms after the start, on the monotonic clock
+at = lambda start, t: start + t / 1000.0
+
+# How long the lamps' state read or set by the script is trusted, in seconds,
+# so that auto_on doesn't ask the lamps before every command
+MAX_PROPERTY_AGE = 10
 
 def activate_bulb(bulb, duration=POWER_ON_DURATION):
     bulb.set_hsv(1, 100, 1, effect='smooth', duration=duration)
-    sleep(duration)
 
 # Get bulb by name
-def get_bulb(name, bulbs):
-    match = [b for b in bulbs if b['capabilities']['name'] == name]
-    if len(match) == 1:
-        return Bulb(match[0]['ip'], auto_on=True)
-    else:
-        return None
-
-def lamp_thread(lamp, delay, bulbs):
+def get_bulb(name, registry):
+    return registry.get(name)
+
+def sunset_duration():
+    return RED_DURATION + sum([a.duration for a in phase2_transitions])
+
+def schedule_lamp(lamp, bulb, delay, scheduler, start):
     """
-    This function turns on the lamp, calculates
-    the duration of the red phase, then
-    activates the flow
+    This function calculates the duration
+    of the red phase, then schedules activating
+    the flow after the lamp's delay, relative to
+    the common start
     """
-    warn  = lambda m: logging.warning('W: %10s: %s' % (lamp, m))
     info  = lambda m: logging.info   ('I: %10s: %s' % (lamp, m))
     debug = lambda m: logging.debug  ('D: %10s: %s' % (lamp, m))
 
-    bulb = get_bulb(lamp, bulbs)
-    if not bulb:
-        warn("Lamp not found on the network")
-        return
-
     # Start of the logic
     if delay:
-        debug('waiting %is before start...' % (delay/1000))
-        sleep(delay)
-
-    info("Activating...")
-    #activate_bulb(bulb)
+        debug('starting in %is...' % (delay/1000))
 
     duration = RED_DURATION - delay
     debug('Duration of the red transition: %is' % (duration/1000))
-    debug('Starting the rest of the transitions')
 
     # The bed lamp is special, we let it shine to the full power
     brightness = 100 if lamp == 'bed' else RED_BRIGHTNESS
@@ -113,20 +104,23 @@ def lamp_thread(lamp, delay, bulbs):
         *phase2_transitions
     ]
 
-    bulb.start_flow(
-        Flow(
-            count=1,
-            action=Flow.actions.stay,
-            transitions=transitions
+    def start_flow():
+        info("Activating...")
+        #activate_bulb(bulb)
+        debug('Starting the rest of the transitions')
+        bulb.start_flow(
+            Flow(
+                count=1,
+                action=Flow.actions.stay,
+                transitions=transitions
+            )
         )
-    )
 
-    if args.alarm:
-        sleep(sum([a.duration for a in transitions]))
+    return [scheduler.call_at(at(start, delay), start_flow)]
 
 
-def alarm(lamp, bulbs):
-    bulb = get_bulb(lamp, bulbs)
+def alarm(lamp, bulb):
+    logging.info('I: %10s: Triggering alarm' % lamp)
     bulb.start_flow(Flow(
         count=args.alarm,
         action=Flow.actions.recover,
@@ -146,19 +140,44 @@ def main():
 
     # Discover available lamps
     logging.info('Discovering lamps in the network')
-    bulbs = discover_bulbs()
-    logging.info('%i lamp(s) found' % len(bulbs))
+    registry = BulbRegistry.from_cache(
+        DiscoveryCache(), expected_names=LAMP_DELAYS, auto_on=True,
+        max_property_age=MAX_PROPERTY_AGE)
+    logging.info('%i lamp(s) found' % len(registry))
+
+    # Look the lamps up and connect to them before the clock starts, so
+    # that the first actions aren't late
+    bulbs = {}
+    for lamp in LAMP_DELAYS:
+        bulb = get_bulb(lamp, registry)
+        if bulb:
+            bulbs[lamp] = bulb
+        else:
+            logging.warning('W: %10s: %s' % (lamp, "Lamp not found on the network"))
+
+    # All the lamps share one timer thread, and the actions run on a pool
+    # of workers, so a slow or unreachable lamp doesn't delay the others
+    scheduler = Scheduler()
+    start = time.monotonic()
+    events = []
 
     if not args.no_sunrise:
-        with ThreadPoolExecutor() as executor:
-            f = lambda it: lamp_thread(*it, bulbs)
-            executor.map(f, LAMP_DELAYS.items())
+        for lamp, bulb in bulbs.items():
+            events += schedule_lamp(lamp, bulb, LAMP_DELAYS[lamp], scheduler, start)
 
     if args.alarm:
-        logging.info("Triggering alarm")
-        with ThreadPoolExecutor() as executor:
-            f = lambda it: alarm(it, bulbs)
-            executor.map(f, LAMP_DELAYS)
+        alarm_time = 0 if args.no_sunrise else sunset_duration()
+        for lamp, bulb in bulbs.items():
+            events.append(scheduler.call_at(
+                at(start, alarm_time), alarm, lamp, bulb))
+
+    for event in events:
+        event.wait()
+    scheduler.stop()
+
+    if events:
+        logging.info('Largest lateness of a lamp action: %.3fs' %
+                     max([e.lateness for e in events]))
 
 
 if __name__ == '__main__':
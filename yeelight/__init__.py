@@ -2,7 +2,25 @@
 
 """A Python library for controlling YeeLight RGB bulbs."""
 
+from yeelight.cache import DiscoveryCache
+from yeelight.connection import ConnectionManager, ConnectionStats
 from yeelight.enums import BulbType, CronType, LightType, PowerMode, SceneClass
 from yeelight.flow import Flow, HSVTransition, RGBTransition, SleepTransition, TemperatureTransition
-from yeelight.main import Bulb, BulbException, discover_bulbs
+from yeelight.group import BulbGroup, GroupResult
+from yeelight.instrumentation import BulbStats, CommandEvent, Instrumentation, LatencyHistogram
+from yeelight.main import Bulb, BulbException, discover_bulbs, discover_bulbs_iter
+from yeelight.music import MusicHub
+from yeelight.ratelimit import RateLimiter
+from yeelight.registry import BulbRegistry
+from yeelight.scheduler import FlowChain, ScheduledEvent, Scheduler
 from yeelight.version import __version__
+
+
+def __getattr__(name):
+    # asyncio takes longer to import than the rest of the package, so the
+    # asyncio client is only imported when it is first used.
+    if name in ("AsyncBulb", "AsyncScheduler", "async_discover_bulbs"):
+        from yeelight import aio
+
+        return getattr(aio, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,517 @@
+"""An asyncio client for YeeLight bulbs."""
+
+import asyncio
+import json
+import logging
+import time
+
+from .enums import PowerMode
+from .main import (
+    _CONNECTION_LOST,
+    _SSDP_ADDRESS,
+    _SSDP_SEARCH,
+    Bulb,
+    BulbException,
+    _DiscoveryGoal,
+    _PropertyFetch,
+    _discovery_socket,
+    _encode_command,
+    _parse_discovery_reply,
+    _property_set,
+)
+from .scheduler import ScheduledEvent
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Collect the replies to an SSDP discovery request."""
+
+    def __init__(self, goal):
+        self.bulbs = []
+        self.goal = goal
+        self.done = asyncio.Event()
+
+    def datagram_received(self, data, addr):
+        bulb = _parse_discovery_reply(data)
+        if not self.goal.add(bulb):
+            return
+
+        self.bulbs.append(bulb)
+        if self.goal.reached:
+            self.done.set()
+
+
+async def async_discover_bulbs(timeout=2, interface=False, expected_names=None, expected_count=None, ssdp_address=None):
+    """
+    Discover all the bulbs in the local network, without blocking the event loop.
+
+    See :py:func:`discover_bulbs <yeelight.discover_bulbs>` for the parameters.
+
+    :returns: A list of dictionaries, containing the ip, port and capabilities
+              of each of the bulbs in the network.
+    """
+    loop = asyncio.get_running_loop()
+    s = _discovery_socket(interface)
+    s.setblocking(False)
+    goal = _DiscoveryGoal(expected_names, expected_count)
+    transport, protocol = await loop.create_datagram_endpoint(lambda: _DiscoveryProtocol(goal), sock=s)
+    try:
+        transport.sendto(_SSDP_SEARCH, ssdp_address or _SSDP_ADDRESS)
+        await asyncio.wait_for(protocol.done.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        transport.close()
+
+    return protocol.bulbs
+
+
+class AsyncBulb(Bulb):
+    def __init__(
+        self,
+        ip,
+        port=55443,
+        effect="smooth",
+        duration=300,
+        auto_on=False,
+        power_mode=PowerMode.LAST,
+        model=None,
+        timeout=5,
+        instrumentation=None,
+        max_property_age=None,
+        support=None,
+        capabilities=None,
+    ):
+        """
+        A YeeLight bulb driven by an asyncio event loop.
+
+        ``AsyncBulb`` has the same methods as :py:class:`Bulb <yeelight.Bulb>`,
+        but every method that talks to the bulb is a coroutine. Responses are
+        read by a single background task per bulb and matched to the waiting
+        coroutine by their ``id``, so any number of commands can be in flight
+        at once, and one event loop can drive many bulbs.
+
+        Example:
+
+        >>> bulb = AsyncBulb("192.168.0.19")
+        >>> await bulb.set_rgb(255, 0, 0)
+        >>> await bulb.close()
+
+        :param int timeout: How many seconds to wait for a connection or a
+                            response before giving up.
+
+        See :py:class:`Bulb <yeelight.Bulb>` for the other parameters.
+        """
+        super(AsyncBulb, self).__init__(
+            ip,
+            port,
+            effect,
+            duration,
+            auto_on,
+            power_mode,
+            model,
+            instrumentation=instrumentation,
+            max_property_age=max_property_age,
+            support=support,
+            capabilities=capabilities,
+        )
+        self.timeout = timeout
+
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._futures = {}  # Command id -> future waiting for its response.
+        self._connect_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _connect(self):
+        """Open the connection to the bulb, if it isn't open already."""
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self._ip, self._port), timeout=self.timeout
+                )
+            except (OSError, asyncio.TimeoutError):
+                raise BulbException("Could not connect to the bulb.")
+            self._attach(reader, writer)
+
+    def _attach(self, reader, writer):
+        """Start reading responses from a new connection."""
+        self._reader = reader
+        self._writer = writer
+        self._read_task = asyncio.ensure_future(self._read_loop(reader, writer))
+
+    async def _read_loop(self, reader, writer):
+        """Read lines from the bulb, resolving futures and applying notifications."""
+        try:
+            while True:
+                data = await reader.readline()
+                if not data:
+                    break
+
+                size = len(data)
+                data = data.strip()
+                if not data:
+                    continue
+
+                try:
+                    line = json.loads(data.decode("utf8"))
+                    _LOGGER.debug("%s < %s", self, line)
+                except ValueError:
+                    line = {"result": ["invalid command"]}
+
+                if line.get("method") == "props":
+                    self._set_properties(line["params"])
+                    continue
+
+                # Responses without an id are assumed to belong to the oldest command.
+                cmd_id = line.get("id", next(iter(self._futures), None))
+                future = self._futures.pop(cmd_id, None)
+                if future is not None and not future.done():
+                    future.set_result((line, size))
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if self._writer is writer:
+                self._drop_connection()
+
+    def _drop_connection(self):
+        """Forget the current connection and fail every command waiting on it."""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+        futures, self._futures = self._futures, {}
+        for future in futures.values():
+            if not future.done():
+                future.set_result(({"error": _CONNECTION_LOST}, 0))
+
+    async def close(self):
+        """Close the connection to the bulb."""
+        read_task = self._read_task
+        self._read_task = None
+        self._drop_connection()
+        if read_task is not None:
+            read_task.cancel()
+            try:
+                await read_task
+            except asyncio.CancelledError:
+                pass
+
+    async def ensure_on(self):
+        """Turn the bulb on if it is off."""
+        if self._music_mode is True or self.auto_on is False:
+            return
+
+        if not self._power_known():
+            await self.get_properties()
+
+        if self._last_properties["power"] != "on":
+            await self.turn_on()
+
+    async def get_properties(self, requested_properties=None, max_age=None):
+        """
+        Retrieve and return the properties of the bulb.
+
+        See :py:meth:`Bulb.get_properties <yeelight.Bulb.get_properties>`.
+
+        :returns: A dictionary of param: value items.
+        :rtype: dict
+        """
+        if self._music_mode:
+            return self._last_properties
+
+        lacking = ()
+        if requested_properties is None:
+            requested_properties, lacking = _property_set(self.model, self.support)
+
+        if max_age is None:
+            max_age = self.max_property_age
+        if max_age and self._is_fresh(requested_properties, max_age):
+            return self._last_properties
+
+        fetch = self._fetch
+        if fetch is not None and fetch.names.issuperset(requested_properties):
+            await fetch.done.wait()
+            if fetch.error is not None:
+                raise fetch.error
+            return self._last_properties
+
+        fetch = self._fetch = _PropertyFetch(requested_properties, asyncio.Event())
+        try:
+            response = await self.send_command("get_prop", requested_properties)
+            return self._update_properties(requested_properties, response["result"], lacking)
+        except Exception as ex:
+            fetch.error = ex
+            raise
+        finally:
+            if self._fetch is fetch:
+                self._fetch = None
+            fetch.done.set()
+
+    async def send_command(self, method, params=None):
+        """
+        Send a command to the bulb and wait for its response.
+
+        :param str method:  The name of the method to send.
+        :param list params: The list of parameters for the method.
+
+        :raises BulbException: When the bulb indicates an error condition, or
+                               doesn't support the method.
+        :returns: The response from the bulb.
+        """
+        self._check_supported(method)
+        if self.instrumentation is None:
+            return await self._send_command(method, params)
+
+        event = self.instrumentation.before(self, method, params)
+        try:
+            response = await self._send_command(method, params, event)
+        except Exception as ex:
+            self.instrumentation.after(event, error=ex)
+            raise
+        self.instrumentation.after(event, response=response)
+        return response
+
+    async def send_commands(self, commands):
+        """
+        Send several commands to the bulb at once and wait for every response.
+
+        See :py:meth:`Bulb.send_commands <yeelight.Bulb.send_commands>`.
+
+        :param list commands: A list of ``(method, params)`` tuples.
+
+        :raises BulbException: When the bulb indicates an error condition for
+                               any of the commands.
+        :returns: The list of responses from the bulb, in the same order.
+        """
+        for method, _ in commands:
+            self._check_supported(method)
+
+        if self.instrumentation is None:
+            events = [None] * len(commands)
+        else:
+            events = [self.instrumentation.before(self, method, params) for method, params in commands]
+
+        responses = await asyncio.gather(
+            *[self._send_command(method, params, event) for (method, params), event in zip(commands, events)],
+            return_exceptions=True,
+        )
+
+        error = None
+        for response, event in zip(responses, events):
+            if isinstance(response, BaseException):
+                error = error or response
+                if event is not None:
+                    self.instrumentation.after(event, error=response)
+            elif event is not None:
+                self.instrumentation.after(event, response=response)
+        if error is not None:
+            raise error
+        return responses
+
+    def start_listening(self, callback=None):
+        """
+        Not available on ``AsyncBulb``.
+
+        Notifications are already applied to :py:attr:`last_properties
+        <yeelight.Bulb.last_properties>` by the task reading the responses,
+        without a background thread.
+        """
+        raise TypeError("AsyncBulb reads notifications by itself, it has no listener thread.")
+
+    def stop_listening(self):
+        """Not available on ``AsyncBulb``, see :py:meth:`start_listening`."""
+        raise TypeError("AsyncBulb reads notifications by itself, it has no listener thread.")
+
+    async def _send_command(self, method, params, event=None):
+        """Send a command and wait for its response."""
+        if event is not None and self._writer is None:
+            connect_start = time.perf_counter()
+            try:
+                await self._connect()
+            finally:
+                event.connect_time += time.perf_counter() - connect_start
+        else:
+            await self._connect()
+
+        cmd_id = self._cmd_id
+        command = {"id": cmd_id, "method": method, "params": params}
+        _LOGGER.debug("%s > %s", self, command)
+
+        if not self._music_mode:
+            future = asyncio.get_running_loop().create_future()
+            self._futures[cmd_id] = future
+
+        data = _encode_command(cmd_id, method, params)
+        if event is not None:
+            event.attempts += 1
+            event.bytes_sent += len(data)
+        sent = time.perf_counter()
+
+        try:
+            self._writer.write(data)
+            await self._writer.drain()
+        except (OSError, AttributeError):
+            self._drop_connection()
+            raise BulbException("A socket error occurred when sending the command.")
+
+        if self._music_mode:
+            # We're in music mode, nothing else will happen.
+            return self._check_response(method, params, {"result": ["ok"]})
+
+        try:
+            response, size = await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self._futures.pop(cmd_id, None)
+            raise BulbException("The bulb did not respond in time.")
+
+        if event is not None:
+            event.rtt = time.perf_counter() - sent
+            event.bytes_received = size
+
+        return self._check_response(method, params, response)
+
+    def _run_command(self, method, params, auto_on=False):
+        return self._async_run_command(method, params, auto_on)
+
+    async def _async_run_command(self, method, params, auto_on):
+        if auto_on:
+            await self.ensure_on()
+
+        response = await self.send_command(method, params)
+        result = response.get("result", [])
+        if result:
+            return result[0]
+
+    async def start_music(self, port=0, ip=None):
+        """
+        Start music mode.
+
+        See :py:meth:`Bulb.start_music <yeelight.Bulb.start_music>`.
+
+        :param int port: The port to listen on. If none is specified, a random
+                         port will be chosen.
+
+        :param str ip: The IP address of the host this library is running on.
+                       Will be discovered automatically if not provided.
+        """
+        if self._music_mode:
+            raise AssertionError("Already in music mode, please stop music mode first.")
+
+        # Force populating the cache in case we are being called directly
+        # without ever fetching properties beforehand
+        await self.get_properties()
+
+        loop = asyncio.get_running_loop()
+        connected = loop.create_future()
+
+        def accept(reader, writer):
+            if connected.done():
+                writer.close()
+            else:
+                connected.set_result((reader, writer))
+
+        server = await asyncio.start_server(accept, host="", port=port, reuse_address=True)
+        try:
+            port = server.sockets[0].getsockname()[1]
+            local_ip = ip if ip else self._writer.get_extra_info("sockname")[0]
+            await self.send_command("set_music", [1, local_ip, port])
+            reader, writer = await asyncio.wait_for(connected, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise BulbException("The bulb did not connect back in time.")
+        finally:
+            server.close()
+
+        await self.close()
+        self._attach(reader, writer)
+        self._music_mode = True
+
+        return "ok"
+
+    async def stop_music(self, **kwargs):
+        """
+        Stop music mode.
+
+        See :py:meth:`Bulb.stop_music <yeelight.Bulb.stop_music>`.
+        """
+        await self.close()
+        return await Bulb.stop_music(self, **kwargs)
+
+
+class AsyncScheduler(object):
+    def __init__(self, late_threshold=0.05, loop=None):
+        """
+        Run functions and coroutines at given times, from an asyncio event loop.
+
+        The asyncio counterpart of :py:class:`Scheduler <yeelight.Scheduler>`,
+        with the same absolute deadlines on the :py:func:`time.monotonic`
+        clock. The timers live in the loop's own heap; no thread is used.
+
+        :param float late_threshold: Calls that start more than this many
+                                     seconds late are logged as warnings.
+                                     ``None`` never warns.
+        :param loop: The event loop to use. Defaults to the running loop.
+        """
+        self.late_threshold = late_threshold
+        self._loop = loop
+
+    def call_at(self, deadline, function, *args, **kwargs):
+        """
+        Call a function, or start a coroutine function, at the given time.
+
+        Must be called from the event loop.
+
+        :param float deadline: When to make the call, on the
+                               :py:func:`time.monotonic` clock.
+        :param callable function: The function or coroutine function to call.
+
+        :rtype: yeelight.ScheduledEvent
+        """
+        loop = self._loop or asyncio.get_running_loop()
+        event = ScheduledEvent(deadline, function, args, kwargs)
+        # The loop's clock may not be time.monotonic(), so convert the deadline.
+        when = loop.time() + (deadline - time.monotonic())
+        event._handle = loop.call_at(when, self._run, event)
+        return event
+
+    def call_later(self, delay, function, *args, **kwargs):
+        """
+        Call a function, or start a coroutine function, after the given delay.
+
+        :param float delay: The delay, in seconds.
+        :param callable function: The function or coroutine function to call.
+
+        :rtype: yeelight.ScheduledEvent
+        """
+        return self.call_at(time.monotonic() + delay, function, *args, **kwargs)
+
+    def _run(self, event):
+        if not asyncio.iscoroutinefunction(event.function):
+            event._run(self.late_threshold)
+            return
+
+        event._started(time.monotonic(), self.late_threshold)
+        task = asyncio.ensure_future(event.function(*event.args, **event.kwargs))
+        event._handle = task
+        task.add_done_callback(lambda task: self._finished(event, task))
+
+    @staticmethod
+    def _finished(event, task):
+        if task.cancelled():
+            event.cancelled = True
+        elif task.exception() is not None:
+            event.error = task.exception()
+            _LOGGER.error("Scheduled call to %s failed: %s", event.function, event.error)
+        else:
+            event.result = task.result()
+        event._done.set()
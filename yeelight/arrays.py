@@ -0,0 +1,246 @@
+"""
+Columnar storage for large numbers of transitions.
+
+This module needs `numpy <https://numpy.org>`_.
+"""
+
+import numpy as np
+
+from .colors import hsv_to_rgb_array
+from .flow import Action, Flow, RGBTransition, SleepTransition, TemperatureTransition
+
+#: The mode of color transitions, both RGB and HSV.
+MODE_COLOR = 1
+
+#: The mode of color temperature transitions.
+MODE_TEMPERATURE = 2
+
+#: The mode of sleep transitions.
+MODE_SLEEP = 7
+
+# The shortest transition the bulbs accept, in milliseconds.
+_MIN_DURATION = 50
+
+
+class TransitionArray(object):
+    def __init__(self, durations, modes, values, brightness):
+        """
+        Transitions stored as columns of integers, instead of one object each.
+
+        Building, clamping and encoding thousands of transitions are then a few
+        numpy operations. The values are stored as the bulb expects them: RGB
+        integers for colors (HSV colors are converted when they are added),
+        degrees Kelvin for color temperatures. Use the :py:meth:`rgb`,
+        :py:meth:`hsv`, :py:meth:`temperature` and :py:meth:`sleep` builders,
+        which clamp their inputs like the transition classes do.
+
+        Example:
+
+        >>> array = TransitionArray.hsv(np.linspace(0, 359, 1000), 100, durations=100)
+        >>> chain = FlowChain(bulb, array.to_flow(count=1))
+
+        :param durations:  The durations, in milliseconds.
+        :param modes:      The modes (:py:data:`MODE_COLOR`,
+                           :py:data:`MODE_TEMPERATURE` or :py:data:`MODE_SLEEP`).
+        :param values:     The values.
+        :param brightness: The brightness (1-100).
+        """
+        self.durations = np.array(durations, dtype=np.int32, ndmin=1)
+        size = len(self.durations)
+        self.modes = np.broadcast_to(np.asarray(modes, dtype=np.uint8), (size,)).copy()
+        self.values = np.broadcast_to(np.asarray(values, dtype=np.int32), (size,)).copy()
+        self.brightness = np.broadcast_to(np.asarray(brightness, dtype=np.int32), (size,)).copy()
+
+    @classmethod
+    def _build(cls, mode, values, durations, brightness):
+        values, durations, brightness = np.broadcast_arrays(values, durations, brightness)
+        return cls(durations, mode, values, brightness)
+
+    @classmethod
+    def rgb(cls, red, green, blue, durations=300, brightness=100):
+        """
+        Build RGB transitions.
+
+        :param red:        The values of red (0-255).
+        :param green:      The values of green (0-255).
+        :param blue:       The values of blue (0-255).
+        :param durations:  The durations, in milliseconds.
+        :param brightness: The brightness to transition to (1-100).
+
+        :rtype: yeelight.arrays.TransitionArray
+        """
+        red, green, blue = (np.clip(np.asarray(component, dtype=np.int64), 0, 255) for component in (red, green, blue))
+        return cls._build(MODE_COLOR, red * 65536 + green * 256 + blue, durations, brightness)
+
+    @classmethod
+    def hsv(cls, hue, saturation, durations=300, brightness=100):
+        """
+        Build HSV transitions, converted to RGB.
+
+        :param hue:        The color hues (0-359).
+        :param saturation: The color saturations (0-100).
+        :param durations:  The durations, in milliseconds.
+        :param brightness: The brightness to transition to (1-100).
+
+        :rtype: yeelight.arrays.TransitionArray
+        """
+        return cls._build(MODE_COLOR, hsv_to_rgb_array(hue, saturation), durations, brightness)
+
+    @classmethod
+    def temperature(cls, degrees, durations=300, brightness=100):
+        """
+        Build color temperature transitions.
+
+        :param degrees:    The color temperatures (1700-6500).
+        :param durations:  The durations, in milliseconds.
+        :param brightness: The brightness to transition to (1-100).
+
+        :rtype: yeelight.arrays.TransitionArray
+        """
+        degrees = np.clip(np.rint(np.asarray(degrees, dtype=float)), 1700, 6500)
+        return cls._build(MODE_TEMPERATURE, degrees, durations, np.clip(brightness, 1, 100))
+
+    @classmethod
+    def sleep(cls, durations):
+        """
+        Build sleep transitions.
+
+        :param durations: The durations, in milliseconds.
+
+        :rtype: yeelight.arrays.TransitionArray
+        """
+        # The value and brightness are ignored by the bulbs.
+        return cls(durations, MODE_SLEEP, 1, 2)
+
+    @classmethod
+    def from_transitions(cls, transitions):
+        """
+        Build an array from :py:class:`FlowTransition <yeelight.FlowTransition>` instances.
+
+        :param list transitions: The transitions.
+
+        :rtype: yeelight.arrays.TransitionArray
+        """
+        columns = np.array([transition.as_list() for transition in transitions], dtype=np.int64).reshape(-1, 4)
+        return cls(columns[:, 0], columns[:, 1], columns[:, 2], columns[:, 3])
+
+    @classmethod
+    def from_flow(cls, flow):
+        """
+        Build an array from the transitions of a :py:class:`Flow <yeelight.Flow>`.
+
+        :param yeelight.Flow flow: The flow.
+
+        :rtype: yeelight.arrays.TransitionArray
+        """
+        return cls.from_transitions(flow.transitions)
+
+    @classmethod
+    def concatenate(cls, arrays):
+        """
+        Join arrays, one after the other.
+
+        :param list arrays: The arrays.
+
+        :rtype: yeelight.arrays.TransitionArray
+        """
+        return cls(
+            np.concatenate([array.durations for array in arrays]),
+            np.concatenate([array.modes for array in arrays]),
+            np.concatenate([array.values for array in arrays]),
+            np.concatenate([array.brightness for array in arrays]),
+        )
+
+    def __len__(self):
+        return len(self.durations)
+
+    def __getitem__(self, index):
+        """Return a transition for an integer index, or an array for slices and index arrays."""
+        if isinstance(index, (int, np.integer)):
+            return self._transition(*self._columns()[index].tolist())
+        return TransitionArray(self.durations[index], self.modes[index], self.values[index], self.brightness[index])
+
+    def __iter__(self):
+        return iter(self.to_transitions())
+
+    def __repr__(self):
+        return "<%s of %s transitions>" % (self.__class__.__name__, len(self))
+
+    @property
+    def duration(self):
+        """
+        Return how long the transitions take, in milliseconds.
+
+        :rtype: int
+        """
+        return int(np.maximum(self.durations, _MIN_DURATION).sum(dtype=np.int64))
+
+    def clamped(self):
+        """
+        Return a copy with every column within what the bulbs accept.
+
+        :rtype: yeelight.arrays.TransitionArray
+        """
+        color = self.modes == MODE_COLOR
+        temperature = self.modes == MODE_TEMPERATURE
+        values = np.where(color, np.clip(self.values, 0, 0xFFFFFF), self.values)
+        values = np.where(temperature, np.clip(values, 1700, 6500), values)
+        brightness = np.where(self.modes == MODE_SLEEP, self.brightness, np.clip(self.brightness, 1, 100))
+        return TransitionArray(np.maximum(self.durations, _MIN_DURATION), self.modes, values, brightness)
+
+    def _columns(self):
+        """Return the transitions as an ``(n, 4)`` array, encoded like :py:meth:`FlowTransition.as_list`."""
+        return np.stack(
+            [
+                np.maximum(self.durations, _MIN_DURATION),
+                self.modes.astype(np.int32),
+                self.values,
+                np.minimum(self.brightness, 100),
+            ],
+            axis=-1,
+        )
+
+    @property
+    def expression(self):
+        """
+        Return a YeeLight-compatible expression that implements the transitions.
+
+        :rtype: str
+        """
+        return ", ".join(map(str, self._columns().ravel().tolist()))
+
+    @staticmethod
+    def _transition(duration, mode, value, brightness):
+        if mode == MODE_TEMPERATURE:
+            return TemperatureTransition(value, duration=duration, brightness=brightness)
+        if mode == MODE_SLEEP:
+            return SleepTransition(duration)
+        return RGBTransition(value >> 16, (value >> 8) & 0xFF, value & 0xFF, duration=duration, brightness=brightness)
+
+    def to_transitions(self):
+        """
+        Return the transitions as :py:class:`FlowTransition <yeelight.FlowTransition>` instances.
+
+        Colors become :py:class:`RGBTransition <yeelight.RGBTransition>`\\ s.
+
+        :rtype: list
+        """
+        return [self._transition(*row) for row in self._columns().tolist()]
+
+    def to_flow(self, count=0, action=Action.recover):
+        """
+        Return a :py:class:`Flow <yeelight.Flow>` of the transitions.
+
+        The flow reuses the expression encoded here. Flows of more transitions
+        than the bulbs accept can be played with a :py:class:`FlowChain
+        <yeelight.FlowChain>`.
+
+        :param int count: The number of times to run the flow (0 to run forever).
+        :param yeelight.flow.Action action: The action to take after the flow stops.
+
+        :rtype: yeelight.Flow
+        """
+        flow = Flow(count=count, action=action, transitions=self.to_transitions())
+        flow._cache("_expression", self.expression)
+        flow._cache("_duration", self.duration)
+        return flow
@@ -0,0 +1,317 @@
+"""
+Benchmarks of the library, run against simulated bulbs.
+
+Run ``python -m yeelight.benchmark -o results.json`` to measure the command
+throughput and latency of the blocking, pipelined, threaded and asyncio
+clients, the cost of :py:meth:`get_properties <yeelight.Bulb.get_properties>`
+and of encoding flows, and how long discovery takes for growing fleets. The
+results are written as JSON, so runs can be compared to track regressions.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+from .aio import AsyncBulb
+from .flow import Flow, HSVTransition, RGBTransition, SleepTransition, TemperatureTransition
+from .group import BulbGroup
+from .instrumentation import Instrumentation
+from .main import Bulb, _encode_command, discover_bulbs
+from .simulator import Simulator
+from .version import __version__
+
+
+def percentile(samples, fraction):
+    """
+    Return a percentile of sorted samples, interpolating between the closest ones.
+
+    :param list samples:   The samples, sorted.
+    :param float fraction: The percentile, from 0 to 1.
+
+    :rtype: float
+    """
+    if not samples:
+        return None
+    position = (len(samples) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(samples) - 1)
+    return samples[low] + (samples[high] - samples[low]) * (position - low)
+
+
+def summarize(latencies, elapsed):
+    """
+    Summarize the latencies of commands run in the given time.
+
+    :param list latencies: The latency of every command, in seconds.
+    :param float elapsed:  The wall time taken by all the commands, in seconds.
+
+    :returns: The throughput in commands per second, and the mean, p50, p95,
+              p99 and maximum latencies in milliseconds.
+    :rtype: dict
+    """
+    samples = sorted(latency * 1000 for latency in latencies)
+    return {
+        "count": len(samples),
+        "elapsed_s": elapsed,
+        "per_second": len(samples) / elapsed if elapsed else None,
+        "mean_ms": sum(samples) / len(samples) if samples else None,
+        "p50_ms": percentile(samples, 0.50),
+        "p95_ms": percentile(samples, 0.95),
+        "p99_ms": percentile(samples, 0.99),
+        "max_ms": samples[-1] if samples else None,
+    }
+
+
+def _timed(latencies, function, *args):
+    """Call a function, appending how long it took to ``latencies``."""
+    start = time.perf_counter()
+    result = function(*args)
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+def _set_bright(index):
+    return "set_bright", [index % 100 + 1, "sudden", 30]
+
+
+def _blocking_bulb(virtual, instrumentation=None):
+    bulb = Bulb(virtual.ip, virtual.port, instrumentation=instrumentation)
+    bulb.turn_on()
+    return bulb
+
+
+def bench_send_command(simulator, count, instrumentation=None):
+    """One command at a time, on one bulb."""
+    bulb = _blocking_bulb(simulator.bulbs[0], instrumentation)
+    latencies = []
+    start = time.perf_counter()
+    for index in range(count):
+        _timed(latencies, bulb.send_command, *_set_bright(index))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_send_commands(simulator, count, batch=10):
+    """Batches of pipelined commands, on one bulb. The latency is per batch."""
+    bulb = _blocking_bulb(simulator.bulbs[0])
+    latencies = []
+    start = time.perf_counter()
+    for first in range(0, count, batch):
+        commands = [_set_bright(index) for index in range(first, min(first + batch, count))]
+        _timed(latencies, bulb.send_commands, commands)
+    elapsed = time.perf_counter() - start
+
+    result = summarize(latencies, elapsed)
+    result.update({"batch": batch, "per_second": count / elapsed})
+    return result
+
+
+def bench_get_properties(simulator, count):
+    """Reading all the default properties, on one bulb."""
+    bulb = _blocking_bulb(simulator.bulbs[0])
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        _timed(latencies, bulb.get_properties)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_group(simulator, count):
+    """Commands sent to every bulb at once, from one thread per bulb."""
+    bulbs = [_blocking_bulb(virtual) for virtual in simulator.bulbs]
+    per_bulb = max(count // len(bulbs), 1)
+    latencies = []
+
+    def run(bulb):
+        for index in range(per_bulb):
+            _timed(latencies, bulb.send_command, *_set_bright(index))
+
+    with BulbGroup(bulbs) as group:
+        start = time.perf_counter()
+        group.map(run).raise_for_errors()
+        elapsed = time.perf_counter() - start
+
+    result = summarize(latencies, elapsed)
+    result["bulbs"] = len(bulbs)
+    return result
+
+
+def bench_async(simulator, count, in_flight=4):
+    """Commands sent to every bulb from one event loop, a few at a time per bulb."""
+    per_bulb = max(count // len(simulator.bulbs), 1)
+    latencies = []
+
+    async def timed(bulb, index):
+        start = time.perf_counter()
+        await bulb.send_command(*_set_bright(index))
+        latencies.append(time.perf_counter() - start)
+
+    async def drive(bulb):
+        await bulb.turn_on()
+        for first in range(0, per_bulb, in_flight):
+            await asyncio.gather(*(timed(bulb, index) for index in range(first, min(first + in_flight, per_bulb))))
+
+    async def run():
+        bulbs = [AsyncBulb(virtual.ip, virtual.port) for virtual in simulator.bulbs]
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(drive(bulb) for bulb in bulbs))
+            return time.perf_counter() - start
+        finally:
+            await asyncio.gather(*(bulb.close() for bulb in bulbs))
+
+    elapsed = asyncio.run(run())
+    # The latencies don't include turning the bulbs on, the elapsed time does.
+    result = summarize(latencies, elapsed)
+    result.update({"bulbs": len(simulator.bulbs), "in_flight": in_flight})
+    return result
+
+
+def bench_flow_expression(count):
+    """Encoding a flow of nine transitions, for the first time and again."""
+    transitions = [
+        RGBTransition(255, 0, 0, duration=500),
+        HSVTransition(120, 100, duration=500),
+        TemperatureTransition(2700, duration=500),
+        SleepTransition(500),
+    ] * 2 + [TemperatureTransition(6500, duration=500, brightness=50)]
+
+    def compile_flow():
+        return _encode_command(1, "start_cf", Flow(count=0, transitions=transitions).as_start_flow_params)
+
+    flow = Flow(count=0, transitions=transitions)
+    results = {}
+    for name, call in (
+        ("compile", compile_flow),
+        ("replay", lambda: _encode_command(1, "start_cf", flow.as_start_flow_params)),
+    ):
+        elapsed = timeit.timeit(call, number=count)
+        results[name] = {
+            "count": count,
+            "elapsed_s": elapsed,
+            "per_second": count / elapsed,
+            "mean_us": elapsed / count * 1e6,
+        }
+    return results
+
+
+class _UnsentBulb(Bulb):
+    """A bulb that prepares commands without sending them."""
+
+    def _run_command(self, method, params, auto_on=False):
+        return None
+
+
+def bench_command_wrapper(count):
+    """Preparing commands, without sending them."""
+    bulb = _UnsentBulb("127.0.0.1")
+    results = {}
+    for name, call in (
+        ("set_brightness", lambda: bulb.set_brightness(50)),
+        ("turn_on", lambda: bulb.turn_on()),
+        ("set_rgb", lambda: bulb.set_rgb(255, 128, 0)),
+    ):
+        elapsed = min(timeit.repeat(call, number=count, repeat=5))
+        results[name] = {"count": count, "elapsed_s": elapsed, "mean_us": elapsed / count * 1e6}
+    return results
+
+
+def bench_import(count=10):
+    """Importing the package, in a new interpreter every time."""
+    code = "import time; start = time.perf_counter(); import yeelight; print(time.perf_counter() - start)"
+    samples = sorted(float(subprocess.check_output([sys.executable, "-c", code])) for _ in range(count))
+    return {"count": count, "p50_ms": percentile(samples, 0.5) * 1000, "min_ms": samples[0] * 1000}
+
+
+def bench_discovery(sizes, **simulator_kwargs):
+    """The time to discover fleets of growing sizes."""
+    results = []
+    for size in sizes:
+        with Simulator(count=size, distinct_ips=True, **simulator_kwargs) as simulator:
+            start = time.perf_counter()
+            found = discover_bulbs(timeout=10, ssdp_address=simulator.ssdp_address, expected_count=size)
+            elapsed = time.perf_counter() - start
+        results.append({"bulbs": size, "found": len(found), "elapsed_s": elapsed})
+    return results
+
+
+def run(commands=1000, bulbs=10, fleet_sizes=(1, 10, 100, 1000), latency=0.0, jitter=0.0):
+    """
+    Run every benchmark.
+
+    :param int commands:     How many commands each benchmark sends.
+    :param int bulbs:        How many simulated bulbs the threaded and asyncio
+                             benchmarks drive.
+    :param list fleet_sizes: The fleet sizes to time discovery with.
+    :param float latency:    The simulated latency of the bulbs, in seconds.
+    :param float jitter:     The simulated latency jitter, in seconds.
+
+    :returns: The results, ready to be written as JSON.
+    :rtype: dict
+    """
+    # Benchmarks send far more than a real bulb's quota.
+    simulator_kwargs = {"latency": latency, "jitter": jitter, "rate_limit": None, "seed": 0}
+    results = {}
+    with Simulator(count=bulbs, distinct_ips=True, max_connections=16, **simulator_kwargs) as simulator:
+        results["send_command"] = bench_send_command(simulator, commands)
+        results["send_command_instrumented"] = bench_send_command(simulator, commands, Instrumentation())
+        results["send_commands"] = bench_send_commands(simulator, commands)
+        results["get_properties"] = bench_get_properties(simulator, commands)
+        results["group"] = bench_group(simulator, commands)
+        results["async"] = bench_async(simulator, commands)
+    results["flow_expression"] = bench_flow_expression(commands * 10)
+    results["command_wrapper"] = bench_command_wrapper(commands * 10)
+    results["import"] = bench_import()
+    results["discovery"] = bench_discovery(fleet_sizes, **simulator_kwargs)
+
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {
+            "commands": commands,
+            "bulbs": bulbs,
+            "fleet_sizes": list(fleet_sizes),
+            "latency": latency,
+            "jitter": jitter,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the yeelight library against simulated bulbs.")
+    parser.add_argument("-o", "--output", help="the file to write the JSON results to (default: stdout)")
+    parser.add_argument("-c", "--commands", type=int, default=1000, help="the number of commands per benchmark")
+    parser.add_argument("-b", "--bulbs", type=int, default=10, help="the number of bulbs driven concurrently")
+    parser.add_argument(
+        "-f", "--fleet-sizes", default="1,10,100,1000", help="comma-separated fleet sizes to time discovery with"
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="the simulated latency, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="the simulated latency jitter, in seconds")
+    args = parser.parse_args(argv)
+
+    report = run(
+        commands=args.commands,
+        bulbs=args.bulbs,
+        fleet_sizes=[int(size) for size in args.fleet_sizes.split(",")],
+        latency=args.latency,
+        jitter=args.jitter,
+    )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
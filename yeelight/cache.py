@@ -0,0 +1,256 @@
+"""A persistent cache of discovered bulbs."""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from .main import Bulb, discover_bulbs
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _default_path():
+    """Return the default location of the cache file."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "yeelight", "bulbs.json")
+
+
+class DiscoveryCache(object):
+    def __init__(self, path=None, ttl=24 * 60 * 60, timeout=2, interface=False):
+        """
+        A discovery cache, stored on disk and keyed by the bulbs' ids.
+
+        Discovery waits for the bulbs to answer a multicast request, which
+        takes seconds. The cache remembers the address, model, name and
+        supported methods of every bulb it has seen, so the next run can skip
+        discovery entirely. Entries older than ``ttl`` are still used, but
+        trigger a discovery in the background to refresh them.
+
+        Example:
+
+        >>> cache = DiscoveryCache()
+        >>> bulbs = cache.discover(expected_names=["bed", "kitchen 1"])
+        >>> bulb = cache.get_bulb("bed", auto_on=True)
+
+        :param str path:      The file to store the cache in. Defaults to
+                              ``$XDG_CACHE_HOME/yeelight/bulbs.json``.
+        :param int ttl:       How many seconds an entry stays fresh.
+        :param int timeout:   The timeout of discovery, when it is needed.
+        :param str interface: The interface to discover bulbs on, see
+                              :py:func:`discover_bulbs <yeelight.discover_bulbs>`.
+        """
+        self.path = path or _default_path()
+        self.ttl = ttl
+        self.timeout = timeout
+        self.interface = interface
+
+        self._lock = threading.RLock()
+        self._refresher = None  # The background refresh thread, if any.
+        self._entries = self._load()
+
+    def _load(self):
+        """Read the entries from disk, ignoring a missing or corrupt file."""
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        return entries if isinstance(entries, dict) else {}
+
+    def save(self):
+        """Write the entries to disk."""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            # Write to a temporary file first, so readers never see half a file.
+            temp_path = "%s.%s.tmp" % (self.path, os.getpid())
+            with open(temp_path, "w") as f:
+                json.dump(self._entries, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+    def update(self, bulbs):
+        """
+        Add or refresh entries from the result of a discovery.
+
+        :param list bulbs: Bulbs, as returned by :py:func:`discover_bulbs
+                           <yeelight.discover_bulbs>`.
+        """
+        now = time.time()
+        with self._lock:
+            for bulb in bulbs:
+                capabilities = bulb["capabilities"]
+                bulb_id = capabilities.get("id") or "%s:%s" % (bulb["ip"], bulb["port"])
+                self._entries[bulb_id] = {
+                    "ip": bulb["ip"],
+                    "port": bulb["port"],
+                    "model": capabilities.get("model"),
+                    "name": capabilities.get("name"),
+                    "support": capabilities.get("support", ""),
+                    "seen": now,
+                }
+
+    def invalidate(self, bulb_id):
+        """
+        Remove an entry, e.g. because its address is no longer valid.
+
+        :param str bulb_id: The id of the bulb.
+        """
+        with self._lock:
+            self._entries.pop(bulb_id, None)
+
+    def is_stale(self, bulb_id):
+        """
+        Return whether an entry is older than the TTL.
+
+        :param str bulb_id: The id of the bulb.
+        :rtype: bool
+        """
+        entry = self._entries.get(bulb_id)
+        return entry is None or time.time() - entry["seen"] > self.ttl
+
+    def bulbs(self):
+        """
+        Return every cached bulb, in the same format as :py:func:`discover_bulbs
+        <yeelight.discover_bulbs>`.
+
+        :rtype: list
+        """
+        with self._lock:
+            return [self._as_bulb(bulb_id, entry) for bulb_id, entry in sorted(self._entries.items())]
+
+    @staticmethod
+    def _as_bulb(bulb_id, entry):
+        capabilities = {"id": bulb_id, "model": entry["model"], "name": entry["name"], "support": entry["support"]}
+        return {"ip": entry["ip"], "port": entry["port"], "capabilities": capabilities}
+
+    def lookup(self, name):
+        """
+        Find a cached bulb by name.
+
+        :param str name: The name of the bulb.
+
+        :returns: The bulb, in the format of :py:func:`discover_bulbs
+                  <yeelight.discover_bulbs>`, or None if it isn't cached.
+        """
+        with self._lock:
+            for bulb_id, entry in self._entries.items():
+                if entry["name"] == name:
+                    return self._as_bulb(bulb_id, entry)
+        return None
+
+    def refresh(self, expected_names=None, expected_count=None):
+        """
+        Run a discovery and update the cache with its results.
+
+        :param list expected_names: Stop discovery as soon as these bulbs replied.
+        :param int expected_count: Stop discovery as soon as this many bulbs replied.
+
+        :returns: The bulbs that were discovered.
+        :rtype: list
+        """
+        bulbs = discover_bulbs(self.timeout, self.interface, expected_names, expected_count)
+        self.update(bulbs)
+        try:
+            self.save()
+        except (IOError, OSError) as ex:
+            _LOGGER.warning("Could not save the discovery cache to %s: %s", self.path, ex)
+        return bulbs
+
+    def refresh_in_background(self):
+        """Start a discovery in a background thread, unless one is running already."""
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+
+            self._refresher = threading.Thread(target=self.refresh, name="yeelight discovery cache refresh")
+            self._refresher.daemon = True
+            self._refresher.start()
+
+    def close(self, timeout=None):
+        """
+        Wait for a background refresh to finish, so its results are saved.
+
+        The refresh thread doesn't keep the program alive by itself, so call
+        this before exiting if the refreshed cache should be written.
+
+        :param float timeout: How many seconds to wait at most. Defaults to a
+                              bit more than the discovery timeout.
+        """
+        refresher = self._refresher
+        if refresher is not None:
+            refresher.join(self.timeout + 1 if timeout is None else timeout)
+
+    def discover(self, expected_names=None, expected_count=None):
+        """
+        Return the bulbs in the network, using the cache when it can.
+
+        The network is only searched when the cache can't satisfy the stop
+        conditions (or when none are given and the cache is empty). When some
+        of the cached entries are stale, they are returned anyway and refreshed
+        in the background.
+
+        :param list expected_names: The names of the bulbs the caller needs.
+        :param int expected_count: The number of bulbs the caller needs.
+
+        :returns: A list of bulbs, in the format of :py:func:`discover_bulbs
+                  <yeelight.discover_bulbs>`.
+        :rtype: list
+        """
+        bulbs = self.bulbs()
+        names = set(bulb["capabilities"]["name"] for bulb in bulbs)
+
+        if expected_names is not None:
+            satisfied = set(expected_names) <= names
+        elif expected_count is not None:
+            satisfied = len(bulbs) >= expected_count
+        else:
+            satisfied = len(bulbs) > 0
+
+        if not satisfied:
+            self.refresh(expected_names, expected_count)
+            return self.bulbs()
+
+        if any(self.is_stale(bulb["capabilities"]["id"]) for bulb in bulbs):
+            self.refresh_in_background()
+        return bulbs
+
+    def get_bulb(self, name, **kwargs):
+        """
+        Return a connected :py:class:`Bulb <yeelight.Bulb>` for the named bulb.
+
+        If the cached address refuses the connection, the bulb has probably
+        moved, so it is discovered again.
+
+        :param str name: The name of the bulb.
+        :param kwargs:   Keyword arguments for :py:class:`Bulb <yeelight.Bulb>`.
+
+        :returns: The bulb, or None if no bulb with that name can be found.
+        :rtype: yeelight.Bulb
+        """
+        bulb = self.lookup(name)
+        if bulb is None:
+            self.refresh(expected_names=[name])
+            bulb = self.lookup(name)
+            if bulb is None:
+                return None
+
+        kwargs.setdefault("capabilities", bulb["capabilities"])
+        connection = Bulb(bulb["ip"], bulb["port"], **kwargs)
+        try:
+            connection._socket
+        except socket.error:
+            _LOGGER.info("Cached address of %s (%s) is not reachable, rediscovering", name, bulb["ip"])
+            self.invalidate(bulb["capabilities"]["id"])
+            self.refresh(expected_names=[name])
+            bulb = self.lookup(name)
+            if bulb is None:
+                return None
+            connection = Bulb(bulb["ip"], bulb["port"], **kwargs)
+
+        return connection
@@ -0,0 +1,281 @@
+"""
+Color conversions, one value at a time or in batches.
+
+The functions on single values are plain Python, and keep what they compute in
+lookup tables. The ``_array`` functions convert whole arrays at once and need
+`numpy <https://numpy.org>`_.
+
+Colors are RGB integers, as the bulbs expect them (``red * 65536 + green * 256
++ blue``), hues go from 0 to 359 and saturations from 0 to 100.
+"""
+
+import colorsys
+import math
+
+from .utils import _clamp
+
+# The colors of the integer hues and saturations, filled as they are used.
+_HSV_LUT = {}
+
+# The arrays of the integer hues and saturations, and of the integer color
+# temperatures, built when they are first used.
+_HSV_ARRAY_LUT = None
+_KELVIN_ARRAY_LUT = None
+
+# The color temperatures the blackbody fit holds for.
+_MIN_KELVIN = 1000
+_MAX_KELVIN = 40000
+
+
+def _hsv_to_rgb(hue, saturation):
+    hue = _clamp(hue, 0, 359) / 359.0
+    saturation = _clamp(saturation, 0, 100) / 100.0
+    red, green, blue = [int(round(col * 255)) for col in colorsys.hsv_to_rgb(hue, saturation, 1)]
+    return red * 65536 + green * 256 + blue
+
+
+def hsv_to_rgb(hue, saturation):
+    """
+    Convert a fully bright HSV color to an RGB integer.
+
+    :param hue:        The hue (0-359).
+    :param saturation: The saturation (0-100).
+
+    :rtype: int
+    """
+    rgb = _HSV_LUT.get((hue, saturation))
+    if rgb is None:
+        rgb = _hsv_to_rgb(hue, saturation)
+        if type(hue) is int and type(saturation) is int and 0 <= hue <= 359 and 0 <= saturation <= 100:
+            _HSV_LUT[hue, saturation] = rgb
+    return rgb
+
+
+def rgb_to_hsv(rgb):
+    """
+    Convert an RGB integer to HSV.
+
+    :param int rgb: The color.
+
+    :returns: The hue (0-360), saturation (0-100) and value (0-100).
+    :rtype: tuple
+    """
+    hue, saturation, value = colorsys.rgb_to_hsv((rgb >> 16) & 0xFF, (rgb >> 8) & 0xFF, rgb & 0xFF)
+    return hue * 360.0, saturation * 100.0, value / 2.55
+
+
+def kelvin_to_rgb(kelvin):
+    """
+    Return the color of a black body at the given temperature, as an RGB integer.
+
+    Uses Tanner Helland's fit of the blackbody locus, which holds from 1000 to
+    40000 K. Strips and other bulbs without color temperatures can show it.
+
+    :param kelvin: The temperature, in degrees Kelvin.
+
+    :rtype: int
+    """
+    t = _clamp(kelvin, _MIN_KELVIN, _MAX_KELVIN) / 100.0
+    if t > 66:
+        red = 329.698727446 * (t - 60) ** -0.1332047592
+        green = 288.1221695283 * (t - 60) ** -0.0755148492
+    else:
+        red = 255.0
+        green = 99.4708025861 * math.log(t) - 161.1195681661
+    if t >= 66:
+        blue = 255.0
+    elif t <= 19:
+        blue = 0.0
+    else:
+        blue = 138.5177312231 * math.log(t - 10) - 305.0447927307
+    red, green, blue = (int(round(_clamp(component, 0.0, 255.0))) for component in (red, green, blue))
+    return red * 65536 + green * 256 + blue
+
+
+def _perceived_brightness(lightness):
+    # Invert CIE L*, the perceived lightness, to a relative luminance.
+    lightness = _clamp(lightness, 0.0, 100.0)
+    if lightness > 8:
+        luminance = ((lightness + 16) / 116.0) ** 3
+    else:
+        luminance = lightness / 903.3
+    return max(1, int(round(luminance * 100)))
+
+
+# The brightness of the integer lightnesses.
+_BRIGHTNESS_LUT = [_perceived_brightness(lightness) for lightness in range(101)]
+
+
+def perceived_brightness(lightness):
+    """
+    Return the brightness that looks ``lightness`` percent as bright as the full brightness.
+
+    The bulbs' brightness is proportional to the light they give, but the eye
+    sees light on a roughly logarithmic scale, so fades with evenly spaced
+    brightness seem to rush at the dark end. Fading through evenly spaced
+    lightnesses (CIE L*) looks even instead.
+
+    :param lightness: The perceived lightness (0-100).
+
+    :returns: The brightness (1-100).
+    :rtype: int
+    """
+    if type(lightness) is int and 0 <= lightness <= 100:
+        return _BRIGHTNESS_LUT[lightness]
+    return _perceived_brightness(lightness)
+
+
+def pack_rgb(red, green, blue):
+    """
+    Pack arrays of red, green and blue components (0-255) into RGB integers.
+
+    :rtype: numpy.ndarray
+    """
+    import numpy as np
+
+    red, green, blue = (np.clip(np.rint(component), 0, 255).astype(np.int64) for component in (red, green, blue))
+    return red * 65536 + green * 256 + blue
+
+
+def unpack_rgb(rgb):
+    """
+    Split an array of RGB integers into red, green and blue components.
+
+    :rtype: tuple
+    """
+    import numpy as np
+
+    rgb = np.asarray(rgb, dtype=np.int64)
+    return (rgb >> 16) & 0xFF, (rgb >> 8) & 0xFF, rgb & 0xFF
+
+
+def _hsv_to_rgb_array(hue, saturation):
+    import numpy as np
+
+    # colorsys.hsv_to_rgb, vectorised.
+    h = np.clip(hue, 0, 359) / 359.0 * 6.0
+    s = np.clip(saturation, 0, 100) / 100.0
+    sector = np.floor(h)
+    f = h - sector
+    sector = sector.astype(int) % 6
+    p = 1.0 - s
+    q = 1.0 - s * f
+    t = 1.0 - s * (1.0 - f)
+    one = np.ones_like(s)
+
+    red = np.choose(sector, [one, q, p, p, t, one])
+    green = np.choose(sector, [t, one, one, q, p, p])
+    blue = np.choose(sector, [p, p, t, one, one, q])
+    return pack_rgb(red * 255, green * 255, blue * 255)
+
+
+def hsv_to_rgb_array(hue, saturation):
+    """
+    Convert arrays of fully bright HSV colors to RGB integers.
+
+    Integer arrays are looked up in a table of every hue and saturation; other
+    arrays are converted. Both give the same colors as :py:func:`hsv_to_rgb`.
+
+    :param hue:        The hues (0-359).
+    :param saturation: The saturations (0-100).
+
+    :rtype: numpy.ndarray
+    """
+    global _HSV_ARRAY_LUT
+    import numpy as np
+
+    hue, saturation = np.broadcast_arrays(np.asarray(hue), np.asarray(saturation))
+    if hue.dtype.kind not in "iu" or saturation.dtype.kind not in "iu":
+        return _hsv_to_rgb_array(hue.astype(float), saturation.astype(float))
+
+    if _HSV_ARRAY_LUT is None:
+        grid = np.meshgrid(np.arange(360.0), np.arange(101.0), indexing="ij")
+        _HSV_ARRAY_LUT = _hsv_to_rgb_array(*grid)
+    return _HSV_ARRAY_LUT[np.clip(hue, 0, 359), np.clip(saturation, 0, 100)]
+
+
+def rgb_to_hsv_array(red, green, blue):
+    """
+    Convert arrays of red, green and blue components to HSV.
+
+    :param red:   The red components (0-255).
+    :param green: The green components (0-255).
+    :param blue:  The blue components (0-255).
+
+    :returns: The hue (0-360), saturation (0-100) and value (0-100) arrays.
+    :rtype: tuple
+    """
+    import numpy as np
+
+    red, green, blue = np.broadcast_arrays(*(np.asarray(component, dtype=float) for component in (red, green, blue)))
+    high = np.maximum(np.maximum(red, green), blue)
+    delta = high - np.minimum(np.minimum(red, green), blue)
+    safe = np.where(delta == 0, 1.0, delta)
+
+    hue = np.where(
+        high == red,
+        (green - blue) / safe % 6,
+        np.where(high == green, (blue - red) / safe + 2, (red - green) / safe + 4),
+    )
+    hue = np.where(delta == 0, 0.0, hue * 60.0)
+    saturation = np.where(high == 0, 0.0, delta / np.where(high == 0, 1.0, high) * 100.0)
+    return hue, saturation, high / 2.55
+
+
+def blackbody_array(kelvin):
+    """
+    Return the colors of black bodies at the given temperatures, as components.
+
+    The fit is the one :py:func:`kelvin_to_rgb` uses, without rounding.
+
+    :param kelvin: The temperatures, in degrees Kelvin.
+
+    :returns: The red, green and blue arrays (0-255), as floats.
+    :rtype: tuple
+    """
+    import numpy as np
+
+    t = np.clip(np.asarray(kelvin, dtype=float), _MIN_KELVIN, _MAX_KELVIN) / 100.0
+    hot = t > 66
+    # Keep the unused branches of np.where finite.
+    above = np.maximum(t - 60, 1.0)
+    red = np.where(hot, 329.698727446 * above ** -0.1332047592, 255.0)
+    green = np.where(hot, 288.1221695283 * above ** -0.0755148492, 99.4708025861 * np.log(t) - 161.1195681661)
+    blue = np.where(t >= 66, 255.0, 138.5177312231 * np.log(np.maximum(t - 10, 1.0)) - 305.0447927307)
+    blue = np.where(t <= 19, 0.0, blue)
+    return tuple(np.clip(component, 0, 255) for component in (red, green, blue))
+
+
+def kelvin_to_rgb_array(kelvin):
+    """
+    Convert arrays of color temperatures to RGB integers, from a table of every integer temperature.
+
+    :param kelvin: The temperatures, in degrees Kelvin (1000-40000).
+
+    :rtype: numpy.ndarray
+    """
+    global _KELVIN_ARRAY_LUT
+    import numpy as np
+
+    if _KELVIN_ARRAY_LUT is None:
+        _KELVIN_ARRAY_LUT = pack_rgb(*blackbody_array(np.arange(_MIN_KELVIN, _MAX_KELVIN + 1)))
+    index = np.clip(np.rint(np.asarray(kelvin, dtype=float)), _MIN_KELVIN, _MAX_KELVIN).astype(np.int64)
+    return _KELVIN_ARRAY_LUT[index - _MIN_KELVIN]
+
+
+def perceived_brightness_array(lightness):
+    """
+    Return the brightness that looks ``lightness`` percent as bright as the full brightness, for arrays.
+
+    See :py:func:`perceived_brightness`.
+
+    :param lightness: The perceived lightnesses (0-100).
+
+    :returns: The brightness (1-100).
+    :rtype: numpy.ndarray
+    """
+    import numpy as np
+
+    lightness = np.clip(np.asarray(lightness, dtype=float), 0.0, 100.0)
+    luminance = np.where(lightness > 8, ((lightness + 16) / 116.0) ** 3, lightness / 903.3)
+    return np.maximum(np.rint(luminance * 100), 1).astype(np.int64)
@@ -0,0 +1,182 @@
+"""Connection management for the bulbs' control sockets."""
+
+import logging
+import random
+import socket
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ConnectionStats(object):
+    """Counters describing the life of a bulb's connection."""
+
+    def __init__(self):
+        #: The number of successful connections.
+        self.connects = 0
+        #: The number of successful connections after the first one.
+        self.reconnects = 0
+        #: The number of connection attempts that failed.
+        self.connect_failures = 0
+        #: The number of times a connection was closed or lost.
+        self.disconnects = 0
+        #: The number of commands that were sent again after a failure.
+        self.retries = 0
+        #: When the last connection was made (seconds since the epoch).
+        self.last_connect_time = None
+        #: When the last reconnection was made (seconds since the epoch).
+        self.last_reconnect_time = None
+        #: When the connection was last closed or lost (seconds since the epoch).
+        self.last_disconnect_time = None
+
+    def as_dict(self):
+        """
+        Return the counters as a dictionary.
+
+        :rtype: dict
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.as_dict())
+
+
+class ConnectionManager(object):
+    #: Methods that leave the bulb in the same state when sent twice.
+    IDEMPOTENT_METHODS = frozenset(
+        prefix + method
+        for prefix in ("", "bg_")
+        for method in (
+            "get_prop",
+            "set_ct_abx",
+            "set_rgb",
+            "set_hsv",
+            "set_bright",
+            "set_power",
+            "set_default",
+            "set_name",
+            "stop_cf",
+            "set_scene",
+            "cron_get",
+            "cron_del",
+        )
+    )
+
+    def __init__(
+        self,
+        connect_timeout=5,
+        read_timeout=5,
+        keepalive=True,
+        retries=2,
+        backoff=0.5,
+        max_backoff=10,
+    ):
+        """
+        Open, keep alive and reopen a bulb's control connection.
+
+        Every :py:class:`Bulb <yeelight.Bulb>` has its own manager, which also
+        keeps the :py:class:`ConnectionStats <yeelight.ConnectionStats>` of that
+        bulb. Failed connection attempts are retried after a jittered,
+        exponentially growing delay. Commands that are safe to repeat (see
+        ``IDEMPOTENT_METHODS``) are sent again, up to ``retries`` times, when the
+        connection is lost before their response arrives.
+
+        :param float connect_timeout: How many seconds to wait for a connection.
+        :param float read_timeout:    How many seconds to wait for a response.
+        :param bool keepalive:        Whether to enable TCP keep-alive, so dead
+                                      connections are noticed while idle.
+        :param int retries:           How many times to retry connecting, and
+                                      sending an idempotent command.
+        :param float backoff:         The delay before the first retry, in seconds.
+        :param float max_backoff:     The longest delay between retries, in seconds.
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive = keepalive
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.stats = ConnectionStats()
+
+    def delay(self, attempt):
+        """
+        Return how long to wait before the given retry.
+
+        :param int attempt: The number of the retry, starting at 0.
+
+        :returns: The delay in seconds.
+        :rtype: float
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def connect(self, ip, port):
+        """
+        Open a connection, retrying with backoff if it fails.
+
+        :param str ip:   The IP of the bulb.
+        :param int port: The port to connect to on the bulb.
+
+        :raises socket.error: When every attempt failed.
+        :returns: The connected socket.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                sock = socket.create_connection((ip, port), timeout=self.connect_timeout)
+            except socket.error as ex:
+                self.stats.connect_failures += 1
+                if attempt == self.retries:
+                    raise
+                delay = self.delay(attempt)
+                _LOGGER.debug("Connecting to %s:%s failed (%s), retrying in %.2fs", ip, port, ex, delay)
+                time.sleep(delay)
+            else:
+                break
+
+        sock.settimeout(self.read_timeout)
+        if self.keepalive:
+            self._enable_keepalive(sock)
+
+        now = time.time()
+        if self.stats.connects:
+            self.stats.reconnects += 1
+            self.stats.last_reconnect_time = now
+            _LOGGER.info("Reconnected to %s:%s (%s reconnects so far)", ip, port, self.stats.reconnects)
+        self.stats.connects += 1
+        self.stats.last_connect_time = now
+        return sock
+
+    @staticmethod
+    def _enable_keepalive(sock, idle=10, interval=5, count=3):
+        """Enable TCP keep-alive probes, with short intervals where the platform allows it."""
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Linux names the idle option TCP_KEEPIDLE, macOS names it TCP_KEEPALIVE.
+        for name, value in (
+            ("TCP_KEEPIDLE", idle),
+            ("TCP_KEEPALIVE", idle),
+            ("TCP_KEEPINTVL", interval),
+            ("TCP_KEEPCNT", count),
+        ):
+            option = getattr(socket, name, None)
+            if option is not None:
+                try:
+                    sock.setsockopt(socket.IPPROTO_TCP, option, value)
+                except socket.error:
+                    pass
+
+    def disconnected(self):
+        """Record that the connection was closed or lost."""
+        self.stats.disconnects += 1
+        self.stats.last_disconnect_time = time.time()
+
+    def can_retry(self, method, attempt):
+        """
+        Return whether a command should be sent again after losing the connection.
+
+        :param str method:  The name of the method.
+        :param int attempt: How many times the command has been retried already.
+
+        :rtype: bool
+        """
+        return method in self.IDEMPOTENT_METHODS and attempt < self.retries
@@ -1,12 +1,15 @@
-import colorsys
 import logging
 from enum import Enum
 from itertools import chain
 
+from .colors import hsv_to_rgb
 from .utils import _clamp
 
 _LOGGER = logging.getLogger(__name__)
 
+# The number of transitions the bulbs accept in a single flow.
+MAX_TRANSITIONS = 9
+
 
 class Action(Enum):
     """
@@ -21,7 +24,37 @@ class Action(Enum):
     off = 2
 
 
-class Flow(object):
+class _Immutable(object):
+    """A base for objects that can't be changed once created, so what is computed from them can be cached."""
+
+    _frozen = False
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError("%s objects can't be changed, create a new one instead." % self.__class__.__name__)
+        object.__setattr__(self, name, value)
+
+    def _cache(self, name, value):
+        """Keep a value computed from the object."""
+        object.__setattr__(self, name, value)
+        return value
+
+
+class _FlowParams(tuple):
+    """
+    The params of a start_cf command.
+
+    They keep the JSON encoding of the commands that send them, so sending the
+    same flow again only has to encode the command id.
+    """
+
+    def __new__(cls, values):
+        params = tuple.__new__(cls, values)
+        params.encoded = {}  # Method -> the encoded command, without the id.
+        return params
+
+
+class Flow(_Immutable):
     actions = Action
 
     def __init__(self, count=0, action=Action.recover, transitions=None):
@@ -43,17 +76,22 @@ class Flow(object):
         :param list transitions: A list of :py:class:`FlowTransition
                                  <yeelight.FlowTransition>` instances that
                                  describe the flow transitions to perform.
+
+        Flows can't be changed once created. They are encoded once, so the same
+        flow can be started on many bulbs, or many times, for almost nothing.
         """
         if transitions is None:
             transitions = []
         self.count = count
         self.action = action
-        self.transitions = transitions
+        self.transitions = tuple(transitions)
+        self._frozen = True
 
         # Note, main depends on us, so we cannot import BulbException here.
-        if len(self.transitions) > 9:
+        if len(self.transitions) > MAX_TRANSITIONS:
             _LOGGER.warning(
-                "The bulb seems to support up to 9 transitions. Your %s might fail." % len(self.transitions)
+                "The bulb seems to support up to %s transitions. Your %s might fail, "
+                "consider a yeelight.FlowChain instead." % (MAX_TRANSITIONS, len(self.transitions))
             )
 
     @property
@@ -61,24 +99,84 @@ class Flow(object):
         """
         Return a YeeLight-compatible expression that implements this flow.
 
+        :rtype: str
+        """
+        try:
+            return self._expression
+        except AttributeError:
+            pass
+        expr = chain.from_iterable(transition._as_tuple() for transition in self.transitions)
+        return self._cache("_expression", ", ".join(str(value) for value in expr))
+
+    @property
+    def duration(self):
+        """
+        Return how long one run of this flow takes, in milliseconds.
+
+        :rtype: int
+        """
+        try:
+            return self._duration
+        except AttributeError:
+            pass
+        return self._cache("_duration", sum(transition._as_tuple()[0] for transition in self.transitions))
+
+    def segments(self, size=MAX_TRANSITIONS):
+        """
+        Split this flow into flows the bulb can run, of at most ``size`` transitions each.
+
+        Started one after another, every ``duration`` milliseconds, the
+        segments play the same transitions as this flow. Every segment but the
+        last stays at its final state, so the next one continues from there;
+        the last one takes this flow's action (so ``recover`` goes back to the
+        state before the last segment). A flow that runs forever (``count`` 0)
+        is split into one run, which is up to the caller to repeat. A flow that
+        is short enough is returned as it is.
+
+        :param int size: The maximum number of transitions per segment.
+
         :rtype: list
         """
-        expr = chain.from_iterable(transition.as_list() for transition in self.transitions)
-        expr = ", ".join(str(value) for value in expr)
-        return expr
+        if len(self.transitions) <= size:
+            return [self]
+
+        transitions = list(self.transitions) * max(self.count, 1)
+        chunks = [transitions[i : i + size] for i in range(0, len(transitions), size)]
+        last_action = Action.stay if self.count == 0 else self.action
+        return [
+            Flow(count=1, action=last_action if i == len(chunks) - 1 else Action.stay, transitions=chunk)
+            for i, chunk in enumerate(chunks)
+        ]
 
     @property
     def as_start_flow_params(self):
         """
         Return a YeeLight start_cf compatible params
 
-        :rtype: list
+        :rtype: tuple
         """
-        return self.count * len(self.transitions), self.action.value, self.expression
+        try:
+            return self._params
+        except AttributeError:
+            pass
+        params = _FlowParams((self.count * len(self.transitions), self.action.value, self.expression))
+        return self._cache("_params", params)
 
 
-class FlowTransition(object):
-    """A single transition in the flow."""
+class FlowTransition(_Immutable):
+    """A single transition in the flow. Transitions can't be changed once created."""
+
+    def _freeze(self):
+        """Encode the transition, and prevent it from changing."""
+        brightness = min(int(self.brightness), 100)
+        # Duration must be at least 50, otherwise there's an error.
+        self._tuple = (max(50, self.duration), self._mode, self._value, brightness)
+        self._frozen = True
+
+    def _as_tuple(self):
+        if not self._frozen:
+            self._freeze()
+        return self._tuple
 
     def as_list(self):
         """
@@ -86,9 +184,7 @@ class FlowTransition(object):
 
         :rtype: list
         """
-        brightness = min(int(self.brightness), 100)
-        # Duration must be at least 50, otherwise there's an error.
-        return [max(50, self.duration), self._mode, self._value, brightness]
+        return list(self._as_tuple())
 
 
 class RGBTransition(FlowTransition):
@@ -112,6 +208,7 @@ class RGBTransition(FlowTransition):
 
         self.duration = duration
         self.brightness = brightness
+        self._freeze()
 
     @property
     def _value(self):
@@ -151,15 +248,12 @@ class HSVTransition(FlowTransition):
 
         self.duration = duration
         self.brightness = brightness
+        self._freeze()
 
     @property
     def _value(self):
         """The YeeLight-compatible value for this transition."""
-        hue = _clamp(self.hue, 0, 359) / 359.0
-        saturation = max(0, min(100, self.saturation)) / 100.0
-
-        red, green, blue = [int(round(col * 255)) for col in colorsys.hsv_to_rgb(hue, saturation, 1)]
-        return red * 65536 + green * 256 + blue
+        return hsv_to_rgb(self.hue, self.saturation)
 
     def __repr__(self):
         return "<%s(%s,%s) duration %s, brightness %s>" % (
@@ -189,6 +283,7 @@ class TemperatureTransition(FlowTransition):
 
         self.duration = duration
         self.brightness = _clamp(brightness, 1, 100)
+        self._freeze()
 
     @property
     def _value(self):
@@ -220,6 +315,7 @@ class SleepTransition(FlowTransition):
         self.brightness = 2
 
         self.duration = duration
+        self._freeze()
 
     def __repr__(self):
         return "<%s: duration %s>" % (self.__class__.__name__, self.duration)
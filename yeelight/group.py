@@ -0,0 +1,125 @@
+"""Control many bulbs at once."""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .main import Bulb
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class GroupResult(object):
+    def __init__(self, results, errors):
+        """
+        The outcome of a command sent to a group of bulbs.
+
+        :param dict results: Bulb -> the value the command returned, for every
+                             bulb that succeeded.
+        :param dict errors:  Bulb -> the exception the command raised, for
+                             every bulb that failed.
+        """
+        self.results = results
+        self.errors = errors
+
+    @property
+    def ok(self):
+        """
+        Return whether the command succeeded on every bulb.
+
+        :rtype: bool
+        """
+        return not self.errors
+
+    def raise_for_errors(self):
+        """Re-raise the first error, if the command failed on any bulb."""
+        for error in self.errors.values():
+            raise error
+
+    def __repr__(self):
+        return "<%s: %s ok, %s failed>" % (self.__class__.__name__, len(self.results), len(self.errors))
+
+
+class BulbGroup(object):
+    def __init__(self, bulbs, max_workers=None):
+        """
+        A group of bulbs that are controlled together.
+
+        The group has the same methods as :py:class:`Bulb <yeelight.Bulb>`.
+        Calling one calls it on every bulb at the same time, so the whole group
+        changes in about the time one bulb takes. Each call returns a
+        :py:class:`GroupResult <yeelight.GroupResult>` with the per-bulb
+        results and errors; an error on one bulb doesn't stop the others.
+
+        Example:
+
+        >>> group = BulbGroup(registry.get(name) for name in ["kitchen 1", "kitchen 2"])
+        >>> group.set_color_temp(2700).ok
+        True
+
+        :param list bulbs:      The :py:class:`Bulb <yeelight.Bulb>` instances
+                                in the group. ``None`` entries (e.g. bulbs that
+                                weren't found) are skipped.
+        :param int max_workers: The maximum number of bulbs to talk to at the
+                                same time. Defaults to the size of the group.
+        """
+        self.bulbs = [bulb for bulb in bulbs if bulb is not None]
+        self.max_workers = max_workers or max(len(self.bulbs), 1)
+        self._executor = None
+
+    def __len__(self):
+        return len(self.bulbs)
+
+    def __iter__(self):
+        return iter(self.bulbs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker threads of the group."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def map(self, function, *args, **kwargs):
+        """
+        Call a function with every bulb in the group, concurrently.
+
+        :param callable function: The function to call. It receives the bulb
+                                  as its first argument, followed by ``args``
+                                  and ``kwargs``.
+
+        :rtype: yeelight.GroupResult
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        futures = [(bulb, self._executor.submit(function, bulb, *args, **kwargs)) for bulb in self.bulbs]
+
+        results = {}
+        errors = {}
+        for bulb, future in futures:
+            try:
+                results[bulb] = future.result()
+            except Exception as ex:
+                _LOGGER.debug("%s failed: %s", bulb, ex)
+                errors[bulb] = ex
+        return GroupResult(results, errors)
+
+    def __getattr__(self, name):
+        method = getattr(Bulb, name, None)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+
+        def call(*args, **kwargs):
+            return self.map(lambda bulb: getattr(bulb, name)(*args, **kwargs))
+
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+    def __repr__(self):
+        return "%s<%s>" % (self.__class__.__name__, ", ".join(repr(bulb) for bulb in self.bulbs))
@@ -0,0 +1,364 @@
+"""Hooks, counters and latency histograms for the commands sent to the bulbs."""
+
+import atexit
+import json
+import logging
+import math
+import sys
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CommandEvent(object):
+    """
+    A command sent to a bulb, as seen by instrumentation hooks.
+
+    The pre hooks get the event before anything is sent, so only ``bulb``,
+    ``method``, ``params_size`` and ``start`` are set. The post hooks get it
+    once the command has returned or raised.
+    """
+
+    __slots__ = (
+        "bulb",
+        "method",
+        "params_size",
+        "start",
+        "bytes_sent",
+        "bytes_received",
+        "connect_time",
+        "wait_time",
+        "rtt",
+        "duration",
+        "attempts",
+        "coalesced",
+        "error",
+    )
+
+    def __init__(self, bulb, method, params):
+        #: The :py:class:`Bulb <yeelight.Bulb>` the command was sent to.
+        self.bulb = bulb
+        #: The name of the method.
+        self.method = method
+        #: The size of the JSON-encoded parameters, in bytes.
+        self.params_size = len(json.dumps(params))
+        #: When the command started, on the :py:func:`time.perf_counter` clock.
+        self.start = time.perf_counter()
+        #: How many bytes were written to the connection, over every attempt.
+        self.bytes_sent = 0
+        #: How many bytes the response took.
+        self.bytes_received = 0
+        #: How many seconds were spent opening the connection.
+        self.connect_time = 0.0
+        #: How many seconds were spent waiting for the rate limiter.
+        self.wait_time = 0.0
+        #: Seconds between sending the command and receiving its response, or
+        #: None if no response was received (e.g. in music mode).
+        self.rtt = None
+        #: How many seconds the whole command took.
+        self.duration = None
+        #: How many times the command was sent.
+        self.attempts = 0
+        #: Whether the rate limiter replaced the command with a newer one.
+        self.coalesced = False
+        #: The class name of the exception the command raised, or of the
+        #: error the bulb answered with, if any.
+        self.error = None
+
+    def as_dict(self):
+        """
+        Return the event as a dictionary, without the bulb.
+
+        :rtype: dict
+        """
+        return {name: getattr(self, name) for name in self.__slots__ if name != "bulb"}
+
+    def __repr__(self):
+        return "<%s %s %s>" % (self.__class__.__name__, self.bulb, self.as_dict())
+
+
+class LatencyHistogram(object):
+    def __init__(self, significant_figures=2):
+        """
+        A histogram of latencies with a bounded relative error, like HdrHistogram.
+
+        Latencies are counted in microseconds, in buckets that are linear
+        within each power of two. Each bucket is narrower than ``10 **
+        -significant_figures`` of the values it holds, so percentiles keep
+        that precision from microseconds to hours in a few kilobytes.
+
+        :param int significant_figures: The number of significant decimal
+                                        digits to keep (1-5).
+        """
+        self.significant_figures = significant_figures
+        self._sub_bits = int(math.ceil(math.log2(2 * 10 ** significant_figures)))
+        self._half = 1 << (self._sub_bits - 1)
+        self._counts = {}  # Bucket index -> count.
+        #: The number of recorded values.
+        self.count = 0
+        #: The sum of the recorded values, in seconds.
+        self.total = 0.0
+        #: The largest recorded value, in seconds.
+        self.max = 0.0
+
+    def _index(self, micros):
+        shift = max(0, micros.bit_length() - self._sub_bits)
+        return shift * self._half + (micros >> shift)
+
+    def _value(self, index):
+        """Return the middle of a bucket, in microseconds."""
+        if index < 2 * self._half:
+            return index
+        shift = index // self._half - 1
+        return ((index - shift * self._half) << shift) + (1 << shift) // 2
+
+    def record(self, seconds):
+        """
+        Record a latency.
+
+        :param float seconds: The latency, in seconds.
+        """
+        index = self._index(max(0, int(seconds * 1e6)))
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        Return a percentile of the recorded latencies.
+
+        :param float fraction: The percentile, from 0 to 1.
+
+        :returns: The latency in seconds, or None if nothing was recorded.
+        :rtype: float
+        """
+        if not self.count:
+            return None
+
+        rank = max(1, int(math.ceil(fraction * self.count)))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                return min(self._value(index) / 1e6, self.max)
+
+    def as_dict(self):
+        """
+        Return the count, mean, p50, p90, p99, p99.9 and maximum, in milliseconds.
+
+        :rtype: dict
+        """
+
+        def ms(seconds):
+            return None if seconds is None else seconds * 1000
+
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(0.5)),
+            "p90_ms": ms(self.percentile(0.9)),
+            "p99_ms": ms(self.percentile(0.99)),
+            "p999_ms": ms(self.percentile(0.999)),
+            "max_ms": ms(self.max) if self.count else None,
+        }
+
+
+class BulbStats(object):
+    """The counters and histograms of one bulb."""
+
+    def __init__(self):
+        #: The number of commands.
+        self.commands = 0
+        #: The number of commands that failed, by error class.
+        self.errors = {}
+        #: The number of times a command was sent again.
+        self.retries = 0
+        #: The number of commands replaced by the rate limiter.
+        self.coalesced = 0
+        #: The number of bytes sent.
+        self.bytes_sent = 0
+        #: The number of bytes received in responses.
+        self.bytes_received = 0
+        #: The time spent opening connections, in seconds.
+        self.connect_time = 0.0
+        #: The time spent waiting for the rate limiter, in seconds.
+        self.wait_time = 0.0
+        #: The round-trip time of the commands.
+        self.rtt = LatencyHistogram()
+        #: The time the commands took in total, including connecting, waiting
+        #: for the rate limiter and retrying.
+        self.duration = LatencyHistogram()
+
+    def add(self, event):
+        """Account for a finished command."""
+        self.commands += 1
+        if event.error is not None:
+            self.errors[event.error] = self.errors.get(event.error, 0) + 1
+        self.retries += max(event.attempts - 1, 0)
+        self.coalesced += event.coalesced
+        self.bytes_sent += event.bytes_sent
+        self.bytes_received += event.bytes_received
+        self.connect_time += event.connect_time
+        self.wait_time += event.wait_time
+        if event.rtt is not None:
+            self.rtt.record(event.rtt)
+        self.duration.record(event.duration)
+
+    def as_dict(self):
+        """
+        Return the counters and histograms as a dictionary.
+
+        :rtype: dict
+        """
+        result = dict(self.__dict__)
+        result["errors"] = dict(self.errors)
+        result["rtt"] = self.rtt.as_dict()
+        result["duration"] = self.duration.as_dict()
+        return result
+
+
+class Instrumentation(object):
+    def __init__(self, stats=True):
+        """
+        Watch the commands sent to the bulbs.
+
+        Pass the same instance to any number of bulbs (or to a
+        :py:class:`BulbRegistry <yeelight.BulbRegistry>`, which passes it to
+        its bulbs). Each command then produces a :py:class:`CommandEvent
+        <yeelight.CommandEvent>`, handed to the pre hooks before it is sent and
+        to the post hooks when it is done, and accounted for in the
+        :py:class:`BulbStats <yeelight.BulbStats>` of its bulb.
+
+        Bulbs without instrumentation (the default) skip all of this.
+
+        Example:
+
+        >>> instrumentation = Instrumentation()
+        >>> instrumentation.add_post_hook(lambda event: print(event.method, event.rtt))
+        >>> bulb = Bulb("192.168.0.19", instrumentation=instrumentation)
+        >>> bulb.turn_on()
+        >>> instrumentation.stats_for(bulb).rtt.percentile(0.99)
+
+        :param bool stats: Whether to keep the per-bulb counters and histograms.
+        """
+        self.keep_stats = stats
+        self.pre_hooks = []
+        self.post_hooks = []
+        self._stats = {}  # "ip:port" -> BulbStats.
+        self._lock = threading.Lock()
+        self._dump_registered = False
+
+    def add_pre_hook(self, hook):
+        """
+        Call a function before every command is sent.
+
+        :param callable hook: The function, called with the
+                              :py:class:`CommandEvent <yeelight.CommandEvent>`.
+        """
+        self.pre_hooks.append(hook)
+
+    def add_post_hook(self, hook):
+        """
+        Call a function after every command is done.
+
+        :param callable hook: The function, called with the
+                              :py:class:`CommandEvent <yeelight.CommandEvent>`.
+        """
+        self.post_hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Stop calling a pre or post hook."""
+        for hooks in (self.pre_hooks, self.post_hooks):
+            if hook in hooks:
+                hooks.remove(hook)
+
+    def before(self, bulb, method, params):
+        """
+        Start watching a command.
+
+        :rtype: yeelight.CommandEvent
+        """
+        event = CommandEvent(bulb, method, params)
+        for hook in self.pre_hooks:
+            self._call(hook, event)
+        return event
+
+    def after(self, event, response=None, error=None):
+        """
+        Finish watching a command.
+
+        :param yeelight.CommandEvent event: The event returned by :py:meth:`before`.
+        :param dict response: The response, if the command returned one.
+        :param Exception error: The exception, if the command raised one.
+        """
+        event.duration = time.perf_counter() - event.start
+        if error is not None:
+            event.error = error.__class__.__name__
+        elif response is not None:
+            event.coalesced = bool(response.get("coalesced"))
+
+        if self.keep_stats:
+            with self._lock:
+                self._stats_for(event.bulb).add(event)
+        for hook in self.post_hooks:
+            self._call(hook, event)
+
+    @staticmethod
+    def _call(hook, event):
+        try:
+            hook(event)
+        except Exception:
+            _LOGGER.exception("Instrumentation hook %s failed", hook)
+
+    def _stats_for(self, bulb):
+        key = "%s:%s" % (bulb._ip, bulb._port)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = BulbStats()
+        return stats
+
+    def stats_for(self, bulb):
+        """
+        Return the counters and histograms of a bulb.
+
+        :param yeelight.Bulb bulb: The bulb.
+
+        :rtype: yeelight.BulbStats
+        """
+        with self._lock:
+            return self._stats_for(bulb)
+
+    def as_dict(self):
+        """
+        Return the statistics of every bulb, keyed by ``"ip:port"``.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {key: stats.as_dict() for key, stats in self._stats.items()}
+
+    def dump(self, path=None):
+        """
+        Write the statistics of every bulb as JSON.
+
+        :param str path: The file to write to. Defaults to the standard error.
+        """
+        if path is None:
+            json.dump(self.as_dict(), sys.stderr, indent=2)
+            sys.stderr.write("\n")
+            return
+        with open(path, "w") as output:
+            json.dump(self.as_dict(), output, indent=2)
+
+    def dump_at_exit(self, path=None):
+        """
+        Write the statistics of every bulb as JSON when the interpreter exits.
+
+        :param str path: The file to write to. Defaults to the standard error.
+        """
+        if not self._dump_registered:
+            self._dump_registered = True
+            atexit.register(self.dump, path)
@@ -1,17 +1,21 @@
 # encoding: utf8
 
-import colorsys
+import functools
 import json
 import logging
 import os
+import select
 import socket
 import struct
+import threading
+import time
 
 #from futur utils import raise
 
-from .decorator import decorator
+from .colors import hsv_to_rgb
+from .connection import ConnectionManager
 from .enums import BulbType, LightType, PowerMode, SceneClass
-from .flow import Flow
+from .flow import Flow, _FlowParams
 from .utils import _clamp, rgb_to_yeelight
 
 if os.name == "nt":
@@ -42,78 +46,313 @@ _MODEL_SPECS = {
     "color2": {"color_temp": {"min": 2700, "max": 6500}, "night_light": False, "background_light": False},
 }
 
+# The properties fetched by ``Bulb.get_properties`` by default.
+_DEFAULT_PROPERTIES = [
+    "power",
+    "bright",
+    "ct",
+    "rgb",
+    "hue",
+    "sat",
+    "color_mode",
+    "flowing",
+    "delayoff",
+    "music_on",
+    "name",
+    "bg_power",
+    "bg_flowing",
+    "bg_ct",
+    "bg_bright",
+    "bg_hue",
+    "bg_sat",
+    "bg_rgb",
+    "nl_br",
+    "active_mode",
+]
+
+# The models that can show colors.
+_COLOR_MODELS = frozenset(["color", "color1", "color2", "strip1", "bslamp1", "bslamp2"])
+
+# The properties that only make sense with a feature, and the methods that
+# tell, in a bulb's ``support`` list, that it has the feature.
+_FEATURE_PROPERTIES = (
+    (("rgb", "hue", "sat"), ("set_rgb", "set_hsv")),
+    (("ct",), ("set_ct_abx",)),
+    (("color_mode",), ("set_rgb", "set_hsv", "set_ct_abx")),
+    (("flowing",), ("start_cf",)),
+    (("delayoff",), ("cron_add",)),
+    (("music_on",), ("set_music",)),
+    (("bg_power", "bg_flowing", "bg_ct", "bg_bright", "bg_hue", "bg_sat", "bg_rgb"), ("bg_set_power",)),
+)
+
+# The properties of the night light, which doesn't show in the support list.
+_NIGHT_LIGHT_PROPERTIES = ("nl_br", "active_mode")
+
+
+@functools.lru_cache(maxsize=None)
+def _model_lacking_methods(model):
+    """
+    Return the methods of the features a model doesn't have, according to its specs.
+
+    This stands in for the ``support`` list of bulbs whose list is unknown.
+    Models we know nothing about lack nothing.
+
+    :param str model: The model of the bulb, or None.
+
+    :rtype: frozenset
+    """
+    specs = _MODEL_SPECS.get(model)
+    lacking = set()
+    if specs is not None:
+        if model not in _COLOR_MODELS:
+            lacking.update(("set_rgb", "set_hsv"))
+        if specs["color_temp"]["min"] == specs["color_temp"]["max"]:
+            lacking.add("set_ct_abx")
+        if not specs["background_light"]:
+            lacking.add("bg_set_power")
+    return frozenset(lacking)
+
+
+@functools.lru_cache(maxsize=None)
+def _property_set(model, support):
+    """
+    Return the default properties a bulb has, and those it lacks.
+
+    The properties are derived from the bulb's ``support`` list, when known,
+    and from its model. Bulbs we know nothing about get every property.
+
+    :param str model:         The model of the bulb, or None.
+    :param frozenset support: The methods the bulb supports, or None.
+
+    :returns: The properties to request, in the default order, and the ones
+              the bulb doesn't have.
+    :rtype: tuple
+    """
+    specs = _MODEL_SPECS.get(model)
+    lacking = set()
+    if support is not None:
+        for properties, methods in _FEATURE_PROPERTIES:
+            if support.isdisjoint(methods):
+                lacking.update(properties)
+    else:
+        lacking_methods = _model_lacking_methods(model)
+        for properties, methods in _FEATURE_PROPERTIES:
+            if lacking_methods.issuperset(methods):
+                lacking.update(properties)
+    if specs is not None and not specs["night_light"]:
+        lacking.update(_NIGHT_LIGHT_PROPERTIES)
+
+    requested = tuple(name for name in _DEFAULT_PROPERTIES if name not in lacking)
+    return requested, tuple(name for name in _DEFAULT_PROPERTIES if name in lacking)
+
+
+# The error the firmware answers unsupported methods with.
+_UNSUPPORTED = {"code": -1, "message": "method not supported"}
+
+# The specs of the bulbs of unknown models, by type.
+_FALLBACK_MODELS = {BulbType.White: "mono", BulbType.WhiteTemp: "ceiling1", BulbType.WhiteTempMood: "ceiling4"}
+
+
+class _CapabilityProfile(object):
+    """What a bulb can do, as far as its model and ``support`` list tell."""
+
+    __slots__ = ("model", "support", "lacking", "background_light", "bulb_type", "specs")
+
+    def __init__(self, model, support):
+        self.model = model
+        self.support = support
+        # Without a support list, the model tells which features are missing.
+        self.lacking = _model_lacking_methods(model) if support is None else frozenset()
+        specs = _MODEL_SPECS.get(model)
+
+        if support is None and specs is None:
+            self.background_light = None
+            self.bulb_type = BulbType.Unknown
+        else:
+            self.background_light = self._has("bg_set_power")
+            if self._has("set_rgb") or self._has("set_hsv"):
+                self.bulb_type = BulbType.Color
+            elif self._has("set_ct_abx"):
+                self.bulb_type = BulbType.WhiteTempMood if self.background_light else BulbType.WhiteTemp
+            else:
+                self.bulb_type = BulbType.White
+
+        if specs is None and self.bulb_type is not BulbType.Unknown:
+            specs = _MODEL_SPECS[_FALLBACK_MODELS.get(self.bulb_type, "color")]
+        self.specs = specs
+
+    def _has(self, method):
+        if self.support is not None:
+            return method in self.support
+        return method not in self.lacking
+
+    def allows(self, method):
+        """Return whether the bulb may support a method, as far as we know."""
+        if self.support is None and method.startswith("bg_"):
+            return self.background_light is not False
+        return self._has(method)
+
+
+@functools.lru_cache(maxsize=None)
+def _capability_profile(model, support):
+    """
+    Return the capability profile of the bulbs of a model and ``support`` list.
+
+    Profiles are shared by every bulb with the same model and list.
+
+    :param str model:         The model of the bulb, or None.
+    :param frozenset support: The methods the bulb supports, or None.
+
+    :rtype: _CapabilityProfile
+    """
+    return _CapabilityProfile(model, support)
+
+
+# Methods that need the light to be on, see ``Bulb.auto_on``.
+_AUTO_ON_METHODS = {"set_ct_abx", "set_rgb", "set_hsv", "set_bright", "start_cf"}
+
+# The error that commands waiting for a response get when the connection is lost.
+_CONNECTION_LOST = "Bulb closed the connection."
+
+
+def _coalesced_response():
+    """Return the response of a command the rate limiter replaced with a newer one."""
+    return {"result": ["ok"], "coalesced": True}
+
 
-@decorator
-def _command(f, *args, **kw):
+_SSDP_ADDRESS = ("239.255.255.250", 1982)
+_SSDP_SEARCH = "\r\n".join(
+    ["M-SEARCH * HTTP/1.1", "HOST: 239.255.255.250:1982", 'MAN: "ssdp:discover"', "ST: wifi_bulb"]
+).encode()
+
+
+# Enum members looked up on every command, which is slow on the enum classes.
+_AMBIENT = LightType.Ambient
+_LAST_POWER_MODE = PowerMode.LAST
+
+
+class _CommandSpec(object):
+    """How the ``_command`` decorator prepares a method, computed once per method."""
+
+    __slots__ = ("method", "effect", "properties", "toggles", "power_mode", "auto_on", "background")
+
+    def __init__(self, method, effect=False, properties=(), toggles=(), power_mode=False, auto_on=False):
+        #: The name of the method sent to the bulb.
+        self.method = method
+        #: Whether the method takes the effect and duration parameters.
+        self.effect = effect
+        #: The properties the method's parameters set, in order, to keep the
+        #: shadow state up to date.
+        self.properties = properties
+        #: The power properties the method toggles, following the first one.
+        self.toggles = toggles
+        #: Whether the method takes the power mode parameter when turning on.
+        self.power_mode = power_mode
+        #: Whether the method needs the light to be on first.
+        self.auto_on = auto_on
+        #: The spec of the method controlling the ambient light.
+        self.background = None
+
+    def update_shadow(self, bulb, params):
+        """Apply the command to the bulb's shadow state, before the bulb confirms it."""
+        if self.toggles:
+            state = bulb._last_properties.get(self.toggles[0])
+            if state not in ("on", "off"):
+                # We can't tell what the light toggles to.
+                bulb._forget_properties(self.toggles)
+                return
+            bulb._set_properties(dict.fromkeys(self.toggles, "on" if state == "off" else "off"), confirmed=False)
+        elif self.properties:
+            # Stored as strings, like the bulb reports them.
+            bulb._set_properties({name: str(value) for name, value in zip(self.properties, params)}, confirmed=False)
+
+
+def _build_command_specs():
+    """Build the spec of every method sent by a ``_command`` method, and of its ambient light variant."""
+    specs = {}
+    for method, effect, properties, toggles in (
+        ("set_ct_abx", True, ("ct",), ()),
+        ("set_rgb", True, ("rgb",), ()),
+        ("set_hsv", True, ("hue", "sat"), ()),
+        ("set_bright", True, ("bright",), ()),
+        ("set_power", True, ("power",), ()),
+        ("toggle", True, (), ("power",)),
+        ("dev_toggle", False, (), ("power", "bg_power")),
+        ("set_default", False, (), ()),
+        ("set_name", False, (), ()),
+        ("set_adjust", False, (), ()),
+        ("start_cf", False, (), ()),
+        ("stop_cf", False, (), ()),
+        ("set_scene", False, (), ()),
+        ("set_music", False, (), ()),
+        ("cron_add", False, (), ()),
+        ("cron_get", False, (), ()),
+        ("cron_del", False, (), ()),
+    ):
+        spec = _CommandSpec(
+            method,
+            effect=effect,
+            properties=properties,
+            toggles=toggles,
+            power_mode=method == "set_power",
+            auto_on=method in _AUTO_ON_METHODS,
+        )
+        spec.background = _CommandSpec(
+            "bg_" + method,
+            effect=effect,
+            properties=tuple("bg_" + name for name in properties),
+            toggles=tuple("bg_" + name for name in toggles) if method != "dev_toggle" else toggles,
+            power_mode=spec.power_mode,
+            auto_on=spec.auto_on,
+        )
+        specs[method] = spec
+    return specs
+
+
+_COMMAND_SPECS = _build_command_specs()
+
+# The specs of the methods that change the shadow state, by the name sent to the bulb.
+_SHADOW_SPECS = {
+    variant.method: variant
+    for spec in _COMMAND_SPECS.values()
+    for variant in (spec, spec.background)
+    if variant.properties or variant.toggles
+}
+
+
+def _command_spec(method):
+    """Return the spec of a method, building one for methods missing from the table."""
+    spec = _COMMAND_SPECS.get(method)
+    if spec is None:
+        spec = _COMMAND_SPECS[method] = _CommandSpec(method, auto_on=method in _AUTO_ON_METHODS)
+        spec.background = _CommandSpec("bg_" + method, auto_on=spec.auto_on)
+    return spec
+
+
+def _command(f):
     """A decorator that wraps a function and enables effects."""
-    self = args[0]
-    effect = kw.get("effect", self.effect)
-    duration = kw.get("duration", self.duration)
-    power_mode = kw.get("power_mode", self.power_mode)
-
-    method, params, kwargs = f(*args, **kw)
-
-    light_type = kwargs.get("light_type", LightType.Main)
-
-    # Prepend the control for different bulbs
-    if light_type == LightType.Ambient:
-        method = "bg_" + method
-
-    if method in [
-        "set_ct_abx",
-        "set_rgb",
-        "set_hsv",
-        "set_bright",
-        "set_power",
-        "toggle",
-        "bg_set_ct_abx",
-        "bg_set_rgb",
-        "bg_set_hsv",
-        "bg_set_bright",
-        "bg_set_power",
-        "bg_toggle",
-    ]:
-        if self._music_mode:
-            # Mapping calls to their properties.
-            # Used to keep music mode cache up to date.
-            action_property_map = {
-                "set_ct_abx": ["ct"],
-                "bg_set_ct_abx": ["bg_ct"],
-                "set_rgb": ["rgb"],
-                "bg_set_rgb": ["bg_rgb"],
-                "set_hsv": ["hue", "sat"],
-                "bg_set_hsv": ["bg_hue", "bg_sat"],
-                "set_bright": ["bright"],
-                "bg_set_bright": ["bg_bright"],
-                "set_power": ["power"],
-                "bg_set_power": ["bg_power"],
-            }
-            # Handle toggling separately, as it depends on a previous power state.
-            if method == "toggle":
-                self._last_properties["power"] = "on" if self._last_properties["power"] == "off" else "off"
-            if method == "bg_toggle":
-                self._last_properties["bg_power"] = "on" if self._last_properties["bg_power"] == "off" else "off"
-            # dev_toggle toggle both lights depending on the MAIN light power status.
-            if method == "dev_toggle":
-                new_state = "on" if self._last_properties["power"] == "off" else "off"
-                self._last_properties["power"] = new_state
-                self._last_properties["bg_power"] = new_state
-            elif method in action_property_map:
-                set_prop = action_property_map[method]
-                update_props = {set_prop[prop]: params[prop] for prop in range(len(set_prop))}
-                _LOGGER.debug("Music mode cache update: %s", update_props)
-                self._last_properties.update(update_props)
-        # Add the effect parameters.
-        params += [effect, duration]
-        # Add power_mode parameter.
-        if method == "set_power" and params[0] == "on" and power_mode.value != PowerMode.LAST:
-            params += [power_mode.value]
-        if method == "bg_set_power" and params[0] == "on" and power_mode.value != PowerMode.LAST:
-            params += [power_mode.value]
-
-    result = self.send_command(method, params).get("result", [])
-    if result:
-        return result[0]
+
+    @functools.wraps(f)
+    def wrapper(self, *args, **kw):
+        method, params, kwargs = f(self, *args, **kw)
+
+        spec = _command_spec(method)
+        # Use the control for different bulbs
+        if kwargs.get("light_type") is _AMBIENT:
+            spec = spec.background
+
+        if spec.effect:
+            # Add the effect parameters.
+            params += [kw.get("effect", self.effect), kw.get("duration", self.duration)]
+            # Add power_mode parameter.
+            if spec.power_mode and params[0] == "on":
+                power_mode = kw.get("power_mode", self.power_mode)
+                if power_mode != _LAST_POWER_MODE:
+                    params.append(power_mode.value)
+
+        return self._run_command(spec.method, params, spec.auto_on)
+
+    return wrapper
 
 
 def get_ip_address(ifname):
@@ -131,52 +370,187 @@ def get_ip_address(ifname):
     )  # SIOCGIFADDR
 
 
-def discover_bulbs(timeout=2, interface=False):
+def discover_bulbs(timeout=2, interface=False, expected_names=None, expected_count=None, ssdp_address=None):
     """
     Discover all the bulbs in the local network.
 
-    :param int timeout: How many seconds to wait for replies. Discovery will
-                        always take exactly this long to run, as it can't know
-                        when all the bulbs have finished responding.
+    :param int timeout: How many seconds to wait for replies. Unless one of the
+                        stop conditions below is given, discovery will always
+                        take exactly this long to run, as it can't know when all
+                        the bulbs have finished responding.
 
     :param string interface: The interface that should be used for multicast packets.
                              Note: it *has* to have a valid IPv4 address. IPv6-only
                              interfaces are not supported (at the moment).
                              The default one will be used if this is not specified.
 
+    :param list expected_names: Stop as soon as bulbs with all these names have
+                                replied.
+
+    :param int expected_count: Stop as soon as this many bulbs have replied.
+
+    :param tuple ssdp_address: The (host, port) address to send the discovery
+                               request to. Defaults to the SSDP multicast
+                               group the bulbs listen on; pass the
+                               ``ssdp_address`` of a :py:class:`Simulator
+                               <yeelight.simulator.Simulator>` to discover
+                               simulated bulbs.
+
     :returns: A list of dictionaries, containing the ip, port and capabilities
               of each of the bulbs in the network.
     """
-    msg = "\r\n".join(["M-SEARCH * HTTP/1.1", "HOST: 239.255.255.250:1982", 'MAN: "ssdp:discover"', "ST: wifi_bulb"])
+    return list(discover_bulbs_iter(timeout, interface, expected_names, expected_count, ssdp_address))
+
+
+def discover_bulbs_iter(timeout=2, interface=False, expected_names=None, expected_count=None, ssdp_address=None):
+    """
+    Discover the bulbs in the local network, yielding each one as it replies.
+
+    Example:
+
+    >>> for bulb in discover_bulbs_iter(expected_names=["bed", "kitchen 1"]):
+    ...     print(bulb["capabilities"]["name"])
+
+    See :py:func:`discover_bulbs <yeelight.discover_bulbs>` for the parameters.
+
+    :returns: A generator of dictionaries, containing the ip, port and
+              capabilities of each of the bulbs in the network.
+    """
+    goal = _DiscoveryGoal(expected_names, expected_count)
+    deadline = time.monotonic() + timeout
+
+    s = _discovery_socket(interface)
+    try:
+        s.sendto(_SSDP_SEARCH, ssdp_address or _SSDP_ADDRESS)
+
+        while not goal.reached:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            s.settimeout(remaining)
+            try:
+                data, addr = s.recvfrom(65507)
+            except socket.timeout:
+                break
+
+            bulb = _parse_discovery_reply(data)
+            if goal.add(bulb):
+                yield bulb
+    finally:
+        s.close()
+
+
+class _DiscoveryGoal(object):
+    """Keep track of the bulbs seen during discovery, and of when to stop."""
+
+    def __init__(self, expected_names=None, expected_count=None):
+        self.missing_names = set(expected_names) if expected_names is not None else None
+        self.expected_count = expected_count
+        self.bulb_ips = set()
+
+    @property
+    def reached(self):
+        """Whether any of the stop conditions has been met."""
+        if self.missing_names is not None and not self.missing_names:
+            return True
+        return self.expected_count is not None and len(self.bulb_ips) >= self.expected_count
+
+    def add(self, bulb):
+        """
+        Record a discovered bulb.
+
+        :returns: False if the bulb had already been seen, True otherwise.
+        """
+        bulb_ip = (bulb["ip"], bulb["port"])
+        if bulb_ip in self.bulb_ips:
+            return False
+
+        self.bulb_ips.add(bulb_ip)
+        if self.missing_names is not None:
+            self.missing_names.discard(bulb["capabilities"].get("name"))
+        return True
+
+
+def _discovery_socket(interface=False):
+    """
+    Create the UDP socket used to send SSDP discovery requests.
 
-    # Set up UDP socket
+    :param string interface: The interface that should be used for multicast packets.
+    """
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 32)
+    # Make room for the replies of large fleets, which all arrive at once.
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
     if interface:
         s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(get_ip_address(interface)))
-    s.settimeout(timeout)
-    s.sendto(msg.encode(), ("239.255.255.250", 1982))
+    return s
 
-    bulbs = []
-    bulb_ips = set()
-    while True:
-        try:
-            data, addr = s.recvfrom(65507)
-        except socket.timeout:
-            break
 
-        capabilities = dict([x.strip("\r").split(": ") for x in data.decode().split("\n") if ":" in x])
-        parsed_url = urlparse(capabilities["Location"])
+def _parse_discovery_reply(data):
+    """
+    Parse a bulb's reply to an SSDP discovery request.
 
-        bulb_ip = (parsed_url.hostname, parsed_url.port)
-        if bulb_ip in bulb_ips:
-            continue
+    :param bytes data: The raw reply.
 
-        capabilities = {key: value for key, value in capabilities.items() if key.islower()}
-        bulbs.append({"ip": bulb_ip[0], "port": bulb_ip[1], "capabilities": capabilities})
-        bulb_ips.add(bulb_ip)
+    :returns: A dictionary containing the ip, port and capabilities of the bulb.
+    """
+    capabilities = dict([x.strip("\r").split(": ") for x in data.decode().split("\n") if ":" in x])
+    parsed_url = urlparse(capabilities["Location"])
+
+    capabilities = {key: value for key, value in capabilities.items() if key.islower()}
+    return {"ip": parsed_url.hostname, "port": parsed_url.port, "capabilities": capabilities}
+
+
+def _encode_command(cmd_id, method, params):
+    """
+    Encode a command as the bulb expects it.
+
+    The params of a flow keep their encoding, so only the id is encoded when
+    the same flow is started again.
+
+    :rtype: bytes
+    """
+    if type(params) is not _FlowParams:
+        return (json.dumps({"id": cmd_id, "method": method, "params": params}) + "\r\n").encode("utf8")
+
+    encoded = params.encoded.get(method)
+    if encoded is None:
+        # Drop the opening brace, the id goes before the rest.
+        encoded = json.dumps({"method": method, "params": params})[1:] + "\r\n"
+        encoded = params.encoded[method] = encoded.encode("utf8")
+    return b'{"id": %d, ' % cmd_id + encoded
 
-    return bulbs
+
+class _PendingResponse(object):
+    """A command that has been sent to the bulb and is waiting for its response."""
+
+    __slots__ = ("event", "response", "size", "sent", "received", "deadline")
+
+    def __init__(self, deadline=None):
+        self.event = threading.Event()
+        self.response = None
+        self.size = 0  # The size of the response, in bytes.
+        self.sent = None  # When the command was written, on the perf_counter clock.
+        self.received = None  # When the response arrived.
+        self.deadline = deadline  # When to give up on the response, on the monotonic clock.
+
+    def resolve(self, response, size=0):
+        self.response = response
+        self.size = size
+        self.received = time.perf_counter()
+        self.event.set()
+
+
+class _PropertyFetch(object):
+    """A ``get_prop`` command in flight, which other callers wanting the same properties can wait for."""
+
+    __slots__ = ("names", "done", "error")
+
+    def __init__(self, names, done):
+        self.names = frozenset(names)
+        self.done = done  # A threading or asyncio Event, set when the reply is in.
+        self.error = None  # The exception the command raised, if any.
 
 
 class BulbException(Exception):
@@ -190,9 +564,28 @@ class BulbException(Exception):
     pass
 
 
+class _ConnectionLost(BulbException):
+    """The connection broke while sending a command."""
+
+    pass
+
+
 class Bulb(object):
     def __init__(
-        self, ip, port=55443, effect="smooth", duration=300, auto_on=False, power_mode=PowerMode.LAST, model=None
+        self,
+        ip,
+        port=55443,
+        effect="smooth",
+        duration=300,
+        auto_on=False,
+        power_mode=PowerMode.LAST,
+        model=None,
+        connection=None,
+        rate_limiter=None,
+        instrumentation=None,
+        max_property_age=None,
+        support=None,
+        capabilities=None,
     ):
         """
         The main controller class of a physical YeeLight bulb.
@@ -218,6 +611,36 @@ class Bulb(object):
                              "mono", etc). The setting is used to enable model
                              specific features (e.g. a particular color
                              temperature range).
+        :param yeelight.ConnectionManager connection:
+                             The manager of the bulb's connection, which sets
+                             the timeouts, keep-alive and retry policy, and
+                             keeps the connection statistics. A default one is
+                             created if this is not specified.
+        :param yeelight.RateLimiter rate_limiter:
+                             An optional limiter that keeps the commands sent
+                             outside music mode below the bulb's rate limit,
+                             coalescing state-setting commands that would
+                             otherwise queue up.
+        :param yeelight.Instrumentation instrumentation:
+                             Optional hooks and statistics that watch every
+                             command sent to the bulb.
+        :param float max_property_age:
+                             How many seconds a property's last known value can
+                             be used for, instead of asking the bulb again. The
+                             default, None, always asks the bulb. See
+                             :py:meth:`get_properties()
+                             <yeelight.Bulb.get_properties>`.
+        :param list support: The methods the bulb supports, as listed in its
+                             discovery reply. With the model, it is used to
+                             only ask the bulb for the properties it has, and
+                             to reject the methods it doesn't support without
+                             sending them.
+        :param dict capabilities:
+                             The capabilities of the bulb, as returned by
+                             :py:func:`discover_bulbs()
+                             <yeelight.discover_bulbs>`. They provide the
+                             ``model`` and ``support`` list, unless these are
+                             given.
 
         """
         self._ip = ip
@@ -227,12 +650,33 @@ class Bulb(object):
         self.duration = duration
         self.auto_on = auto_on
         self.power_mode = power_mode
+        self.capabilities = dict(capabilities) if capabilities else {}
+        if model is None:
+            model = self.capabilities.get("model")
+        if support is None:
+            support = self.capabilities.get("support")
         self.model = model
+        self.connection = connection if connection is not None else ConnectionManager()
+        self.rate_limiter = rate_limiter
+        self.instrumentation = instrumentation
+        self.max_property_age = max_property_age
+        self.support = frozenset(support.split() if isinstance(support, str) else support) if support else None
 
         self.__cmd_id = 0  # The last command id we used.
         self._last_properties = {}  # The last set of properties we've seen.
+        self._property_times = {}  # Property name -> when we last saw or set its value.
+        self._unconfirmed = set()  # Properties set by our commands, not yet confirmed by the bulb.
+        self._fetch = None  # The get_prop command in flight, if any.
+        self._fetch_lock = threading.Lock()
         self._music_mode = False  # Whether we're currently in music mode.
         self.__socket = None  # The socket we use to communicate.
+        self.__recv_buffer = b""  # Incomplete data received from the socket.
+        self._pending = {}  # Command id -> _PendingResponse waiting for it.
+        self._send_lock = threading.Lock()
+        self._recv_lock = threading.Lock()
+        self._listener = None  # The thread reading notifications, if any.
+        self._listener_stop = threading.Event()
+        self._listener_callback = None
 
     @property
     def _cmd_id(self):
@@ -248,32 +692,231 @@ class Bulb(object):
     def _socket(self):
         """Return, optionally creating, the communication socket."""
         if self.__socket is None:
-            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.__socket.settimeout(5)
-            self.__socket.connect((self._ip, self._port))
+            self.__socket = self.connection.connect(self._ip, self._port)
         return self.__socket
 
     def ensure_on(self):
-        """Turn the bulb on if it is off."""
+        """
+        Turn the bulb on if it is off.
+
+        While :py:meth:`listening <yeelight.Bulb.start_listening>`, the power
+        state is kept up to date by the bulb's notifications, so it is not
+        fetched again. Neither is it while it is younger than
+        ``max_property_age``.
+        """
         if self._music_mode is True or self.auto_on is False:
             return
 
-        self.get_properties()
+        if not self._power_known():
+            self.get_properties()
 
         if self._last_properties["power"] != "on":
             self.turn_on()
 
+    def _power_known(self):
+        """Return whether the power state can be used without asking the bulb."""
+        if self._listener is not None and "power" in self._last_properties:
+            return True
+        return self.max_property_age is not None and self._is_fresh(("power",), self.max_property_age)
+
     @property
     def last_properties(self):
         """
-        The last properties we've seen the bulb have.
-
-        This might potentially be out of date, as there's no background listener
-        for the bulb's notifications. To update it, call
+        The shadow state of the bulb: the last properties we've seen it have.
+
+        The properties are updated from the replies to :py:meth:`get_properties
+        <yeelight.Bulb.get_properties()>`, from the bulb's notifications, and
+        from the commands we send: once the bulb accepts a command (or as soon
+        as it is sent, in music mode), the properties it sets are updated as if
+        it had taken effect, until the bulb confirms their value (see
+        :py:attr:`unconfirmed_properties
+        <yeelight.Bulb.unconfirmed_properties>`).
+
+        This might potentially be out of date, unless a background listener for
+        the bulb's notifications is running (see :py:meth:`start_listening
+        <yeelight.Bulb.start_listening()>`). To update it, call
         :py:meth:`get_properties <yeelight.Bulb.get_properties()>`.
         """
         return self._last_properties
 
+    @property
+    def unconfirmed_properties(self):
+        """
+        The properties set by our commands that the bulb hasn't reported since.
+
+        :rtype: frozenset
+        """
+        return frozenset(self._unconfirmed)
+
+    def property_age(self, name):
+        """
+        Return how long ago the given property's value was last seen or set.
+
+        :param str name: The name of the property.
+
+        :returns: The age in seconds, or None if the property has never been seen.
+        :rtype: float
+        """
+        seen = self._property_times.get(name)
+        if seen is None:
+            return None
+        return time.monotonic() - seen
+
+    def _is_fresh(self, names, max_age):
+        """Return whether every given property was seen or set less than ``max_age`` seconds ago."""
+        oldest = time.monotonic() - max_age
+        times = self._property_times
+        for name in names:
+            seen = times.get(name)
+            if seen is None or seen < oldest:
+                return False
+        return True
+
+    def _set_properties(self, properties, confirmed=True):
+        """
+        Update the shadow state.
+
+        :param dict properties: The new values of the properties.
+        :param bool confirmed:  Whether the values come from the bulb, rather
+                                than from a command we sent.
+        """
+        self._last_properties.update(properties)
+        now = time.monotonic()
+        for name in properties:
+            self._property_times[name] = now
+        if confirmed:
+            self._unconfirmed.difference_update(properties)
+        else:
+            self._unconfirmed.update(properties)
+        self._update_current_brightness()
+
+    def _forget_properties(self, names):
+        """Mark properties as unknown until the bulb reports them again."""
+        for name in names:
+            self._last_properties.pop(name, None)
+            self._property_times.pop(name, None)
+            self._unconfirmed.discard(name)
+        self._update_current_brightness()
+
+    @property
+    def listening(self):
+        """
+        Return whether the background notification listener is running.
+
+        :rtype: bool
+        """
+        return self._listener is not None
+
+    def start_listening(self, callback=None):
+        """
+        Start a background thread that reads the bulb's notifications.
+
+        The bulb notifies every connected client whenever its state changes.
+        While listening, these notifications are applied to
+        :py:attr:`last_properties <yeelight.Bulb.last_properties>` as soon as
+        they arrive, instead of only while another command is waiting for its
+        response. This also means :py:meth:`ensure_on()
+        <yeelight.Bulb.ensure_on>` no longer needs to fetch the properties
+        before every command.
+
+        The listener reconnects by itself if the connection is lost, and it is
+        stopped when music mode starts, since the bulb doesn't send
+        notifications in music mode.
+
+        :param callable callback: An optional function that will be called with
+                                  a dictionary of the changed properties on
+                                  every notification.
+        """
+        if self._listener is not None:
+            return
+
+        self._listener_callback = callback
+        self._listener_stop.clear()
+        self._listener = threading.Thread(target=self._listen, name="%s listener" % self)
+        self._listener.daemon = True
+        self._listener.start()
+
+    def stop_listening(self):
+        """Stop the background notification listener, if it is running."""
+        listener = self._listener
+        if listener is None:
+            return
+
+        self._listener_stop.set()
+        if listener is not threading.current_thread():
+            listener.join()
+        self._listener = None
+
+    def _listen(self):
+        """Read from the socket until asked to stop and no command is waiting for a response."""
+        while not self._listener_stop.is_set() or self._pending:
+            try:
+                with self._send_lock:
+                    sock = self._socket
+            except socket.error:
+                _LOGGER.debug("%s: Could not connect, retrying later.", self)
+                self._close_socket()
+                self._listener_stop.wait(1)
+                continue
+
+            try:
+                readable, _, _ = select.select([sock], [], [], 0.5)
+            except (socket.error, ValueError):
+                # The socket was closed under us.
+                continue
+
+            if readable:
+                with self._recv_lock:
+                    self._receive()
+            self._expire_pending()
+
+    def _expire_pending(self):
+        """
+        Fail the commands whose response is overdue.
+
+        Without the listener, the socket's read timeout does this; the listener
+        only reads when there is something to read, so it checks the deadlines
+        itself.
+        """
+        if not self._pending:
+            return
+
+        now = time.monotonic()
+        with self._recv_lock:
+            for cmd_id, pending in list(self._pending.items()):
+                if pending.deadline is not None and pending.deadline <= now:
+                    _LOGGER.debug("%s: No response to command %s in time", self, cmd_id)
+                    self._pending.pop(cmd_id, None)
+                    pending.resolve({"error": _CONNECTION_LOST})
+
+    @property
+    def _profile(self):
+        """Return the capability profile of the bulb's model and ``support`` list."""
+        return _capability_profile(self.model, self.support)
+
+    def supports(self, method, light_type=LightType.Main):
+        """
+        Return whether the bulb may support a method, without asking it.
+
+        The answer comes from the bulb's ``support`` list when it is known, and
+        otherwise from its model. Methods of bulbs we know nothing about are
+        assumed to be supported.
+
+        :param str method: The name of the method, e.g. "set_rgb".
+        :param yeelight.LightType light_type: Light type to control.
+
+        :rtype: bool
+        """
+        if light_type == LightType.Ambient:
+            method = "bg_" + method
+        return self._profile.allows(method)
+
+    def _check_supported(self, method):
+        """Raise the bulb's own error for methods it doesn't support, without sending them."""
+        if not self._profile.allows(method):
+            _LOGGER.debug("%s: Not sending %s, which the bulb doesn't support", self, method)
+            raise BulbException(dict(_UNSUPPORTED))
+
     @property
     def bulb_type(self):
         """
@@ -282,11 +925,16 @@ class Bulb(object):
         Returns a :py:class:`BulbType <yeelight.BulbType>` describing the bulb
         type.
 
-        When trying to access before properties are known, the bulb type is unknown.
+        It is derived from the model and ``support`` list when they are known,
+        without asking the bulb, and otherwise from the last properties. When
+        neither is known, the bulb type is unknown.
 
         :rtype: yeelight.BulbType
         :return: The bulb's type.
         """
+        bulb_type = self._profile.bulb_type
+        if bulb_type is not BulbType.Unknown:
+            return bulb_type
         if not self._last_properties or any(name not in self.last_properties for name in ["ct", "rgb"]):
             return BulbType.Unknown
         if self.last_properties["rgb"] is None and self.last_properties["ct"]:
@@ -311,31 +959,7 @@ class Bulb(object):
         """
         return self._music_mode
 
-    def get_properties(
-        self,
-        requested_properties=[
-            "power",
-            "bright",
-            "ct",
-            "rgb",
-            "hue",
-            "sat",
-            "color_mode",
-            "flowing",
-            "delayoff",
-            "music_on",
-            "name",
-            "bg_power",
-            "bg_flowing",
-            "bg_ct",
-            "bg_bright",
-            "bg_hue",
-            "bg_sat",
-            "bg_rgb",
-            "nl_br",
-            "active_mode",
-        ],
-    ):
+    def get_properties(self, requested_properties=None, max_age=None):
         """
         Retrieve and return the properties of the bulb.
 
@@ -345,8 +969,19 @@ class Bulb(object):
         by the bulb), and indicates the current brightness of the lamp, aware of night light
         mode. It is 0 if the lamp is off, and None if it is unknown.
 
+        If every requested property was seen or set less than ``max_age``
+        seconds ago, the shadow state is returned without asking the bulb.
+        Callers asking for properties that a call from another thread is
+        already fetching wait for its reply instead of sending their own.
+
         :param list requested_properties: The list of properties to request from the bulb.
-                                          By default, this does not include ``flow_params``.
+                                          By default, the properties the bulb has,
+                                          according to its model and ``support``
+                                          list; the ones it lacks are set to None.
+                                          This does not include ``flow_params``.
+        :param float max_age: How old the known values can be, in seconds.
+                              Defaults to the bulb's ``max_property_age``;
+                              0 always asks the bulb.
 
         :returns: A dictionary of param: value items.
         :rtype: dict
@@ -356,12 +991,68 @@ class Bulb(object):
         if self._music_mode:
             return self._last_properties
 
-        response = self.send_command("get_prop", requested_properties)
-        properties = response["result"]
-        properties = [x if x else None for x in properties]
+        lacking = ()
+        if requested_properties is None:
+            requested_properties, lacking = _property_set(self.model, self.support)
+
+        if max_age is None:
+            max_age = self.max_property_age
+        if max_age and self._is_fresh(requested_properties, max_age):
+            return self._last_properties
+
+        with self._fetch_lock:
+            fetch = self._fetch
+            if fetch is not None and fetch.names.issuperset(requested_properties):
+                owner = False
+            else:
+                fetch = self._fetch = _PropertyFetch(requested_properties, threading.Event())
+                owner = True
+
+        if not owner:
+            fetch.done.wait()
+            if fetch.error is not None:
+                raise fetch.error
+            return self._last_properties
+
+        try:
+            response = self.send_command("get_prop", requested_properties)
+            return self._update_properties(requested_properties, response["result"], lacking)
+        except Exception as ex:
+            fetch.error = ex
+            raise
+        finally:
+            with self._fetch_lock:
+                if self._fetch is fetch:
+                    self._fetch = None
+            fetch.done.set()
+
+    def _update_properties(self, requested_properties, properties, lacking=()):
+        """
+        Update ``last_properties`` with the reply to a ``get_prop`` command.
 
-        self._last_properties = dict(zip(requested_properties, properties))
+        :param list requested_properties: The list of properties that were requested.
+        :param list properties: The values the bulb returned for them.
+        :param tuple lacking: The properties the bulb doesn't have, set to None.
 
+        :returns: The updated ``last_properties``.
+        :rtype: dict
+        """
+        last_properties = self._last_properties
+        property_times = self._property_times
+        now = time.monotonic()
+        for name, value in zip(requested_properties, properties):
+            last_properties[name] = value if value else None
+            property_times[name] = now
+        for name in lacking:
+            last_properties[name] = None
+            property_times[name] = now
+        if self._unconfirmed:
+            self._unconfirmed.difference_update(requested_properties)
+        self._update_current_brightness()
+        return last_properties
+
+    def _update_current_brightness(self):
+        """Compute the ``current_brightness`` property from the others."""
         if self._last_properties.get("power") == "off":
             cb = "0"
         if self._last_properties.get("bg_power") == "off":
@@ -373,64 +1064,300 @@ class Bulb(object):
             cb = self._last_properties.get("bright")
         self._last_properties["current_brightness"] = cb
 
-        return self._last_properties
-
     def send_command(self, method, params=None):
         """
         Send a command to the bulb.
 
+        Several threads can share a bulb and send commands at the same time;
+        the commands are written to the connection as they come and each
+        response is matched to its command by ``id``.
+
         :param str method:  The name of the method to send.
         :param list params: The list of parameters for the method.
 
-        :raises BulbException: When the bulb indicates an error condition.
+        If the connection is lost before the response arrives, commands that
+        are safe to repeat are sent again on a new connection, as configured by
+        the bulb's :py:class:`ConnectionManager <yeelight.ConnectionManager>`.
+
+        With a :py:class:`RateLimiter <yeelight.RateLimiter>`, this waits for
+        the rate limit, and a command replaced by a newer one while waiting
+        returns a response with ``"coalesced": True`` without being sent.
+
+        :raises BulbException: When the bulb indicates an error condition, or
+                               doesn't support the method according to its
+                               ``support`` list or model.
         :returns: The response from the bulb.
         """
-        command = {"id": self._cmd_id, "method": method, "params": params}
+        self._check_supported(method)
+        if self.instrumentation is None:
+            return self._send_command(method, params)
 
-        _LOGGER.debug("%s > %s", self, command)
+        event = self.instrumentation.before(self, method, params)
+        try:
+            response = self._send_command(method, params, event)
+        except Exception as ex:
+            self.instrumentation.after(event, error=ex)
+            raise
+        self.instrumentation.after(event, response=response)
+        return response
+
+    def _send_command(self, method, params, event=None):
+        """Send a command and wait for its response, retrying if allowed."""
+        attempt = 0
+        while True:
+            if not self._acquire(method, event):
+                return _coalesced_response()
+
+            try:
+                pending = self._send(method, params, event)
+            except _ConnectionLost:
+                if self._music_mode or not self.connection.can_retry(method, attempt):
+                    raise
+            else:
+                if pending is None:
+                    # We're in music mode, nothing else will happen.
+                    return self._check_response(method, params, {"result": ["ok"]})
+
+                response = self._wait_response(pending, event)
+                if response.get("error") != _CONNECTION_LOST or not self.connection.can_retry(method, attempt):
+                    return self._check_response(method, params, response)
+
+            delay = self.connection.delay(attempt)
+            _LOGGER.debug("%s: Connection lost, sending %s again in %.2fs", self, method, delay)
+            time.sleep(delay)
+            attempt += 1
+            self.connection.stats.retries += 1
+
+    def send_commands(self, commands):
+        """
+        Send several commands to the bulb, without waiting for each response.
 
+        All the commands are written to the connection before any response is
+        read, so a burst of commands costs about one round-trip instead of one
+        per command.
+
+        Example:
+
+        >>> bulb.send_commands([("set_bright", [10, "smooth", 300]), ("get_prop", ["power"])])
+
+        :param list commands: A list of ``(method, params)`` tuples.
+
+        :raises BulbException: When the bulb indicates an error condition for
+                               any of the commands.
+        :returns: The list of responses from the bulb, in the same order.
+        """
+        for method, _ in commands:
+            self._check_supported(method)
+
+        if self.instrumentation is None:
+            events = [None] * len(commands)
+        else:
+            events = [self.instrumentation.before(self, method, params) for method, params in commands]
+
+        # Commands the rate limiter replaced with newer ones are marked False.
+        pending = []
         try:
-            self._socket.send((json.dumps(command) + "\r\n").encode("utf8"))
-        except socket.error as ex:
-            # Some error occurred, remove this socket in hopes that we can later
-            # create a new one.
-            self.__socket.close()
-            self.__socket = None
-            raise BulbException("A socket error occurred when sending the command.")
+            for (method, params), event in zip(commands, events):
+                pending.append(self._send(method, params, event) if self._acquire(method, event) else False)
+        except Exception as ex:
+            # Nobody will wait for the commands already written, so forget them.
+            with self._recv_lock:
+                for cmd_id, p in list(self._pending.items()):
+                    if any(p is sent for sent in pending):
+                        del self._pending[cmd_id]
+            if self.instrumentation is not None:
+                for event in events:
+                    self.instrumentation.after(event, error=ex)
+            raise
+
+        # Wait for every response before checking them, so no pending
+        # command is left behind if one of them failed.
+        responses = [
+            _coalesced_response() if p is False else {"result": ["ok"]} if p is None else self._wait_response(p, e)
+            for p, e in zip(pending, events)
+        ]
+        if self.instrumentation is None:
+            return [
+                response if p is False else self._check_response(method, params, response)
+                for (method, params), p, response in zip(commands, pending, responses)
+            ]
+
+        checked = []
+        error = None
+        for (method, params), p, response, event in zip(commands, pending, responses, events):
+            try:
+                checked.append(response if p is False else self._check_response(method, params, response))
+            except BulbException as ex:
+                self.instrumentation.after(event, error=ex)
+                error = error or ex
+            else:
+                self.instrumentation.after(event, response=response)
+        if error is not None:
+            raise error
+        return checked
 
-        if self._music_mode:
-            # We're in music mode, nothing else will happen.
-            return {"result": ["ok"]}
+    def _acquire(self, method, event=None):
+        """
+        Wait for the rate limiter, if any, to allow sending a command.
+
+        :returns: False if the command was replaced by a newer one, True otherwise.
+        """
+        if self.rate_limiter is None or self._music_mode:
+            return True
+        if event is None:
+            return self.rate_limiter.acquire(method)
+
+        start = time.perf_counter()
+        try:
+            return self.rate_limiter.acquire(method)
+        finally:
+            event.wait_time += time.perf_counter() - start
 
-        # The bulb will send us updates on its state in addition to responses,
-        # so we want to make sure that we read until we see an actual response.
-        response = None
-        while response is None:
+    def _send(self, method, params, event=None):
+        """
+        Write a command to the bulb and register it as waiting for a response.
+
+        :returns: The pending response, or None in music mode, where the bulb
+                  doesn't respond.
+        :rtype: _PendingResponse
+        """
+        with self._send_lock:
+            command = {"id": self._cmd_id, "method": method, "params": params}
+
+            _LOGGER.debug("%s > %s", self, command)
+
+            connect_start = time.perf_counter() if event is not None and self.__socket is None else None
             try:
-                data = self._socket.recv(16 * 1024)
+                sock = self._socket
             except socket.error:
-                # An error occured, let's close and abort...
-                self.__socket.close()
-                self.__socket = None
-                response = {"error": "Bulb closed the connection."}
-                break
+                raise BulbException("Could not connect to the bulb.")
+            finally:
+                if connect_start is not None:
+                    event.connect_time += time.perf_counter() - connect_start
+
+            pending = None
+            if not self._music_mode:
+                timeout = self.connection.read_timeout
+                deadline = time.monotonic() + timeout if timeout is not None else None
+                pending = self._pending[command["id"]] = _PendingResponse(deadline)
+
+            data = _encode_command(command["id"], method, params)
+            if event is not None:
+                event.attempts += 1
+                event.bytes_sent += len(data)
+                if pending is not None:
+                    pending.sent = time.perf_counter()
+
+            try:
+                sock.send(data)
+            except socket.error:
+                # Some error occurred, remove this socket in hopes that we can later
+                # create a new one.
+                self._close_socket()
+                raise _ConnectionLost("A socket error occurred when sending the command.")
+
+        return pending
 
-            for line in data.split(b"\r\n"):
-                if not line:
+    def _wait_response(self, pending, event=None):
+        """
+        Wait for the response to a command sent with :py:meth:`_send`.
+
+        Only one thread reads from the socket at a time; it hands every
+        response it reads to the command it belongs to.
+
+        :param _PendingResponse pending: The pending response to wait for.
+        :param yeelight.CommandEvent event: The event to record the
+                                            round-trip in, if instrumented.
+
+        :returns: The response from the bulb.
+        """
+        while not pending.event.is_set():
+            if self._listener is not None:
+                # The listener reads the response for us.
+                pending.event.wait(1)
+                continue
+
+            with self._recv_lock:
+                if not pending.event.is_set():
+                    self._receive()
+
+        if event is not None and pending.sent is not None:
+            event.rtt = pending.received - pending.sent
+            event.bytes_received = pending.size
+        return pending.response
+
+    def _receive(self):
+        """Read the next chunk of data from the socket and dispatch the lines in it."""
+        try:
+            data = self._socket.recv(16 * 1024)
+        except socket.error:
+            data = b""
+
+        if not data:
+            # An error occured, let's close and abort...
+            self._close_socket()
+            return
+
+        lines = (self.__recv_buffer + data).split(b"\r\n")
+        self.__recv_buffer = b""
+        for i, line in enumerate(lines):
+            if not line:
+                continue
+
+            size = len(line) + 2
+            try:
+                line = json.loads(line.decode("utf8"))
+                _LOGGER.debug("%s < %s", self, line)
+            except ValueError:
+                if i == len(lines) - 1:
+                    # The rest of this line hasn't arrived yet.
+                    self.__recv_buffer = line
                     continue
+                line = {"result": ["invalid command"]}
+
+            self._dispatch(line, size)
+
+    def _dispatch(self, line, size=0):
+        """Handle a line received from the bulb, ``size`` bytes long."""
+        if line.get("method") == "props":
+            self._set_properties(line["params"])
+
+            if self._listener_callback is not None:
+                self._listener_callback(line["params"])
+            return
+
+        # Responses without an id are assumed to belong to the oldest command.
+        cmd_id = line.get("id", next(iter(self._pending), None))
+        pending = self._pending.pop(cmd_id, None)
+        if pending is None:
+            _LOGGER.debug("%s: Discarding response to unknown command: %s", self, line)
+            return
 
-                try:
-                    line = json.loads(line.decode("utf8"))
-                    _LOGGER.debug("%s < %s", self, line)
-                except ValueError:
-                    line = {"result": ["invalid command"]}
+        pending.resolve(line, size)
 
-                if line.get("method") != "props":
-                    # This is probably the response we want.
-                    response = line
-                else:
-                    self._last_properties.update(line["params"])
+    def _close_socket(self):
+        """Close the socket, failing every command that is waiting for a response."""
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+            self.connection.disconnected()
+        self.__recv_buffer = b""
+
+        pending, self._pending = self._pending, {}
+        for response in pending.values():
+            response.resolve({"error": _CONNECTION_LOST})
+
+    def _check_response(self, method, params, response):
+        """
+        Check a response from the bulb for errors.
 
+        :param str method:    The name of the method that was sent.
+        :param list params:   The list of parameters for the method.
+        :param dict response: The response from the bulb.
+
+        :raises BulbException: When the bulb indicates an error condition.
+        :returns: The response from the bulb.
+        """
         if method == "set_music" and params == [0] and "error" in response and response["error"]["code"] == -5000:
             # The bulb seems to throw an error for no reason when stopping music mode,
             # it doesn't affect operation and we can't do anything about it, so we might
@@ -440,8 +1367,28 @@ class Bulb(object):
         if "error" in response:
             raise BulbException(response["error"])
 
+        spec = _SHADOW_SPECS.get(method)
+        if spec is not None:
+            spec.update_shadow(self, params)
         return response
 
+    def _run_command(self, method, params, auto_on=False):
+        """
+        Send a command prepared by a ``_command`` method and unwrap its result.
+
+        :param str method:   The name of the method to send.
+        :param list params:  The list of parameters for the method.
+        :param bool auto_on: Whether the command needs the light to be on first.
+
+        :returns: The first item of the result, if any.
+        """
+        if auto_on:
+            self.ensure_on()
+
+        result = self.send_command(method, params).get("result", [])
+        if result:
+            return result[0]
+
     @_command
     def set_color_temp(self, degrees, light_type=LightType.Main, **kwargs):
         """
@@ -451,8 +1398,6 @@ class Bulb(object):
                             specified by the model's capabilities, or 1700-6500).
         :param yeelight.LightType light_type: Light type to control.
         """
-        self.ensure_on()
-
         return "set_ct_abx", [self._clamp_color_temp(degrees)], dict(kwargs, light_type=light_type)
 
     @_command
@@ -466,8 +1411,6 @@ class Bulb(object):
         :param yeelight.LightType light_type:
                           Light type to control.
         """
-        self.ensure_on()
-
         return "set_rgb", [rgb_to_yeelight(red, green, blue)], dict(kwargs, light_type=light_type)
 
     @_command
@@ -500,8 +1443,6 @@ class Bulb(object):
                                change.
         :param yeelight.LightType light_type: Light type to control.
         """
-        self.ensure_on()
-
         # We fake this using flow so we can add the `value` parameter.
         hue = _clamp(hue, 0, 359)
         saturation = _clamp(saturation, 0, 100)
@@ -518,9 +1459,7 @@ class Bulb(object):
             else:
                 duration = kwargs.get("duration", self.duration)
 
-            hue = _clamp(hue, 0, 359) / 359.0
-            saturation = _clamp(saturation, 0, 100) / 100.0
-            rgb = rgb_to_yeelight(*[int(round(col * 255)) for col in colorsys.hsv_to_rgb(hue, saturation, 1)])
+            rgb = hsv_to_rgb(hue, saturation)
             return "start_cf", [1, 1, "%s, 1, %s, %s" % (duration, rgb, value)], dict(kwargs, light_type=light_type)
 
     @_command
@@ -531,8 +1470,6 @@ class Bulb(object):
         :param int brightness: The brightness value to set (1-100).
         :param yeelight.LightType light_type: Light type to control.
         """
-        self.ensure_on()
-
         brightness = _clamp(brightness, 1, 100)
         return "set_bright", [brightness], dict(kwargs, light_type=light_type)
 
@@ -600,8 +1537,6 @@ class Bulb(object):
         if not isinstance(flow, Flow):
             raise ValueError("Argument is not a Flow instance.")
 
-        self.ensure_on()
-
         return "start_cf", flow.as_start_flow_params, dict(kwargs, light_type=light_type)
 
     @_command
@@ -698,31 +1633,49 @@ class Bulb(object):
         :param str ip: The IP address of the host this library is running on.
                        Will be discovered automatically if not provided.
         """
+        self._prepare_music()
+
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Reuse sockets so we don't hit "address already in use" errors.
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(("", port))
+            host, port = s.getsockname()
+            s.listen(3)
+
+            local_ip = ip if ip else self._socket.getsockname()[0]
+            self.send_command("set_music", [1, local_ip, port])
+            s.settimeout(5)
+            conn, _ = s.accept()
+        finally:
+            s.close()  # Close the listening socket.
+
+        self._enter_music_mode(conn)
+
+        return "ok"
+
+    def _prepare_music(self):
+        """Get ready to tell the bulb to start music mode."""
         if self._music_mode:
             raise AssertionError("Already in music mode, please stop music mode first.")
 
+        # The bulb doesn't send notifications in music mode.
+        self.stop_listening()
+
         # Force populating the cache in case we are being called directly
         # without ever fetching properties beforehand
         self.get_properties()
 
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # Reuse sockets so we don't hit "address already in use" errors.
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(("", port))
-        host, port = s.getsockname()
-        s.listen(3)
-
-        local_ip = ip if ip else self._socket.getsockname()[0]
-        self.send_command("set_music", [1, local_ip, port])
-        s.settimeout(5)
-        conn, _ = s.accept()
-        s.close()  # Close the listening socket.
-        self.__socket.close()
+    def _enter_music_mode(self, conn):
+        """
+        Replace the connection with the one the bulb opened for music mode.
+
+        :param socket conn: The connection the bulb made to us.
+        """
+        self._close_socket()
         self.__socket = conn
         self._music_mode = True
 
-        return "ok"
-
     @_command
     def stop_music(self, **kwargs):
         """
@@ -731,9 +1684,7 @@ class Bulb(object):
         Stopping music mode will close the previous connection. Calling
         ``stop_music`` more than once, or while not in music mode, is safe.
         """
-        if self.__socket:
-            self.__socket.close()
-            self.__socket = None
+        self._close_socket()
         self._music_mode = False
         return "set_music", [0], kwargs
 
@@ -787,22 +1738,17 @@ class Bulb(object):
     def get_model_specs(self, **kwargs):
         """
         Return the specifications (e.g. color temperature min/max) of the bulb.
+
+        They are looked up from the model, or guessed from the ``support`` list
+        or the last properties, without asking the bulb.
         """
-        if self.model is not None and self.model in _MODEL_SPECS:
-            return _MODEL_SPECS[self.model]
+        specs = self._profile.specs
+        if specs is not None:
+            return specs
 
         _LOGGER.debug("Model unknown (%s). Providing a fallback", self.model)
-        if self.bulb_type is BulbType.White:
-            return _MODEL_SPECS["mono"]
-
-        if self.bulb_type is BulbType.WhiteTemp:
-            return _MODEL_SPECS["ceiling1"]
-
-        if self.bulb_type is BulbType.WhiteTempMood:
-            return _MODEL_SPECS["ceiling4"]
-
-        # BulbType.Color and BulbType.Unknown
-        return _MODEL_SPECS["color"]
+        # BulbType.Color and BulbType.Unknown get the specs of color bulbs.
+        return _MODEL_SPECS[_FALLBACK_MODELS.get(self.bulb_type, "color")]
 
     def _clamp_color_temp(self, degrees):
         """
@@ -0,0 +1,129 @@
+"""Put many bulbs into music mode at once."""
+
+import logging
+import socket
+import threading
+import time
+
+from .group import BulbGroup
+from .main import BulbException
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MusicHub(object):
+    def __init__(self, port=0, ip=None, timeout=5):
+        """
+        A single listening socket that many bulbs connect to for music mode.
+
+        :py:meth:`Bulb.start_music <yeelight.Bulb.start_music>` opens a
+        listening socket per bulb and waits for that bulb to connect before
+        the next one can start. The hub listens once, tells all the bulbs to
+        connect to it at the same time, and hands every incoming connection to
+        the bulb with the same IP address, so a whole group of bulbs enters
+        music mode in about the time it takes one of them.
+
+        Example:
+
+        >>> with MusicHub() as hub:
+        ...     result = hub.start(registry.by_model("color"))
+
+        :param int port:    The port to listen on. If none is specified, a
+                            random port will be chosen.
+        :param str ip:      The IP address of the host this library is running
+                            on. Will be discovered automatically for each bulb
+                            if not provided.
+        :param int timeout: How many seconds to wait for the bulbs to connect.
+        """
+        self.ip = ip
+        self.timeout = timeout
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Reuse sockets so we don't hit "address already in use" errors.
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("", port))
+        self._socket.listen(16)
+        self.port = self._socket.getsockname()[1]
+
+        self._connections = {}  # Peer IP -> connection waiting for its bulb.
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the listening socket, and any connection no bulb claimed."""
+        self._socket.close()
+        with self._condition:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+    def start(self, bulbs):
+        """
+        Put bulbs into music mode.
+
+        :param list bulbs: The :py:class:`Bulb <yeelight.Bulb>` instances to
+                           put into music mode.
+
+        :returns: The per-bulb outcome. Bulbs that didn't connect back in time
+                  have a :py:class:`BulbException <yeelight.BulbException>`
+                  in ``errors``.
+        :rtype: yeelight.GroupResult
+        """
+        group = BulbGroup(bulbs)
+        deadline = time.monotonic() + self.timeout
+
+        done = threading.Event()
+        acceptor = threading.Thread(target=self._accept, args=(deadline, done), name="yeelight music hub")
+        acceptor.daemon = True
+        acceptor.start()
+        try:
+            return group.map(self._start_bulb, deadline)
+        finally:
+            done.set()
+            group.close()
+            acceptor.join()
+
+    def _accept(self, deadline, done):
+        """Accept connections until the deadline, or until every bulb is done."""
+        while not done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            self._socket.settimeout(min(remaining, 0.1))
+            try:
+                conn, (peer_ip, _) = self._socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            with self._condition:
+                previous = self._connections.pop(peer_ip, None)
+                if previous is not None:
+                    previous.close()
+                self._connections[peer_ip] = conn
+                self._condition.notify_all()
+
+    def _start_bulb(self, bulb, deadline):
+        """Tell a bulb to connect to the hub, and hand it its connection."""
+        bulb._prepare_music()
+        local_ip = self.ip if self.ip else bulb._socket.getsockname()[0]
+        bulb.send_command("set_music", [1, local_ip, self.port])
+
+        with self._condition:
+            while bulb._ip not in self._connections:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BulbException("The bulb did not connect to the music hub in time.")
+                self._condition.wait(remaining)
+            conn = self._connections.pop(bulb._ip)
+
+        bulb._enter_music_mode(conn)
+        _LOGGER.debug("%s: Music mode started through the hub", bulb)
+        return "ok"
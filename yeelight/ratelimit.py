@@ -0,0 +1,88 @@
+"""Client-side rate limiting of the commands sent to a bulb."""
+
+import threading
+import time
+
+
+class RateLimiter(object):
+    #: State-setting methods, mapped to the state they set. When commands have
+    #: to wait, a newer command for the same state replaces an older one.
+    COALESCED_METHODS = {
+        "set_bright": "bright",
+        "set_ct_abx": "color",
+        "set_rgb": "color",
+        "set_hsv": "color",
+        "bg_set_bright": "bg_bright",
+        "bg_set_ct_abx": "bg_color",
+        "bg_set_rgb": "bg_color",
+        "bg_set_hsv": "bg_color",
+    }
+
+    def __init__(self, rate=50, per=60.0, burst=10):
+        """
+        A token bucket limiting the commands sent to a bulb.
+
+        Outside music mode, the bulb accepts about 60 commands per minute on a
+        connection, and refuses the rest. The bucket holds up to
+        ``burst`` tokens and gains ``rate`` tokens every ``per`` seconds, so no
+        more than ``burst + rate`` commands are sent in any ``per`` seconds.
+
+        When the bucket is empty, commands wait for a token. State-setting
+        commands (see ``COALESCED_METHODS``) don't queue up, though: while one
+        is waiting, a newer command that sets the same state replaces it, and
+        the replaced command returns without being sent. This lets sliders and
+        animations send updates as fast as they like; the bulb gets the latest
+        value as soon as the rate allows.
+
+        :param float rate:  The number of tokens gained every ``per`` seconds.
+        :param float per:   The refill period, in seconds.
+        :param float burst: The capacity of the bucket (at least 1).
+        """
+        if burst < 1:
+            raise ValueError("The bucket must hold at least one token.")
+
+        self.rate = rate
+        self.per = per
+        self.burst = burst
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._latest = {}  # Coalescing key -> the ticket of the newest waiting command.
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate / self.per)
+        self._updated = now
+
+    def acquire(self, method):
+        """
+        Wait until a command may be sent.
+
+        :param str method: The name of the method that will be sent.
+
+        :returns: True if the command should be sent, False if a newer command
+                  replaced it while it was waiting.
+        :rtype: bool
+        """
+        key = self.COALESCED_METHODS.get(method)
+        ticket = object()
+
+        with self._condition:
+            if key is not None:
+                self._latest[key] = ticket
+                # Let the command we replace (if any) know.
+                self._condition.notify_all()
+
+            while True:
+                if key is not None and self._latest.get(key) is not ticket:
+                    return False
+
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    if key is not None:
+                        del self._latest[key]
+                    return True
+
+                self._condition.wait((1 - self._tokens) * self.per / self.rate)
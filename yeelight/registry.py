@@ -0,0 +1,216 @@
+"""A registry of the bulbs in the network."""
+
+import logging
+import threading
+
+from .main import Bulb
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class BulbRegistry(object):
+    def __init__(self, bulbs=(), cache=None, **kwargs):
+        """
+        An index of discovered bulbs that hands out one shared Bulb per lamp.
+
+        Bulbs can be looked up by name, id, IP or model without scanning the
+        discovery results. The first lookup of a lamp creates its
+        :py:class:`Bulb <yeelight.Bulb>`; every later lookup returns that same
+        instance, and with it the same open connection.
+
+        Example:
+
+        >>> registry = BulbRegistry(discover_bulbs(), auto_on=True)
+        >>> registry.get("bed").turn_on()
+        >>> registry.get("bed") is registry.get("bed")
+        True
+
+        :param list bulbs: Bulbs, as returned by :py:func:`discover_bulbs
+                           <yeelight.discover_bulbs>`.
+        :param yeelight.DiscoveryCache cache:
+                           An optional discovery cache, used to find bulbs that
+                           aren't in the registry yet, and to rediscover bulbs
+                           whose address doesn't accept connections anymore.
+        :param kwargs:     Keyword arguments for every :py:class:`Bulb
+                           <yeelight.Bulb>` the registry creates.
+        """
+        self.cache = cache
+        self.bulb_kwargs = kwargs
+
+        self._lock = threading.RLock()
+        self._by_id = {}  # Bulb id -> discovery result.
+        self._by_name = {}  # Bulb name -> bulb id.
+        self._by_ip = {}  # Bulb IP -> bulb id.
+        self._by_model = {}  # Model -> bulb ids, as the keys of a dict to keep their order.
+        self._instances = {}  # Bulb id -> shared Bulb.
+        self._connect_locks = {}  # Bulb id -> lock held while its Bulb is created.
+
+        self.add(bulbs)
+
+    @classmethod
+    def from_cache(cls, cache, expected_names=None, expected_count=None, **kwargs):
+        """
+        Create a registry from a :py:class:`DiscoveryCache <yeelight.DiscoveryCache>`.
+
+        :param yeelight.DiscoveryCache cache: The cache to use.
+        :param list expected_names: The names of the bulbs that will be needed.
+        :param int expected_count: The number of bulbs that will be needed.
+        :param kwargs: Keyword arguments for every :py:class:`Bulb <yeelight.Bulb>`.
+
+        :rtype: yeelight.BulbRegistry
+        """
+        return cls(cache.discover(expected_names, expected_count), cache=cache, **kwargs)
+
+    def add(self, bulbs):
+        """
+        Add discovered bulbs to the registry, or update the ones it has.
+
+        A bulb that changed its address gets a new :py:class:`Bulb
+        <yeelight.Bulb>` on its next lookup.
+
+        :param list bulbs: Bulbs, as returned by :py:func:`discover_bulbs
+                           <yeelight.discover_bulbs>`.
+        """
+        with self._lock:
+            for bulb in bulbs:
+                bulb_id = self._bulb_id(bulb)
+                previous = self._by_id.get(bulb_id)
+                if previous is not None:
+                    self._by_name.pop(previous["capabilities"].get("name"), None)
+                    self._by_ip.pop(previous["ip"], None)
+                    self._unindex_model(bulb_id, previous["capabilities"].get("model"))
+                    if (previous["ip"], previous["port"]) != (bulb["ip"], bulb["port"]):
+                        self._instances.pop(bulb_id, None)
+
+                self._by_id[bulb_id] = bulb
+                self._by_ip[bulb["ip"]] = bulb_id
+                self._by_model.setdefault(bulb["capabilities"].get("model"), {})[bulb_id] = None
+                name = bulb["capabilities"].get("name")
+                if name:
+                    self._by_name[name] = bulb_id
+
+    def _unindex_model(self, bulb_id, model):
+        bulb_ids = self._by_model.get(model)
+        if bulb_ids is not None:
+            bulb_ids.pop(bulb_id, None)
+            if not bulb_ids:
+                del self._by_model[model]
+
+    @staticmethod
+    def _bulb_id(bulb):
+        return bulb["capabilities"].get("id") or "%s:%s" % (bulb["ip"], bulb["port"])
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def names(self):
+        """
+        Return the names of the bulbs in the registry.
+
+        :rtype: list
+        """
+        return list(self._by_name)
+
+    def get(self, name):
+        """
+        Return the shared :py:class:`Bulb <yeelight.Bulb>` with the given name.
+
+        :param str name: The name of the bulb.
+
+        :returns: The bulb, or None if there's no bulb with that name.
+        :rtype: yeelight.Bulb
+        """
+        bulb_id = self._by_name.get(name)
+        if bulb_id is None and self.cache is not None:
+            cached = self.cache.lookup(name) or self._rediscover(name)
+            if cached is not None:
+                self.add([cached])
+                bulb_id = self._by_name.get(name)
+
+        return self.by_id(bulb_id) if bulb_id is not None else None
+
+    def by_id(self, bulb_id):
+        """
+        Return the shared :py:class:`Bulb <yeelight.Bulb>` with the given id.
+
+        :param str bulb_id: The id of the bulb, as reported by discovery.
+
+        :returns: The bulb, or None if there's no bulb with that id.
+        :rtype: yeelight.Bulb
+        """
+        instance = self._instances.get(bulb_id)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if bulb_id not in self._by_id:
+                return None
+            connect_lock = self._connect_locks.setdefault(bulb_id, threading.Lock())
+
+        # Connecting can take seconds, so only the lookups of this bulb wait for it.
+        with connect_lock:
+            instance = self._instances.get(bulb_id)
+            if instance is None:
+                instance = self._connect(bulb_id)
+                with self._lock:
+                    instance = self._instances.setdefault(bulb_id, instance)
+            return instance
+
+    def by_ip(self, ip):
+        """
+        Return the shared :py:class:`Bulb <yeelight.Bulb>` with the given IP.
+
+        :param str ip: The IP of the bulb.
+
+        :returns: The bulb, or None if there's no bulb with that IP.
+        :rtype: yeelight.Bulb
+        """
+        bulb_id = self._by_ip.get(ip)
+        return self.by_id(bulb_id) if bulb_id is not None else None
+
+    def by_model(self, model):
+        """
+        Return the shared :py:class:`Bulb <yeelight.Bulb>` instances of the given model.
+
+        :param str model: The model of the bulbs (e.g. "color", "mono").
+
+        :rtype: list
+        """
+        with self._lock:
+            bulb_ids = list(self._by_model.get(model, ()))
+        return [self.by_id(bulb_id) for bulb_id in bulb_ids]
+
+    def _connect(self, bulb_id):
+        """Create the Bulb for a registered bulb, rediscovering it if its address is stale."""
+        with self._lock:
+            bulb = self._by_id[bulb_id]
+        kwargs = dict(self.bulb_kwargs)
+        kwargs.setdefault("capabilities", bulb["capabilities"])
+
+        instance = Bulb(bulb["ip"], bulb["port"], **kwargs)
+        if self.cache is None:
+            return instance
+
+        name = bulb["capabilities"].get("name")
+        try:
+            instance._socket
+        except OSError:
+            _LOGGER.info("Address of %s (%s) is not reachable, rediscovering", name, bulb["ip"])
+            self.cache.invalidate(bulb_id)
+            rediscovered = self._rediscover(name)
+            if rediscovered is None:
+                return instance
+            self.add([rediscovered])
+            with self._lock:
+                bulb = self._by_id[bulb_id]
+            instance = Bulb(bulb["ip"], bulb["port"], **kwargs)
+
+        return instance
+
+    def _rediscover(self, name):
+        """Look for a bulb in the network, through the cache."""
+        self.cache.refresh(expected_names=[name])
+        return self.cache.lookup(name)
@@ -0,0 +1,330 @@
+"""Timed execution of bulb commands from a single thread."""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .enums import LightType
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ScheduledEvent(object):
+    """A call scheduled on a :py:class:`Scheduler <yeelight.Scheduler>`."""
+
+    __slots__ = (
+        "deadline",
+        "function",
+        "args",
+        "kwargs",
+        "cancelled",
+        "lateness",
+        "result",
+        "error",
+        "_done",
+        "_handle",
+    )
+
+    def __init__(self, deadline, function, args, kwargs):
+        self.deadline = deadline
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        #: How many seconds after its deadline the call started, once it has.
+        self.lateness = None
+        #: What the call returned, once it has returned.
+        self.result = None
+        #: The exception the call raised, if it raised one.
+        self.error = None
+        self._done = threading.Event()
+        self._handle = None  # The asyncio timer, for events of an AsyncScheduler.
+
+    @property
+    def done(self):
+        """
+        Return whether the call has happened or has been cancelled.
+
+        :rtype: bool
+        """
+        return self._done.is_set()
+
+    def cancel(self):
+        """Prevent the call from happening, if it hasn't happened yet."""
+        self.cancelled = True
+        if self._handle is not None:
+            self._handle.cancel()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the call has happened or has been cancelled.
+
+        Don't call this from the event loop of an :py:class:`AsyncScheduler
+        <yeelight.AsyncScheduler>`; check :py:attr:`done` instead.
+
+        :param float timeout: The maximum number of seconds to wait.
+
+        :returns: True if the call is done, False if the timeout expired.
+        :rtype: bool
+        """
+        return self._done.wait(timeout)
+
+    def _started(self, now, late_threshold):
+        """Record and report how late the call is starting."""
+        self.lateness = now - self.deadline
+        if late_threshold is not None and self.lateness > late_threshold:
+            _LOGGER.warning("Scheduled call to %s started %.3fs late", self.function, self.lateness)
+        else:
+            _LOGGER.debug("Scheduled call to %s started %.3fs late", self.function, self.lateness)
+
+    def _run(self, late_threshold):
+        """Call the function, unless the event was cancelled."""
+        if self.cancelled:
+            return
+        self._started(time.monotonic(), late_threshold)
+        try:
+            self.result = self.function(*self.args, **self.kwargs)
+        except Exception as ex:
+            self.error = ex
+            _LOGGER.exception("Scheduled call to %s failed", self.function)
+        finally:
+            self._done.set()
+
+    def __repr__(self):
+        return "<%s %s at %.3f, lateness %s>" % (self.__class__.__name__, self.function, self.deadline, self.lateness)
+
+
+class Scheduler(object):
+    def __init__(self, late_threshold=0.05, max_workers=16):
+        """
+        Run functions at given times, from a small pool of threads.
+
+        All the events share a single timer thread and a single timer heap, so
+        scheduling commands for many bulbs doesn't cost one sleeping thread per
+        bulb. The timer thread only waits for deadlines: due calls are run by a
+        pool of worker threads, so a slow or unreachable bulb holds up one
+        worker instead of every other bulb's calls. The threads are started on
+        the first call to :py:meth:`call_at`.
+
+        Deadlines are absolute times on the :py:func:`time.monotonic` clock.
+        Scheduling every action against the same starting time, instead of
+        sleeping between actions, keeps the time a command takes from delaying
+        the actions after it. How late each call started is kept in its
+        :py:class:`ScheduledEvent <yeelight.ScheduledEvent>`.
+
+        Example:
+
+        >>> start = time.monotonic()
+        >>> scheduler.call_at(start + 60, bulb.turn_on)
+        >>> scheduler.call_at(start + 120, bulb.set_brightness, 100)
+
+        :param float late_threshold: Calls that start more than this many
+                                     seconds late are logged as warnings.
+                                     ``None`` never warns.
+        :param int max_workers: The maximum number of calls that can run at
+                                the same time.
+        """
+        self.late_threshold = late_threshold
+        self.max_workers = max_workers
+
+        self._heap = []
+        self._counter = itertools.count()  # Keeps events with equal deadlines in order.
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._workers = threading.local()  # Marks the worker threads, see stop().
+        self._stopped = False
+
+    def call_at(self, deadline, function, *args, **kwargs):
+        """
+        Call a function at the given time.
+
+        :param float deadline: When to call the function, on the
+                               :py:func:`time.monotonic` clock.
+        :param callable function: The function to call.
+
+        :rtype: yeelight.ScheduledEvent
+        """
+        event = ScheduledEvent(deadline, function, args, kwargs)
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._counter), event))
+            if self._thread is None:
+                self._stopped = False
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="yeelight scheduler worker"
+                )
+                self._thread = threading.Thread(target=self._run, args=(self._executor,), name="yeelight scheduler")
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return event
+
+    def call_later(self, delay, function, *args, **kwargs):
+        """
+        Call a function after the given delay.
+
+        :param float delay: The delay, in seconds.
+        :param callable function: The function to call.
+
+        :rtype: yeelight.ScheduledEvent
+        """
+        return self.call_at(time.monotonic() + delay, function, *args, **kwargs)
+
+    def stop(self):
+        """
+        Stop the threads, cancelling the events that haven't happened yet.
+
+        Calls already running are waited for, unless this is one of them.
+        """
+        with self._condition:
+            self._stopped = True
+            heap, self._heap = self._heap, []
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+
+        for _, _, event in heap:
+            event.cancel()
+        if thread is not None:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=not getattr(self._workers, "active", False))
+
+    def _call(self, event):
+        """Run an event on a worker thread."""
+        self._workers.active = True
+        event._run(self.late_threshold)
+
+    def _run(self, executor):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, event = heapq.heappop(self._heap)
+
+            executor.submit(self._call, event)
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def default_scheduler():
+    """
+    Return the scheduler shared by everything that doesn't ask for its own.
+
+    :rtype: yeelight.Scheduler
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = Scheduler()
+        return _default_scheduler
+
+
+class FlowChain(object):
+    def __init__(self, bulb, flow, light_type=LightType.Main, scheduler=None, max_transitions=None):
+        """
+        Play a flow of any length, by chaining segments the bulb can run.
+
+        The bulbs reject flows of more than 9 transitions. A chain splits the
+        flow into segments (see :py:meth:`Flow.segments
+        <yeelight.Flow.segments>`) and starts each one on the bulb as the
+        previous one ends. The segments are started from a shared
+        :py:class:`Scheduler <yeelight.Scheduler>`, against deadlines computed
+        from the start of the chain, so delays in sending one segment don't add
+        up over the following ones. They are sent by the scheduler's workers,
+        so a slow or unreachable bulb doesn't hold up the other chains.
+
+        Example:
+
+        >>> chain = FlowChain(bulb, Flow(count=1, action=Flow.actions.stay, transitions=sunrise))
+        >>> chain.start()
+        >>> chain.wait()
+
+        :param yeelight.Bulb bulb: The bulb to play the flow on.
+        :param yeelight.Flow flow: The flow to play.
+        :param yeelight.LightType light_type: Light type to control.
+        :param yeelight.Scheduler scheduler: The scheduler to use. Defaults to
+                                             the shared one.
+        :param int max_transitions: The maximum number of transitions per
+                                    segment. Defaults to what the bulbs accept.
+        """
+        self.bulb = bulb
+        self.flow = flow
+        self.light_type = light_type
+        self.scheduler = scheduler if scheduler is not None else default_scheduler()
+
+        if max_transitions is None:
+            self.segments = flow.segments()
+        else:
+            self.segments = flow.segments(max_transitions)
+
+        self._event = None
+        self._done = threading.Event()
+
+    @property
+    def duration(self):
+        """
+        Return how long one run of the chain takes, in milliseconds.
+
+        :rtype: int
+        """
+        return sum(segment.duration * max(segment.count, 1) for segment in self.segments)
+
+    def start(self):
+        """Start playing the flow, in the background."""
+        self._done.clear()
+        now = time.monotonic()
+        self._event = self.scheduler.call_at(now, self._start_segment, 0, now)
+
+    def cancel(self):
+        """Stop starting new segments. The segment already running is not stopped."""
+        if self._event is not None:
+            self._event.cancel()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the last segment has been started and has finished.
+
+        :param float timeout: The maximum number of seconds to wait.
+
+        :returns: True if the chain finished, False if the timeout expired.
+        :rtype: bool
+        """
+        return self._done.wait(timeout)
+
+    def _start_segment(self, index, deadline):
+        if self._done.is_set():
+            return
+
+        if index == len(self.segments):
+            if self.flow.count != 0:
+                self._done.set()
+                return
+            # Flows that run forever start over.
+            index = 0
+
+        segment = self.segments[index]
+        lateness = time.monotonic() - deadline
+        _LOGGER.debug("%s: Starting segment %s/%s, %.3fs late", self.bulb, index + 1, len(self.segments), lateness)
+        try:
+            self.bulb.start_flow(segment, light_type=self.light_type)
+        except Exception as ex:
+            _LOGGER.warning("%s: Could not start segment %s of the flow: %s", self.bulb, index + 1, ex)
+
+        if segment.count == 0:
+            # A short flow that runs forever, the bulb repeats it by itself.
+            self._done.set()
+            return
+
+        deadline += segment.duration * segment.count / 1000.0
+        self._event = self.scheduler.call_at(deadline, self._start_segment, index + 1, deadline)
@@ -0,0 +1,696 @@
+"""
+Simulated bulbs, for testing and benchmarking without any hardware.
+
+The simulated bulbs listen on local TCP ports and speak the bulbs' protocol,
+so the regular :py:class:`Bulb <yeelight.Bulb>` can talk to them. They can be
+discovered through the simulator's SSDP responder:
+
+>>> with Simulator(count=3) as simulator:
+...     bulbs = discover_bulbs(ssdp_address=simulator.ssdp_address, expected_count=3)
+
+Running ``python -m yeelight.simulator`` starts a fleet until interrupted.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from .main import _parse_discovery_reply
+
+_LOGGER = logging.getLogger(__name__)
+
+#: The methods a color bulb advertises in its discovery reply.
+COLOR_SUPPORT = (
+    "get_prop",
+    "set_default",
+    "set_power",
+    "toggle",
+    "set_bright",
+    "start_cf",
+    "stop_cf",
+    "set_scene",
+    "cron_add",
+    "cron_get",
+    "cron_del",
+    "set_ct_abx",
+    "set_rgb",
+    "set_hsv",
+    "set_adjust",
+    "adjust_bright",
+    "adjust_ct",
+    "adjust_color",
+    "set_music",
+    "set_name",
+)
+
+#: The methods a ceiling light with an ambient light advertises.
+CEILING_SUPPORT = (
+    COLOR_SUPPORT
+    + tuple("bg_" + method for method in COLOR_SUPPORT if not method.startswith(("get_", "cron_", "set_mu", "set_na")))
+    + ("dev_toggle",)
+)
+
+_MODEL_SUPPORT = {"ceiling4": CEILING_SUPPORT}
+
+# The errors the firmware answers with.
+_UNSUPPORTED = {"code": -1, "message": "method not supported"}
+_INVALID_PARAMS = {"code": -1, "message": "invalid params"}
+_POWERED_OFF = {"code": -5000, "message": "general error"}
+_QUOTA_EXCEEDED = {"code": -1, "message": "client quota exceeded"}
+
+# Methods that are refused while the light they control is off.
+_NEEDS_POWER = {
+    "set_ct_abx",
+    "set_rgb",
+    "set_hsv",
+    "set_bright",
+    "start_cf",
+    "set_adjust",
+    "adjust_bright",
+    "adjust_ct",
+    "adjust_color",
+}
+
+
+class _CommandError(Exception):
+    """A command the simulated firmware refuses."""
+
+    def __init__(self, error):
+        super(_CommandError, self).__init__(error["message"])
+        self.error = error
+
+
+def _int_param(params, index, low, high):
+    """Return an integer parameter, checking its range like the firmware does."""
+    try:
+        value = int(params[index])
+    except (IndexError, TypeError, ValueError):
+        raise _CommandError(_INVALID_PARAMS)
+    if not low <= value <= high:
+        raise _CommandError(_INVALID_PARAMS)
+    return value
+
+
+class VirtualBulb(object):
+    def __init__(
+        self,
+        ip="127.0.0.1",
+        port=0,
+        model="color",
+        name="",
+        support=None,
+        latency=0.0,
+        jitter=0.0,
+        loss=0.0,
+        rate_limit=60,
+        rate_period=60.0,
+        max_connections=4,
+        bulb_id=None,
+        seed=None,
+    ):
+        """
+        A simulated bulb.
+
+        Commands are applied instantly, whatever their effect and duration.
+        Changes are sent to the connected clients as ``props`` notifications,
+        except on the music mode connection.
+
+        :param str ip:                The IP address to listen on.
+        :param int port:              The port to listen on. If none is
+                                      specified, a random port will be chosen.
+        :param str model:             The model to report.
+        :param str name:              The name of the bulb.
+        :param tuple support:         The supported methods. Defaults to those
+                                      of the model.
+        :param float latency:         How many seconds the bulb takes to
+                                      answer a command.
+        :param float jitter:          The largest random deviation from the
+                                      latency, in seconds.
+        :param float loss:            The probability (0-1) of a command or
+                                      discovery request being ignored.
+        :param int rate_limit:        How many commands a connection may send
+                                      every ``rate_period`` seconds, outside
+                                      music mode. Commands over the quota get
+                                      an error. ``None`` disables the limit.
+        :param float rate_period:     The period of the rate limit, in seconds.
+        :param int max_connections:   How many clients may connect at once.
+        :param int bulb_id:           The ID of the bulb. Random if not given.
+        :param seed:                  The seed of the latency and loss
+                                      random generator.
+        """
+        self.ip = ip
+        self.port = port
+        self.model = model
+        self.support = tuple(support if support is not None else _MODEL_SUPPORT.get(model, COLOR_SUPPORT))
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.max_connections = max_connections
+        self.random = random.Random(seed)
+        self.id = bulb_id if bulb_id is not None else self.random.getrandbits(32)
+
+        #: The state of the bulb, as the firmware reports it.
+        self.properties = {
+            "power": "off",
+            "bright": "100",
+            "ct": "4000",
+            "rgb": "16711680",
+            "hue": "359",
+            "sat": "100",
+            "color_mode": "2",
+            "flowing": "0",
+            "delayoff": "0",
+            "flow_params": "",
+            "music_on": "0",
+            "name": name,
+        }
+        if "bg_set_power" in self.support:
+            self.properties.update(
+                {
+                    "bg_power": "off",
+                    "bg_flowing": "0",
+                    "bg_flow_params": "",
+                    "bg_ct": "4000",
+                    "bg_lmode": "2",
+                    "bg_bright": "100",
+                    "bg_rgb": "16711680",
+                    "bg_hue": "359",
+                    "bg_sat": "100",
+                    "nl_br": "0",
+                    "active_mode": "0",
+                }
+            )
+
+        #: The number of commands received, including dropped and refused ones.
+        self.received = 0
+        #: The number of commands ignored to simulate losses.
+        self.dropped = 0
+        #: The number of commands refused for exceeding the rate limit.
+        self.throttled = 0
+
+        self._server = None
+        self._writers = set()
+        self._music_writer = None
+        self._music_target = None  # Where to connect (or False to disconnect) after set_music.
+
+    def __repr__(self):
+        return "%s<%s:%s, %s>" % (self.__class__.__name__, self.ip, self.port, self.model)
+
+    @property
+    def music_mode(self):
+        """
+        Return whether a music mode connection is open.
+
+        :rtype: bool
+        """
+        return self._music_writer is not None
+
+    def discovery_reply(self):
+        """
+        Return the bulb's reply to an SSDP discovery request.
+
+        :rtype: bytes
+        """
+        lines = [
+            "HTTP/1.1 200 OK",
+            "Cache-Control: max-age=3600",
+            "Location: yeelight://%s:%s" % (self.ip, self.port),
+            "Server: POSIX UPnP/1.0 YGLC/1",
+            "id: 0x%016x" % self.id,
+            "model: %s" % self.model,
+            "fw_ver: 18",
+            "support: %s" % " ".join(self.support),
+        ]
+        for name in ("power", "bright", "color_mode", "ct", "rgb", "hue", "sat", "name"):
+            lines.append("%s: %s" % (name, self.properties[name]))
+        return ("\r\n".join(lines) + "\r\n").encode()
+
+    def delay(self):
+        """
+        Return how long to wait before answering, in seconds.
+
+        :rtype: float
+        """
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def lost(self):
+        """
+        Return whether to ignore the next request.
+
+        :rtype: bool
+        """
+        return self.loss > 0 and self.random.random() < self.loss
+
+    async def start(self):
+        """Start listening for clients."""
+        self._server = await asyncio.start_server(self._serve, self.ip, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening, and disconnect every client."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._writers):
+            writer.close()
+        self._close_music()
+
+    async def _serve(self, reader, writer):
+        if len(self._writers) >= self.max_connections:
+            writer.close()
+            return
+
+        self._writers.add(writer)
+        recent = deque()  # When the commands within the rate period were received.
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._handle(line, recent)
+                if response is not None and not writer.is_closing():
+                    writer.write((json.dumps(response) + "\r\n").encode())
+                    await writer.drain()
+                await self._after_command()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _serve_music(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self._handle(line, None)
+                await self._after_command()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if self._music_writer is writer:
+                self._close_music()
+
+    async def _handle(self, line, recent):
+        """
+        Run one command line.
+
+        :param deque recent: The times of the connection's recent commands,
+                             or None for the music mode connection.
+
+        :returns: The response to send, or None.
+        """
+        self.received += 1
+        try:
+            command = json.loads(line.decode())
+        except ValueError:
+            return None
+
+        if recent is not None and self.lost():
+            self.dropped += 1
+            return None
+
+        delay = self.delay()
+        if delay:
+            await asyncio.sleep(delay)
+
+        if recent is not None and self.rate_limit is not None:
+            now = time.monotonic()
+            while recent and recent[0] <= now - self.rate_period:
+                recent.popleft()
+            if len(recent) >= self.rate_limit:
+                self.throttled += 1
+                return {"id": command.get("id"), "error": _QUOTA_EXCEEDED}
+            recent.append(now)
+
+        changes = {}
+        try:
+            result = self.execute(command.get("method"), command.get("params", []), changes)
+        except _CommandError as ex:
+            return {"id": command.get("id"), "error": ex.error}
+        finally:
+            self._notify(changes)
+
+        if recent is None:
+            return None
+        return {"id": command.get("id"), "result": result}
+
+    async def _after_command(self):
+        """Open or close the music mode connection, once ``set_music`` has been answered."""
+        target, self._music_target = self._music_target, None
+        if target is None:
+            return
+
+        self._close_music()
+        if target is False:
+            return
+
+        try:
+            reader, writer = await asyncio.open_connection(*target)
+        except OSError as ex:
+            _LOGGER.debug("%s: Could not connect for music mode: %s", self, ex)
+            self._set({"music_on": "0"}, {})
+            return
+        self._music_writer = writer
+        asyncio.ensure_future(self._serve_music(reader, writer))
+
+    def _close_music(self):
+        writer, self._music_writer = self._music_writer, None
+        if writer is not None:
+            writer.close()
+            self.properties["music_on"] = "0"
+
+    def _notify(self, changes):
+        """Send a ``props`` notification with the changed properties to every client."""
+        if not changes:
+            return
+        data = (json.dumps({"method": "props", "params": changes}) + "\r\n").encode()
+        for writer in self._writers:
+            if not writer.is_closing():
+                writer.write(data)
+
+    def _set(self, values, changes):
+        """Update properties, recording the ones that changed."""
+        for name, value in values.items():
+            value = str(value)
+            if self.properties.get(name) != value:
+                self.properties[name] = value
+                changes[name] = value
+
+    def execute(self, method, params, changes=None):
+        """
+        Apply a command to the state of the bulb.
+
+        :param str method:   The name of the method.
+        :param list params:  The parameters of the method.
+        :param dict changes: Where to record the properties that changed.
+
+        :returns: The result of the command.
+        :rtype: list
+        """
+        changes = changes if changes is not None else {}
+        if method not in self.support:
+            raise _CommandError(_UNSUPPORTED)
+
+        prefix = "bg_" if method.startswith("bg_") else ""
+        name = method[len(prefix) :]
+        if name in _NEEDS_POWER and self.properties[prefix + "power"] != "on":
+            raise _CommandError(_POWERED_OFF)
+
+        handler = getattr(self, "_cmd_" + name, None)
+        if handler is None:
+            return ["ok"]
+        return handler(prefix, list(params), changes)
+
+    def _cmd_get_prop(self, prefix, params, changes):
+        return [self.properties.get(name, "") for name in params]
+
+    def _cmd_set_power(self, prefix, params, changes):
+        if not params or params[0] not in ("on", "off"):
+            raise _CommandError(_INVALID_PARAMS)
+        values = {prefix + "power": params[0]}
+        if params[0] == "off":
+            values[prefix + "flowing"] = 0
+        self._set(values, changes)
+        return ["ok"]
+
+    def _cmd_toggle(self, prefix, params, changes):
+        power = "off" if self.properties[prefix + "power"] == "on" else "on"
+        return self._cmd_set_power(prefix, [power], changes)
+
+    def _cmd_dev_toggle(self, prefix, params, changes):
+        power = "off" if self.properties["power"] == "on" else "on"
+        self._cmd_set_power("", [power], changes)
+        return self._cmd_set_power("bg_", [power], changes)
+
+    def _cmd_set_bright(self, prefix, params, changes):
+        self._set({prefix + "bright": _int_param(params, 0, 1, 100)}, changes)
+        return ["ok"]
+
+    def _color_mode(self, prefix, mode):
+        return {(prefix + "lmode" if prefix else "color_mode"): mode, prefix + "flowing": 0}
+
+    def _cmd_set_ct_abx(self, prefix, params, changes):
+        values = self._color_mode(prefix, 2)
+        values[prefix + "ct"] = _int_param(params, 0, 1700, 6500)
+        self._set(values, changes)
+        return ["ok"]
+
+    def _cmd_set_rgb(self, prefix, params, changes):
+        values = self._color_mode(prefix, 1)
+        values[prefix + "rgb"] = _int_param(params, 0, 0, 0xFFFFFF)
+        self._set(values, changes)
+        return ["ok"]
+
+    def _cmd_set_hsv(self, prefix, params, changes):
+        values = self._color_mode(prefix, 3)
+        values[prefix + "hue"] = _int_param(params, 0, 0, 359)
+        values[prefix + "sat"] = _int_param(params, 1, 0, 100)
+        self._set(values, changes)
+        return ["ok"]
+
+    def _cmd_start_cf(self, prefix, params, changes):
+        if len(params) != 3:
+            raise _CommandError(_INVALID_PARAMS)
+        self._set({prefix + "flowing": 1, prefix + "flow_params": "%s,%s,%s" % tuple(params)}, changes)
+        return ["ok"]
+
+    def _cmd_stop_cf(self, prefix, params, changes):
+        self._set({prefix + "flowing": 0}, changes)
+        return ["ok"]
+
+    def _cmd_set_scene(self, prefix, params, changes):
+        if not params:
+            raise _CommandError(_INVALID_PARAMS)
+        self._cmd_set_power(prefix, ["on"], changes)
+        scene = params[0]
+        if scene == "color":
+            self._cmd_set_rgb(prefix, params[1:], changes)
+            self._cmd_set_bright(prefix, params[2:], changes)
+        elif scene == "hsv":
+            self._cmd_set_hsv(prefix, params[1:], changes)
+            self._cmd_set_bright(prefix, params[3:], changes)
+        elif scene == "ct":
+            self._cmd_set_ct_abx(prefix, params[1:], changes)
+            self._cmd_set_bright(prefix, params[2:], changes)
+        elif scene == "cf":
+            self._cmd_start_cf(prefix, params[1:], changes)
+        elif scene == "auto_delay_off":
+            self._cmd_set_bright(prefix, params[1:], changes)
+            self._set({"delayoff": _int_param(params, 2, 1, 60 * 24)}, changes)
+        else:
+            raise _CommandError(_INVALID_PARAMS)
+        return ["ok"]
+
+    def _cmd_set_name(self, prefix, params, changes):
+        if not params:
+            raise _CommandError(_INVALID_PARAMS)
+        self._set({"name": params[0]}, changes)
+        return ["ok"]
+
+    def _adjust(self, prefix, prop, percentage, changes):
+        if prop == "bright":
+            bright = int(self.properties[prefix + "bright"])
+            self._set({prefix + "bright": max(1, min(100, bright + percentage))}, changes)
+        elif prop == "ct":
+            ct = int(self.properties[prefix + "ct"])
+            values = self._color_mode(prefix, 2)
+            values[prefix + "ct"] = max(1700, min(6500, ct + (6500 - 1700) * percentage // 100))
+            self._set(values, changes)
+
+    def _cmd_set_adjust(self, prefix, params, changes):
+        if len(params) != 2 or params[0] not in ("increase", "decrease", "circle"):
+            raise _CommandError(_INVALID_PARAMS)
+        step = {"increase": 10, "decrease": -10, "circle": 10}[params[0]]
+        self._adjust(prefix, params[1], step, changes)
+        return ["ok"]
+
+    def _cmd_adjust_bright(self, prefix, params, changes):
+        self._adjust(prefix, "bright", _int_param(params, 0, -100, 100), changes)
+        return ["ok"]
+
+    def _cmd_adjust_ct(self, prefix, params, changes):
+        self._adjust(prefix, "ct", _int_param(params, 0, -100, 100), changes)
+        return ["ok"]
+
+    def _cmd_cron_add(self, prefix, params, changes):
+        self._set({"delayoff": _int_param(params, 1, 1, 60 * 24)}, changes)
+        return ["ok"]
+
+    def _cmd_cron_get(self, prefix, params, changes):
+        delay = int(self.properties["delayoff"])
+        return [{"type": 0, "delay": delay, "mix": 0}] if delay else []
+
+    def _cmd_cron_del(self, prefix, params, changes):
+        self._set({"delayoff": 0}, changes)
+        return ["ok"]
+
+    def _cmd_set_music(self, prefix, params, changes):
+        if params[:1] == [1] and len(params) == 3:
+            self._music_target = (params[1], int(params[2]))
+            self._set({"music_on": 1}, changes)
+        elif params[:1] == [0]:
+            self._music_target = False
+        else:
+            raise _CommandError(_INVALID_PARAMS)
+        return ["ok"]
+
+
+class _SSDPResponder(asyncio.DatagramProtocol):
+    """Answer discovery requests on behalf of every simulated bulb."""
+
+    def __init__(self, bulbs):
+        self.bulbs = bulbs
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if not data.startswith(b"M-SEARCH"):
+            return
+
+        loop = asyncio.get_event_loop()
+        for bulb in self.bulbs:
+            if not bulb.lost():
+                loop.call_later(bulb.delay(), self._reply, bulb, addr)
+
+    def _reply(self, bulb, addr):
+        if not self.transport.is_closing():
+            self.transport.sendto(bulb.discovery_reply(), addr)
+
+
+class Simulator(object):
+    def __init__(self, count=1, ip="127.0.0.1", distinct_ips=False, models=("color",), seed=None, **bulb_kwargs):
+        """
+        A fleet of simulated bulbs, run by an event loop in a background thread.
+
+        All the bulbs share one thread, so thousands of them fit on a laptop
+        (each one needs a listening socket, plus one per connected client).
+
+        :param int count:         The number of bulbs.
+        :param str ip:            The IP address the bulbs listen on.
+        :param bool distinct_ips: Give every bulb its own loopback address
+                                  (127.0.x.y), like bulbs on a real network.
+                                  ``ip`` must then be a loopback address.
+        :param tuple models:      The models of the bulbs, used in turn.
+        :param seed:              The seed of the bulbs' random generators,
+                                  for reproducible latencies and losses.
+
+        Other keyword arguments are passed to every :py:class:`VirtualBulb`.
+        """
+        self.ip = ip
+        self.bulbs = []
+        for index in range(count):
+            bulb_ip = "127.0.%s.%s" % divmod(index + 2, 256) if distinct_ips else ip
+            self.bulbs.append(
+                VirtualBulb(
+                    ip=bulb_ip,
+                    model=models[index % len(models)],
+                    name="bulb %s" % (index + 1),
+                    bulb_id=index + 1,
+                    seed=None if seed is None else seed + index,
+                    **bulb_kwargs,
+                )
+            )
+
+        #: The (host, port) address of the discovery responder, once started.
+        self.ssdp_address = None
+
+        self._loop = None
+        self._thread = None
+        self._transport = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __len__(self):
+        return len(self.bulbs)
+
+    def __iter__(self):
+        return iter(self.bulbs)
+
+    def start(self):
+        """Start the bulbs and the discovery responder."""
+        if self._thread is not None:
+            return
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="yeelight simulator")
+        self._thread.daemon = True
+        self._thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        except Exception:
+            self.stop()
+            raise
+
+    async def _start(self):
+        await asyncio.gather(*(bulb.start() for bulb in self.bulbs))
+        self._transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _SSDPResponder(self.bulbs), local_addr=(self.ip, 0)
+        )
+        self.ssdp_address = self._transport.get_extra_info("sockname")[:2]
+
+    def stop(self):
+        """Stop the bulbs, disconnecting their clients."""
+        if self._thread is None:
+            return
+
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = self._loop = None
+
+    async def _stop(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        await asyncio.gather(*(bulb.stop() for bulb in self.bulbs))
+
+    def discovery_info(self):
+        """
+        Return the bulbs as discovery would report them.
+
+        :rtype: list
+        """
+        return [_parse_discovery_reply(bulb.discovery_reply()) for bulb in self.bulbs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate YeeLight bulbs on this machine.")
+    parser.add_argument("-n", "--count", type=int, default=10, help="the number of bulbs")
+    parser.add_argument("--ip", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="the response latency, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="the latency jitter, in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="the probability of ignoring a command")
+    args = parser.parse_args()
+
+    simulator = Simulator(args.count, args.ip, latency=args.latency, jitter=args.jitter, loss=args.loss)
+    with simulator:
+        print("Discovery responder: %s:%s" % simulator.ssdp_address)
+        for bulb in simulator:
+            print("%s: %s:%s" % (bulb.properties["name"], bulb.ip, bulb.port))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Sunrises computed from the sun's position, sampled into as few transitions as possible.
+
+This module needs `numpy <https://numpy.org>`_.
+"""
+
+import numpy as np
+
+from .colors import blackbody_array, rgb_to_hsv_array
+from .flow import Action, Flow, HSVTransition, TemperatureTransition
+
+#: The lowest color temperature the bulbs can show as a temperature. Redder
+#: keyframes are sent as HSV colors instead.
+MIN_TEMPERATURE = 1700
+
+#: The highest color temperature the bulbs can show.
+MAX_TEMPERATURE = 6500
+
+#: The shortest transition the bulbs accept, in milliseconds.
+MIN_DURATION = 50
+
+# Rayleigh scattering optical depth of the atmosphere, tau = a * lambda^-4
+# (lambda in micrometers), and the second radiation constant, in um*K.
+_RAYLEIGH = 0.0088
+_C2 = 14388.0
+# Wavelength at which the scattering is linearized, in micrometers.
+_LAMBDA = 0.55
+
+
+def air_mass(elevation):
+    """
+    Return the relative optical air mass at a solar elevation.
+
+    Uses the Kasten-Young formula, which holds down to the horizon.
+
+    :param elevation: The elevation of the sun, in degrees. Negative values
+                      are treated as the horizon.
+
+    :rtype: numpy.ndarray
+    """
+    elevation = np.maximum(np.asarray(elevation, dtype=float), 0.0)
+    return 1.0 / (np.sin(np.radians(elevation)) + 0.50572 * (elevation + 6.07995) ** -1.6364)
+
+
+class Sunrise(object):
+    def __init__(
+        self,
+        duration,
+        start_elevation=0.0,
+        end_elevation=30.0,
+        min_brightness=1,
+        max_brightness=100,
+        sun_temperature=5778,
+        optical_depth=0.15,
+    ):
+        """
+        The color and brightness of the sun as it rises, squeezed into ``duration``.
+
+        The sun's elevation grows linearly with time. Its light is modelled as
+        a black body at ``sun_temperature`` reddened by Rayleigh scattering
+        along the air mass it crosses: linearizing the scattering around 550
+        nm shifts the color temperature by a constant number of mireds per
+        air mass (about 15), so the color stays on the blackbody locus, from
+        about 1400 K at the horizon to about 5000 K at 30 degrees. The
+        brightness follows the perceived brightness (Stevens' cube root law) of
+        the direct illuminance, scaled between ``min_brightness`` and
+        ``max_brightness``.
+
+        Example:
+
+        >>> sunrise = Sunrise(duration=30 * 60 * 1000)
+        >>> chain = FlowChain(bulb, sunrise.flow())
+
+        :param int duration:            The length of the sunrise, in milliseconds.
+        :param float start_elevation:   The elevation of the sun at the start, in degrees.
+        :param float end_elevation:     The elevation of the sun at the end, in degrees.
+        :param int min_brightness:      The brightness at the start (1-100).
+        :param int max_brightness:      The brightness at the end (1-100).
+        :param float sun_temperature:   The color temperature of the sun
+                                        outside the atmosphere, in degrees Kelvin.
+        :param float optical_depth:     The broadband optical depth of the
+                                        atmosphere, higher for hazier skies.
+        """
+        self.duration = duration
+        self.start_elevation = start_elevation
+        self.end_elevation = end_elevation
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.sun_temperature = sun_temperature
+        self.optical_depth = optical_depth
+
+    def elevation(self, times):
+        """
+        Return the elevation of the sun at the given times.
+
+        :param times: Milliseconds since the start of the sunrise.
+
+        :rtype: numpy.ndarray
+        """
+        progress = np.clip(np.asarray(times, dtype=float) / self.duration, 0, 1)
+        return self.start_elevation + (self.end_elevation - self.start_elevation) * progress
+
+    def temperature(self, times):
+        """
+        Return the color temperature of the sunlight at the given times.
+
+        :param times: Milliseconds since the start of the sunrise.
+
+        :returns: The temperatures, in degrees Kelvin.
+        :rtype: numpy.ndarray
+        """
+        shift = 4 * _RAYLEIGH * _LAMBDA ** -3 / _C2 * 1e6  # Mireds per air mass.
+        mired = 1e6 / self.sun_temperature + shift * air_mass(self.elevation(times))
+        return np.minimum(1e6 / mired, MAX_TEMPERATURE)
+
+    def brightness(self, times):
+        """
+        Return the brightness of the sunlight at the given times.
+
+        :param times: Milliseconds since the start of the sunrise.
+
+        :returns: The brightness (1-100).
+        :rtype: numpy.ndarray
+        """
+        elevation = self.elevation(times)
+        illuminance = np.sin(np.radians(np.maximum(elevation, 0))) * np.exp(-self.optical_depth * air_mass(elevation))
+        final = np.sin(np.radians(max(self.end_elevation, 0))) * np.exp(
+            -self.optical_depth * air_mass(self.end_elevation)
+        )
+        perceived = np.cbrt(illuminance / final) if final > 0 else np.zeros_like(illuminance)
+        return self.min_brightness + (self.max_brightness - self.min_brightness) * np.clip(perceived, 0, 1)
+
+    def sample(self, resolution=1000, start=0):
+        """
+        Sample the sunrise at regular intervals.
+
+        :param int resolution: The interval between samples, in milliseconds.
+        :param int start:      When to start sampling, in milliseconds since
+                               the start of the sunrise.
+
+        :returns: The times, temperatures and brightnesses of the samples.
+        :rtype: tuple
+        """
+        times = np.arange(start, self.duration, resolution, dtype=float)
+        times = np.append(times, float(self.duration))
+        return times, self.temperature(times), self.brightness(times)
+
+    def transitions(
+        self,
+        mired_tolerance=10,
+        brightness_tolerance=2,
+        hue_tolerance=2,
+        resolution=1000,
+        start=0,
+        start_duration=MIN_DURATION,
+    ):
+        """
+        Return the fewest transitions that follow the sunrise within the tolerances.
+
+        The first transition goes to the color at ``start`` in
+        ``start_duration``, the following ones follow the curve (see
+        :py:func:`fit_keyframes`).
+
+        :param float mired_tolerance:      The largest color temperature error, in mireds.
+        :param float brightness_tolerance: The largest brightness error, in percent.
+        :param float hue_tolerance:        The largest hue error below
+                                           ``MIN_TEMPERATURE``, in degrees.
+        :param int resolution:             The interval between samples of the
+                                           curve, in milliseconds.
+        :param int start:                  Where the lamp joins the sunrise, in
+                                           milliseconds since its start.
+        :param int start_duration:         The length of the first transition,
+                                           in milliseconds.
+
+        :returns: A list of transitions.
+        :rtype: list
+        """
+        times, kelvin, brightness = self.sample(resolution, start)
+        keyframes = fit_keyframes(
+            times,
+            kelvin,
+            brightness,
+            mired_tolerance=mired_tolerance,
+            brightness_tolerance=brightness_tolerance,
+            hue_tolerance=hue_tolerance,
+        )
+        return keyframes_to_transitions(times, kelvin, brightness, keyframes, start_duration)
+
+    def flow(self, **kwargs):
+        """
+        Return a flow playing the sunrise once, and staying at its end.
+
+        Sunrises usually need more transitions than a bulb accepts in one
+        flow; play the result with a :py:class:`FlowChain <yeelight.FlowChain>`.
+        Takes the same arguments as :py:meth:`transitions`.
+
+        :rtype: yeelight.Flow
+        """
+        return Flow(count=1, action=Action.stay, transitions=self.transitions(**kwargs))
+
+
+def _segment_fits(times, kelvin, mired, brightness, hue, first, last, tolerances):
+    """Return whether interpolating between two samples stays within the tolerances."""
+    mired_tolerance, brightness_tolerance, hue_tolerance = tolerances
+    span = slice(first, last + 1)
+    progress = (times[span] - times[first]) / (times[last] - times[first])
+
+    def error(values):
+        return np.abs(values[first] + (values[last] - values[first]) * progress - values[span]).max()
+
+    if error(brightness) > brightness_tolerance:
+        return False
+    if hue is not None:
+        return error(hue) <= hue_tolerance
+    # The bulbs interpolate in Kelvin, but mireds are what the eye sees.
+    interpolated = kelvin[first] + (kelvin[last] - kelvin[first]) * progress
+    return np.abs(1e6 / interpolated - mired[span]).max() <= mired_tolerance
+
+
+def _fit_part(times, kelvin, brightness, hue, first, last, tolerances):
+    """Greedily pick keyframes between two samples, each reaching as far as it can."""
+    mired = 1e6 / kelvin
+    keyframes = [first]
+    current = first
+    while current < last:
+        # Gallop forward to bracket the farthest reachable sample, then bisect.
+        good, step = current + 1, 2
+        while current + step <= last and _segment_fits(
+            times, kelvin, mired, brightness, hue, current, current + step, tolerances
+        ):
+            good = current + step
+            step *= 2
+        bad = min(current + step, last + 1)
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            if _segment_fits(times, kelvin, mired, brightness, hue, current, middle, tolerances):
+                good = middle
+            else:
+                bad = middle
+        keyframes.append(good)
+        current = good
+    return keyframes
+
+
+def fit_keyframes(times, kelvin, brightness, mired_tolerance=10, brightness_tolerance=2, hue_tolerance=2):
+    """
+    Pick the samples of a curve to use as keyframes.
+
+    Between two keyframes, the bulb interpolates linearly; every sample in
+    between must stay within the tolerances of that interpolation. Each
+    keyframe is placed as far from the previous one as the tolerances allow,
+    which checks a segment in one vectorized pass and needs a logarithmic
+    number of passes per keyframe. A keyframe is always placed where the
+    curve crosses ``MIN_TEMPERATURE``, since the bulb switches from HSV
+    colors to color temperatures there.
+
+    :param times:                      The times of the samples, in milliseconds.
+    :param kelvin:                     The color temperature of the samples.
+    :param brightness:                 The brightness of the samples.
+    :param float mired_tolerance:      The largest color temperature error, in mireds.
+    :param float brightness_tolerance: The largest brightness error, in percent.
+    :param float hue_tolerance:        The largest hue error below
+                                       ``MIN_TEMPERATURE``, in degrees.
+
+    :returns: The indices of the keyframes, including the first and last samples.
+    :rtype: list
+    """
+    times = np.asarray(times, dtype=float)
+    kelvin = np.asarray(kelvin, dtype=float)
+    brightness = np.asarray(brightness, dtype=float)
+    tolerances = (mired_tolerance, brightness_tolerance, hue_tolerance)
+    last = len(times) - 1
+    if last <= 0:
+        return list(range(len(times)))
+
+    hue, _, _ = rgb_to_hsv_array(*blackbody_array(kelvin))
+    hsv = kelvin < MIN_TEMPERATURE
+
+    # Split the curve wherever it switches between HSV and temperature.
+    boundaries = [0] + list(np.flatnonzero(hsv[1:] != hsv[:-1]) + 1) + [last]
+    keyframes = [0]
+    for first, end in zip(boundaries, boundaries[1:]):
+        if end == first:
+            continue
+        part_hue = hue if hsv[first] else None
+        keyframes.extend(_fit_part(times, kelvin, brightness, part_hue, first, end, tolerances)[1:])
+    return keyframes
+
+
+def keyframes_to_transitions(times, kelvin, brightness, keyframes, start_duration=MIN_DURATION):
+    """
+    Turn keyframes into transitions.
+
+    Keyframes redder than ``MIN_TEMPERATURE`` become :py:class:`HSVTransition
+    <yeelight.HSVTransition>`\\ s, the others :py:class:`TemperatureTransition
+    <yeelight.TemperatureTransition>`\\ s.
+
+    :param times:              The times of the samples, in milliseconds.
+    :param kelvin:             The color temperature of the samples.
+    :param brightness:         The brightness of the samples.
+    :param list keyframes:     The indices of the samples to use.
+    :param int start_duration: The length of the transition to the first keyframe.
+
+    :returns: A list of transitions.
+    :rtype: list
+    """
+    keyframes = np.asarray(keyframes, dtype=int)
+    kelvin = np.asarray(kelvin, dtype=float)[keyframes]
+    brightness = np.clip(np.rint(np.asarray(brightness, dtype=float)[keyframes]), 1, 100).astype(int)
+    hue, saturation, _ = rgb_to_hsv_array(*blackbody_array(kelvin))
+    durations = np.diff(np.asarray(times, dtype=float)[keyframes], prepend=np.nan)
+    durations[0] = start_duration
+    durations = np.maximum(np.rint(durations), MIN_DURATION).astype(int)
+
+    transitions = []
+    for index in range(len(keyframes)):
+        if kelvin[index] < MIN_TEMPERATURE:
+            transition = HSVTransition(
+                int(round(hue[index])),
+                int(round(saturation[index])),
+                duration=int(durations[index]),
+                brightness=int(brightness[index]),
+            )
+        else:
+            transition = TemperatureTransition(
+                int(round(kelvin[index])), duration=int(durations[index]), brightness=int(brightness[index])
+            )
+        transitions.append(transition)
+    return transitions
+
+
+def sunrise(duration, mired_tolerance=10, brightness_tolerance=2, **kwargs):
+    """
+    A sunrise, following the sun's color and brightness.
+
+    :param int duration:               The length of the sunrise, in milliseconds.
+    :param float mired_tolerance:      The largest color temperature error, in mireds.
+    :param float brightness_tolerance: The largest brightness error, in percent.
+
+    Other keyword arguments are passed to :py:class:`Sunrise`.
+
+    :returns: A list of transitions.
+    :rtype: list
+    """
+    curve = Sunrise(duration, **kwargs)
+    return curve.transitions(mired_tolerance=mired_tolerance, brightness_tolerance=brightness_tolerance)
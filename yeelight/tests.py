@@ -1,24 +1,97 @@
+import asyncio
+import inspect
 import json
 import os
+import socket
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
-from yeelight import Bulb, Flow, TemperatureTransition, enums
+from yeelight import (
+    AsyncBulb,
+    AsyncScheduler,
+    Bulb,
+    BulbException,
+    BulbGroup,
+    BulbRegistry,
+    ConnectionManager,
+    DiscoveryCache,
+    Flow,
+    FlowChain,
+    HSVTransition,
+    Instrumentation,
+    LatencyHistogram,
+    MusicHub,
+    RateLimiter,
+    Scheduler,
+    SleepTransition,
+    TemperatureTransition,
+    discover_bulbs,
+    discover_bulbs_iter,
+    enums,
+)
 from yeelight.enums import LightType, SceneClass
 from yeelight.flow import Action
+from yeelight.main import _encode_command
+from yeelight.transitions import alarm
+from yeelight.simulator import Simulator
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
 
 sys.path.insert(0, os.path.abspath(__file__ + "/../.."))
 
 
 class SocketMock(object):
-    def __init__(self, received=b'{"id": 0, "result": ["ok"]}'):
+    def __init__(self, received=None):
         self.received = received
 
     def send(self, data):
         self.sent = json.loads(data.decode("utf8"))
 
     def recv(self, length):
-        return self.received
+        if self.received is not None:
+            return self.received
+        return json.dumps({"id": self.sent["id"], "result": ["ok"]}).encode("utf8")
+
+
+class PipelineSocketMock(object):
+    """Collect every command and answer all of them at once, in reverse order."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(json.loads(data.decode("utf8")))
+
+    def recv(self, length):
+        replies = [{"id": command["id"], "result": [command["method"]]} for command in reversed(self.sent)]
+        self.sent = []
+        return b"".join(json.dumps(reply).encode("utf8") + b"\r\n" for reply in replies)
+
+
+class PropertiesSocketMock(object):
+    """Answer get_prop with the given properties, and everything else with "ok"."""
+
+    def __init__(self, properties):
+        self.properties = properties
+        self.methods = []
+
+    def send(self, data):
+        self.sent = json.loads(data.decode("utf8"))
+        self.methods.append(self.sent["method"])
+
+    def recv(self, length):
+        if self.sent["method"] == "get_prop":
+            result = [self.properties.get(name, "") for name in self.sent["params"]]
+        else:
+            result = ["ok"]
+        return json.dumps({"id": self.sent["id"], "result": result}).encode("utf8")
 
 
 class Tests(unittest.TestCase):
@@ -183,6 +256,799 @@ class Tests(unittest.TestCase):
         self.assertEqual(self.socket.sent["method"], "set_scene")
         self.assertEqual(self.socket.sent["params"], ["auto_delay_off", 20, 1])
 
+    def test_command_keeps_signature(self):
+        signature = inspect.signature(Bulb.set_brightness)
+        self.assertEqual(list(signature.parameters), ["self", "brightness", "light_type", "kwargs"])
+        self.assertIn("Set the bulb's brightness.", Bulb.set_brightness.__doc__)
+        self.assertEqual(Bulb.set_brightness.__name__, "set_brightness")
+
+    def test_music_mode_cache(self):
+        self.bulb._music_mode = True
+        self.bulb._last_properties = {"power": "on", "bg_power": "on"}
+        self.bulb.set_rgb(255, 0, 0, light_type=LightType.Ambient)
+        self.assertEqual(self.socket.sent["method"], "bg_set_rgb")
+        self.assertEqual(self.bulb._last_properties["bg_rgb"], "16711680")
+        self.bulb.dev_toggle()
+        self.assertEqual(self.bulb._last_properties["power"], "off")
+        self.assertEqual(self.bulb._last_properties["bg_power"], "off")
+
+    def test_shadow_state(self):
+        self.socket = PropertiesSocketMock({"power": "off", "bright": "50"})
+        self.bulb = Bulb(ip="", auto_on=True, max_property_age=60)
+        self.bulb._Bulb__socket = self.socket
+
+        self.assertEqual(self.bulb.get_properties()["power"], "off")
+        self.bulb.set_brightness(10)
+        self.bulb.set_brightness(20)
+        # The power was read once, and the bulb was turned on once.
+        self.assertEqual(self.socket.methods, ["get_prop", "set_power", "set_bright", "set_bright"])
+        # The values we set are stored as strings, like the bulb reports them.
+        self.assertEqual(self.bulb.get_properties(["power", "bright"])["bright"], "20")
+        self.assertEqual(self.bulb.unconfirmed_properties, {"power", "bright"})
+        self.assertEqual(self.bulb.last_properties["current_brightness"], "20")
+
+        self.bulb._dispatch({"method": "props", "params": {"bright": "25"}})
+        self.assertEqual(self.bulb.unconfirmed_properties, {"power"})
+        self.assertEqual(self.bulb.get_properties(["bright"])["bright"], "25")
+        self.assertEqual(len(self.socket.methods), 4)
+
+        self.bulb.get_properties(["bright"], max_age=0)
+        self.assertEqual(self.socket.methods[-1], "get_prop")
+
+    def test_minimal_property_sets(self):
+        self.socket = PropertiesSocketMock({"power": "on", "bright": "50", "name": "desk"})
+        self.bulb = Bulb(ip="", model="mono")
+        self.bulb._Bulb__socket = self.socket
+        properties = self.bulb.get_properties()
+        self.assertEqual(self.socket.sent["params"], ["power", "bright", "flowing", "delayoff", "music_on", "name"])
+        self.assertIsNone(properties["rgb"])
+        self.assertIsNone(properties["bg_power"])
+        self.assertEqual(self.bulb.bulb_type, enums.BulbType.White)
+
+        self.bulb = Bulb(ip="", support="get_prop set_power set_bright set_ct_abx bg_set_power set_name")
+        self.bulb._Bulb__socket = self.socket
+        self.bulb.get_properties()
+        self.assertNotIn("rgb", self.socket.sent["params"])
+        self.assertIn("bg_ct", self.socket.sent["params"])
+        self.assertIn("nl_br", self.socket.sent["params"])  # The model is unknown.
+
+    def test_capability_profile(self):
+        support = "get_prop set_power toggle set_bright set_ct_abx start_cf bg_set_power bg_set_rgb"
+        self.bulb = Bulb(ip="", capabilities={"id": "0x1", "model": "ceiling10", "support": support})
+        self.bulb._Bulb__socket = self.socket = PropertiesSocketMock({})
+        self.assertEqual(self.bulb.model, "ceiling10")
+        self.assertEqual(self.bulb.bulb_type, enums.BulbType.WhiteTempMood)
+        self.assertEqual(self.bulb.get_model_specs()["color_temp"], {"min": 2700, "max": 6500})
+        self.assertTrue(self.bulb.supports("set_rgb", light_type=LightType.Ambient))
+        self.assertFalse(self.bulb.supports("set_rgb"))
+
+        # Unsupported commands fail without being sent.
+        with self.assertRaises(BulbException) as raised:
+            self.bulb.set_rgb(255, 0, 0)
+        self.assertEqual(raised.exception.args[0]["message"], "method not supported")
+        self.assertRaises(BulbException, self.bulb.set_brightness, 50, light_type=LightType.Ambient)
+        self.assertRaises(BulbException, self.bulb.send_commands, [("set_power", ["on"]), ("set_name", ["x"])])
+        self.assertEqual(self.socket.methods, [])
+
+        # Without a support list, the model's specs tell what the bulb lacks,
+        # for the commands as for the properties.
+        self.bulb = Bulb(ip="", model="mono")
+        self.bulb._Bulb__socket = self.socket
+        self.assertEqual(self.bulb.bulb_type, enums.BulbType.White)
+        self.assertRaises(BulbException, self.bulb.turn_on, light_type=LightType.Ambient)
+        self.assertRaises(BulbException, self.bulb.set_rgb, 255, 0, 0)
+        self.assertRaises(BulbException, self.bulb.set_color_temp, 2700)
+        self.assertTrue(self.bulb.supports("set_name"))
+        self.assertEqual(self.socket.methods, [])
+        self.bulb.get_properties()
+        self.assertNotIn("rgb", self.socket.sent["params"])
+        self.assertNotIn("ct", self.socket.sent["params"])
+
+    def test_toggle_unknown_power(self):
+        self.bulb._last_properties = {"power": None}
+        self.bulb._property_times = {"power": time.monotonic()}
+        self.bulb.auto_on = False
+        self.bulb.toggle()
+        self.assertNotIn("power", self.bulb.last_properties)
+        self.assertIsNone(self.bulb.property_age("power"))
+
+    def test_start_flow_encoded_once(self):
+        flow = Flow(count=2, transitions=[HSVTransition(120, 100, duration=500), SleepTransition(500)])
+        for _ in range(2):
+            self.bulb.start_flow(flow)
+            self.assertEqual(self.socket.sent["method"], "start_cf")
+            self.assertEqual(self.socket.sent["params"], [4, 0, "500, 1, 65281, 100, 500, 7, 1, 2"])
+        self.assertEqual(list(flow.as_start_flow_params.encoded), ["start_cf"])
+        self.assertEqual(
+            _encode_command(7, "start_cf", flow.as_start_flow_params),
+            _encode_command(7, "start_cf", [4, 0, flow.expression]),
+        )
+
+    def test_flows_are_immutable(self):
+        flow = Flow(transitions=alarm())
+        self.assertIs(alarm()[0], flow.transitions[0])
+        with self.assertRaises(AttributeError):
+            flow.count = 3
+        with self.assertRaises(AttributeError):
+            flow.transitions[0].brightness = 10
+
+    def test_send_commands_matches_ids(self):
+        self.bulb._Bulb__socket = PipelineSocketMock()
+        responses = self.bulb.send_commands([("set_bright", [10]), ("set_ct_abx", [2700]), ("get_prop", ["power"])])
+        self.assertEqual([r["result"] for r in responses], [["set_bright"], ["set_ct_abx"], ["get_prop"]])
+        self.assertEqual(self.bulb._pending, {})
+
+
+class FlowChainTests(unittest.TestCase):
+    def setUp(self):
+        self.transitions = [TemperatureTransition(1700 + 100 * i, duration=50) for i in range(12)]
+
+    def test_segments(self):
+        segments = Flow(count=1, action=Action.off, transitions=self.transitions).segments()
+        self.assertEqual([len(segment.transitions) for segment in segments], [9, 3])
+        self.assertEqual([segment.action for segment in segments], [Action.stay, Action.off])
+        self.assertEqual(sum(segment.duration for segment in segments), 600)
+
+        short = Flow(count=2, transitions=self.transitions[:3])
+        self.assertEqual(short.segments(), [short])
+
+    def test_chain(self):
+        bulb = Bulb(ip="")
+        bulb._Bulb__socket = PipelineSocketMock()
+        sent = []
+        bulb._Bulb__socket.send = lambda data: sent.append((time.monotonic(), json.loads(data.decode("utf8"))))
+        bulb._Bulb__socket.recv = lambda length: json.dumps({"id": sent[-1][1]["id"], "result": ["ok"]}).encode()
+
+        chain = FlowChain(bulb, Flow(count=1, action=Action.stay, transitions=self.transitions))
+        start = time.monotonic()
+        chain.start()
+        self.assertTrue(chain.wait(5))
+
+        self.assertEqual([command["params"][0] for _, command in sent], [9, 3])
+        # The second segment is due when the first one ends, from the start of the chain.
+        self.assertGreaterEqual(sent[1][0] - start, 0.45)
+
+    def test_slow_bulb_doesnt_delay_other_chains(self):
+        slow = Bulb(ip="")
+        slow.start_flow = lambda flow, light_type: time.sleep(0.5)
+        fast = Bulb(ip="")
+        started = []
+        fast.start_flow = lambda flow, light_type: started.append(time.monotonic())
+
+        flow = Flow(count=1, action=Action.stay, transitions=self.transitions)
+        chains = [FlowChain(slow, flow), FlowChain(fast, flow)]
+        start = time.monotonic()
+        for chain in chains:
+            chain.start()
+        self.assertTrue(chains[1].wait(5))
+        self.assertLess(started[0] - start, 0.2)
+        self.assertLess(started[1] - start, 0.65)
+        self.assertTrue(chains[0].wait(5))
+
+
+class SchedulerTests(unittest.TestCase):
+    def test_deadlines_and_lateness(self):
+        scheduler = Scheduler(max_workers=1)
+        start = time.monotonic()
+        calls = []
+        slow = scheduler.call_at(start + 0.05, lambda: time.sleep(0.1) or calls.append("slow"))
+        fast = scheduler.call_at(start + 0.1, lambda: calls.append(time.monotonic() - start))
+        cancelled = scheduler.call_at(start + 0.1, calls.append, "cancelled")
+        cancelled.cancel()
+
+        self.assertTrue(fast.wait(5))
+        scheduler.stop()
+        self.assertEqual(calls[0], "slow")
+        # The slow call delays the next one, but doesn't shift later deadlines.
+        self.assertGreaterEqual(fast.lateness, 0.04)
+        self.assertLess(slow.lateness, 0.05)
+        self.assertTrue(cancelled.done)
+        self.assertEqual(len(calls), 2)
+
+    def test_slow_calls_dont_delay_others(self):
+        scheduler = Scheduler()
+        start = time.monotonic()
+        slow = scheduler.call_at(start + 0.02, time.sleep, 0.5)
+        fast = scheduler.call_at(start + 0.02, lambda: None)
+
+        self.assertTrue(fast.wait(5))
+        self.assertLess(fast.lateness, 0.2)
+        self.assertFalse(slow.done)
+        scheduler.stop()
+        self.assertTrue(slow.done)
+
+    def test_async_scheduler(self):
+        async def run():
+            scheduler = AsyncScheduler()
+            called = []
+
+            async def coroutine(value):
+                called.append(value)
+                return value * 2
+
+            event = scheduler.call_later(0.02, coroutine, 21)
+            other = scheduler.call_later(0.01, called.append, 1)
+            while not event.done:
+                await asyncio.sleep(0.01)
+            return called, event, other
+
+        called, event, other = asyncio.run(run())
+        self.assertEqual(called, [1, 21])
+        self.assertEqual(event.result, 42)
+        self.assertGreaterEqual(event.lateness, 0)
+        self.assertTrue(other.done)
+
+
+class ColorsTests(unittest.TestCase):
+    def test_scalar_conversions(self):
+        from yeelight import colors
+
+        self.assertEqual(colors.hsv_to_rgb(0, 100), 0xFF0000)
+        self.assertEqual(colors.hsv_to_rgb(400, -5), 0xFFFFFF)
+        self.assertEqual(colors.hsv_to_rgb(12.5, 50), colors.hsv_to_rgb(12.5, 50.0))
+        self.assertEqual(colors.rgb_to_hsv(0x00FF00), (120.0, 100.0, 100.0))
+        self.assertEqual(colors.kelvin_to_rgb(6600), 0xFFFFFF)
+        self.assertEqual(colors.kelvin_to_rgb(1000) >> 16, 255)
+        self.assertEqual([colors.perceived_brightness(lightness) for lightness in (0, 50, 100)], [1, 18, 100])
+
+    @unittest.skipUnless(numpy, "numpy is not installed")
+    def test_arrays_match_scalars(self):
+        from yeelight import colors
+
+        hue, saturation = [grid.ravel() for grid in numpy.meshgrid(numpy.arange(360), numpy.arange(101))]
+        expected = [colors.hsv_to_rgb(int(h), int(s)) for h, s in zip(hue, saturation)]
+        self.assertEqual(colors.hsv_to_rgb_array(hue, saturation).tolist(), expected)
+        self.assertEqual(colors.hsv_to_rgb_array(hue + 0.0, saturation + 0.0).tolist(), expected)
+
+        kelvin = numpy.arange(1000, 40001, 7)
+        rgb = colors.kelvin_to_rgb_array(kelvin)
+        self.assertEqual(rgb.tolist(), [colors.kelvin_to_rgb(int(k)) for k in kelvin])
+        hsv = colors.rgb_to_hsv_array(*colors.unpack_rgb(rgb[::500]))
+        expected = [colors.rgb_to_hsv(int(color)) for color in rgb[::500]]
+        numpy.testing.assert_allclose(numpy.stack(hsv, axis=-1), expected)
+
+        lightness = numpy.linspace(0, 100, 1001)
+        expected = [colors.perceived_brightness(value) for value in lightness]
+        self.assertEqual(colors.perceived_brightness_array(lightness).tolist(), expected)
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TransitionArrayTests(unittest.TestCase):
+    def test_hsv_matches_transitions(self):
+        from yeelight.arrays import TransitionArray
+
+        hue, saturation = [grid.ravel() for grid in numpy.meshgrid(numpy.arange(360), numpy.arange(0, 101, 5))]
+        array = TransitionArray.hsv(hue, saturation, durations=100, brightness=50)
+        expected = [HSVTransition(int(h), int(s))._value for h, s in zip(hue, saturation)]
+        self.assertEqual(array.values.tolist(), expected)
+
+    def test_round_trip(self):
+        from yeelight.arrays import TransitionArray
+
+        flow = Flow(count=2, transitions=alarm() + [SleepTransition(20), TemperatureTransition(7000, brightness=0)])
+        array = TransitionArray.from_flow(flow)
+        self.assertEqual(array.expression, flow.expression)
+        self.assertEqual(array.to_flow(count=2).as_start_flow_params, flow.as_start_flow_params)
+        self.assertEqual(Flow(transitions=list(array)).expression, flow.expression)
+        self.assertEqual(array[1:].duration, flow.duration - 250)
+
+    def test_clamped(self):
+        from yeelight.arrays import MODE_COLOR, MODE_TEMPERATURE, TransitionArray
+
+        array = TransitionArray([10, 500], [MODE_COLOR, MODE_TEMPERATURE], [-5, 9000], [0, 300]).clamped()
+        self.assertEqual(array.durations.tolist(), [50, 500])
+        self.assertEqual(array.values.tolist(), [0, 6500])
+        self.assertEqual(array.brightness.tolist(), [1, 100])
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class SunriseTests(unittest.TestCase):
+    def test_keyframes_stay_within_tolerance(self):
+        from yeelight.sunrise import Sunrise, fit_keyframes
+
+        sunrise = Sunrise(duration=30 * 60 * 1000)
+        times, kelvin, brightness = sunrise.sample()
+        keyframes = fit_keyframes(times, kelvin, brightness, mired_tolerance=3, brightness_tolerance=1)
+        self.assertEqual((keyframes[0], keyframes[-1]), (0, len(times) - 1))
+        self.assertLess(len(keyframes), len(times) // 20)
+
+        temperature = kelvin >= 1700
+        replayed = numpy.interp(times, times[keyframes], kelvin[keyframes])
+        self.assertLessEqual(numpy.abs(1e6 / replayed - 1e6 / kelvin)[temperature].max(), 3 + 1e-9)
+        replayed = numpy.interp(times, times[keyframes], brightness[keyframes])
+        self.assertLessEqual(numpy.abs(replayed - brightness).max(), 1 + 1e-9)
+
+    def test_transitions(self):
+        from yeelight.flow import HSVTransition
+        from yeelight.sunrise import Sunrise
+
+        sunrise = Sunrise(duration=20 * 60 * 1000)
+        transitions = sunrise.transitions(mired_tolerance=1)
+        self.assertIsInstance(transitions[0], HSVTransition)
+        self.assertIsInstance(transitions[-1], TemperatureTransition)
+        self.assertEqual(sum(transition.duration for transition in transitions[1:]), sunrise.duration)
+        self.assertEqual(transitions[-1].brightness, 100)
+
+        chain = FlowChain(Bulb(ip=""), sunrise.flow(mired_tolerance=1))
+        self.assertGreater(len(chain.segments), 1)
+
+
+class ListenerTests(unittest.TestCase):
+    def setUp(self):
+        self.bulb = Bulb(ip="", auto_on=True)
+        self.bulb._Bulb__socket, self.remote = socket.socketpair()
+        self.bulb._Bulb__socket.settimeout(5)
+        self.remote.settimeout(5)
+
+    def tearDown(self):
+        self.bulb.stop_listening()
+        self.remote.close()
+
+    def test_notifications_update_properties(self):
+        changed = threading.Event()
+        self.bulb.start_listening(callback=lambda params: changed.set())
+        self.remote.send(b'{"method": "props", "params": {"power": "on", "bright": "10"}}\r\n')
+        self.assertTrue(changed.wait(5))
+        self.assertEqual(self.bulb.last_properties["bright"], "10")
+        self.assertLess(self.bulb.property_age("power"), 5)
+
+    def test_ensure_on_uses_notifications(self):
+        changed = threading.Event()
+        self.bulb.start_listening(callback=lambda params: changed.set())
+        self.remote.send(b'{"method": "props", "params": {"power": "on"}}\r\n')
+        self.assertTrue(changed.wait(5))
+
+        thread = threading.Thread(target=self.bulb.set_brightness, args=(10,))
+        thread.start()
+        command = json.loads(self.remote.recv(1024).decode("utf8"))
+        self.remote.send(json.dumps({"id": command["id"], "result": ["ok"]}).encode("utf8") + b"\r\n")
+        thread.join(5)
+        # No get_prop was needed before the command.
+        self.assertEqual(command["method"], "set_bright")
+
+    def test_lost_response_times_out(self):
+        with Simulator(count=1, loss=1.0) as simulator:
+            virtual = simulator.bulbs[0]
+            bulb = Bulb(virtual.ip, virtual.port, connection=ConnectionManager(read_timeout=1, retries=0))
+            bulb.start_listening()
+            self.addCleanup(bulb.stop_listening)
+
+            start = time.monotonic()
+            self.assertRaises(BulbException, bulb.set_brightness, 10)
+            self.assertLess(time.monotonic() - start, 2)
+
+
+class ReconnectTests(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(5)
+        self.server.settimeout(5)
+        threading.Thread(target=self.serve).start()
+        port = self.server.getsockname()[1]
+        self.bulb = Bulb("127.0.0.1", port, connection=ConnectionManager(backoff=0.01))
+
+    def tearDown(self):
+        self.server.close()
+
+    def serve(self):
+        # Drop the first connection after reading a command, answer on the second one.
+        for drop in (True, False):
+            conn, _ = self.server.accept()
+            command = json.loads(conn.recv(1024).decode("utf8"))
+            if not drop:
+                conn.send(json.dumps({"id": command["id"], "result": ["ok"]}).encode("utf8") + b"\r\n")
+            conn.close()
+
+    def test_idempotent_command_is_retried(self):
+        self.assertEqual(self.bulb.set_brightness(10), "ok")
+        stats = self.bulb.connection.stats
+        self.assertEqual((stats.connects, stats.reconnects, stats.retries), (2, 1, 1))
+        self.assertIsNotNone(stats.last_reconnect_time)
+
+    def test_toggle_is_not_retried(self):
+        self.assertRaises(BulbException, self.bulb.toggle)
+        self.assertEqual(self.bulb.connection.stats.retries, 0)
+        self.bulb.turn_on()  # Let the server finish.
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_waiting_commands_are_coalesced(self):
+        limiter = RateLimiter(rate=10, per=1, burst=1)
+        self.assertTrue(limiter.acquire("set_bright"))
+
+        results = []
+        older = threading.Thread(target=lambda: results.append(limiter.acquire("set_bright")))
+        older.start()
+        time.sleep(0.02)
+        start = time.monotonic()
+        self.assertTrue(limiter.acquire("set_bright"))
+        older.join()
+
+        self.assertEqual(results, [False])
+        self.assertGreater(time.monotonic() - start, 0.05)
+
+    def test_coalesced_commands_in_a_batch(self):
+        bulb = Bulb(ip="", instrumentation=Instrumentation())
+        bulb._Bulb__socket = PipelineSocketMock()
+        bulb.rate_limiter = mock.Mock()
+        bulb.rate_limiter.acquire.side_effect = [False, True]
+
+        responses = bulb.send_commands([("set_bright", [10, "smooth", 300]), ("set_power", ["on", "smooth", 300])])
+        self.assertEqual(responses, [{"result": ["ok"], "coalesced": True}, {"id": 0, "result": ["set_power"]}])
+        self.assertNotIn("bright", bulb.last_properties)
+        self.assertEqual(bulb.last_properties["power"], "on")
+        self.assertEqual(bulb.instrumentation.stats_for(bulb).coalesced, 1)
+
+
+class MusicHubTests(unittest.TestCase):
+    def fake_bulb(self, ip, server):
+        """Answer get_prop and set_music, connecting back to the hub from our IP."""
+        conn, _ = server.accept()
+        while True:
+            command = json.loads(conn.recv(1024).decode("utf8"))
+            conn.send(json.dumps({"id": command["id"], "result": ["ok"]}).encode("utf8") + b"\r\n")
+            if command["method"] == "set_music":
+                music = socket.create_connection(tuple(command["params"][1:]), source_address=(ip, 0))
+                self.music.append(music)
+                break
+        conn.close()
+
+    def test_start_many_bulbs(self):
+        self.music = []
+        bulbs = []
+        for ip in ("127.0.0.1", "127.0.0.2"):
+            server = socket.socket()
+            server.bind((ip, 0))
+            server.listen(1)
+            self.addCleanup(server.close)
+            threading.Thread(target=self.fake_bulb, args=(ip, server)).start()
+            bulbs.append(Bulb(ip, server.getsockname()[1]))
+
+        with MusicHub(ip="127.0.0.1") as hub:
+            result = hub.start(bulbs)
+
+        self.assertTrue(result.ok, result.errors)
+        for bulb in bulbs:
+            self.assertTrue(bulb.music_mode)
+            self.assertEqual(bulb._socket.getpeername()[0], bulb._ip)
+            bulb._socket.close()
+        for music in self.music:
+            music.close()
+
+
+class SimulatorTests(unittest.TestCase):
+    def setUp(self):
+        self.simulator = Simulator(count=3, distinct_ips=True, rate_limit=4, rate_period=60)
+        self.simulator.start()
+        self.addCleanup(self.simulator.stop)
+
+    def test_discovery_and_commands(self):
+        found = discover_bulbs(timeout=2, ssdp_address=self.simulator.ssdp_address, expected_count=3)
+        self.assertEqual(sorted(bulb["capabilities"]["name"] for bulb in found), ["bulb 1", "bulb 2", "bulb 3"])
+
+        virtual = self.simulator.bulbs[0]
+        bulb = Bulb(virtual.ip, virtual.port)
+        self.assertRaises(BulbException, bulb.set_brightness, 40)  # The bulb is off.
+        bulb.turn_on()
+        bulb.set_brightness(40)
+        self.assertEqual(virtual.properties["bright"], "40")
+        self.assertEqual(bulb.get_properties()["power"], "on")
+
+        # Only four commands are allowed per minute.
+        self.assertRaises(BulbException, bulb.set_color_temp, 2700)
+        self.assertEqual(virtual.throttled, 1)
+
+    def test_notifications_and_music_mode(self):
+        virtual = self.simulator.bulbs[1]
+        bulb = Bulb(virtual.ip, virtual.port, auto_on=True)
+        notified = threading.Event()
+        bulb.start_listening(lambda properties: notified.set())
+        self.addCleanup(bulb.stop_listening)
+        # The bulb only notifies the clients already connected to it.
+        deadline = time.monotonic() + 2
+        while not virtual._writers and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        other = Bulb(virtual.ip, virtual.port)
+        other.turn_on()
+        self.assertTrue(notified.wait(2))
+        self.assertEqual(bulb.last_properties["power"], "on")
+
+        other.start_music()
+        for brightness in range(1, 21):
+            other.set_brightness(brightness)
+        other.stop_music()
+        self.assertEqual(bulb.get_properties()["bright"], "20")
+        self.assertEqual(virtual.throttled, 0)
+
+
+class PropertyFetchTests(unittest.TestCase):
+    def setUp(self):
+        self.simulator = Simulator(count=1, latency=0.2, rate_limit=None)
+        self.simulator.start()
+        self.addCleanup(self.simulator.stop)
+
+    def test_concurrent_get_properties_coalesce(self):
+        virtual = self.simulator.bulbs[0]
+        bulb = Bulb(virtual.ip, virtual.port)
+        results = []
+
+        def read(properties):
+            results.append(bulb.get_properties(properties)["power"])
+
+        threads = [threading.Thread(target=read, args=(["power", "bright"],))]
+        threads += [threading.Thread(target=read, args=(["power"],)) for _ in range(5)]
+        threads[0].start()
+        time.sleep(0.05)  # The first fetch is in flight when the others start.
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, ["off"] * 6)
+        self.assertEqual(virtual.received, 1)
+
+    def test_concurrent_async_get_properties_coalesce(self):
+        virtual = self.simulator.bulbs[0]
+
+        async def read():
+            async with AsyncBulb(virtual.ip, virtual.port) as bulb:
+                return await asyncio.gather(*(bulb.get_properties(["power"]) for _ in range(5)))
+
+        asyncio.run(read())
+        self.assertEqual(virtual.received, 1)
+
+
+class InstrumentationTests(unittest.TestCase):
+    def test_histogram(self):
+        histogram = LatencyHistogram()
+        for micros in range(1, 100001):
+            histogram.record(micros / 1e6)
+        self.assertEqual(histogram.count, 100000)
+        self.assertAlmostEqual(histogram.percentile(0.5), 0.05, delta=0.05 * 0.01)
+        self.assertAlmostEqual(histogram.percentile(0.99), 0.099, delta=0.099 * 0.01)
+        self.assertEqual(histogram.percentile(1), histogram.max)
+        self.assertIsNone(LatencyHistogram().percentile(0.5))
+
+    def test_hooks_and_stats(self):
+        with Simulator(count=1, rate_limit=2) as simulator:
+            virtual = simulator.bulbs[0]
+            instrumentation = Instrumentation()
+            before, after = [], []
+            instrumentation.add_pre_hook(before.append)
+            instrumentation.add_post_hook(after.append)
+
+            bulb = Bulb(virtual.ip, virtual.port, instrumentation=instrumentation)
+            bulb.turn_on()
+            with self.assertRaises(BulbException):
+                bulb.send_commands([("get_prop", ["power"]), ("get_prop", ["bright"])])
+
+        self.assertEqual([event.method for event in before], ["set_power", "get_prop", "get_prop"])
+        self.assertIs(before[0], after[0])
+        self.assertGreater(after[0].connect_time, 0)
+        self.assertGreater(after[0].bytes_sent, after[0].params_size)
+        self.assertGreater(after[0].bytes_received, 0)
+        self.assertIsNotNone(after[0].rtt)
+        self.assertEqual(after[-1].error, "BulbException")  # Over the simulated quota.
+
+        stats = instrumentation.stats_for(bulb)
+        self.assertEqual(stats.commands, 3)
+        self.assertEqual(stats.errors, {"BulbException": 1})
+        self.assertEqual(stats.rtt.count, 3)
+        dumped = json.loads(json.dumps(instrumentation.as_dict()))
+        self.assertEqual(dumped["%s:%s" % (virtual.ip, virtual.port)]["commands"], 3)
+
+    def test_batch_failing_halfway(self):
+        bulb = Bulb(ip="", instrumentation=Instrumentation())
+        bulb._Bulb__socket = PipelineSocketMock()
+        bulb.rate_limiter = mock.Mock()
+        bulb.rate_limiter.acquire.side_effect = [True, BulbException("Quota exceeded.")]
+
+        with self.assertRaises(BulbException):
+            bulb.send_commands([("set_bright", [10, "smooth", 300]), ("set_power", ["on", "smooth", 300])])
+        self.assertEqual(bulb._pending, {})
+        stats = bulb.instrumentation.stats_for(bulb)
+        self.assertEqual(stats.commands, 2)
+        self.assertEqual(stats.errors, {"BulbException": 2})
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_percentile(self):
+        from yeelight.benchmark import percentile
+
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 0.5), 3)
+        self.assertAlmostEqual(percentile([0, 10], 0.95), 9.5)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_run(self):
+        from yeelight.benchmark import run
+
+        report = run(commands=20, bulbs=2, fleet_sizes=(3,))
+        json.dumps(report)
+        results = report["results"]
+        for name in ("send_command", "send_commands", "get_properties", "group", "async"):
+            self.assertGreater(results[name]["per_second"], 0, name)
+        self.assertEqual(results["send_command"]["count"], 20)
+        self.assertEqual(results["discovery"][0]["found"], 3)
+
+
+class DiscoveryTests(unittest.TestCase):
+    def setUp(self):
+        self.responder = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.responder.bind(("127.0.0.1", 0))
+        self.patch = mock.patch("yeelight.main._SSDP_ADDRESS", self.responder.getsockname())
+        self.patch.start()
+        threading.Thread(target=self.respond, args=(["bed", "bed", "kitchen 1"],)).start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.responder.close()
+
+    def respond(self, names):
+        _, addr = self.responder.recvfrom(1024)
+        for i, name in enumerate(names):
+            reply = "HTTP/1.1 200 OK\r\nLocation: yeelight://127.0.0.%s:55443\r\nid: %s\r\nname: %s\r\n"
+            self.responder.sendto((reply % (names.index(name) + 1, i, name)).encode(), addr)
+
+    def test_stops_when_expected_names_replied(self):
+        start = time.monotonic()
+        bulbs = discover_bulbs(timeout=10, expected_names=["bed", "kitchen 1"])
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual([bulb["capabilities"]["name"] for bulb in bulbs], ["bed", "kitchen 1"])
+
+    def test_iter_stops_at_expected_count(self):
+        bulbs = list(discover_bulbs_iter(timeout=10, expected_count=1))
+        self.assertEqual(bulbs, [{"ip": "127.0.0.1", "port": 55443, "capabilities": {"id": "0", "name": "bed"}}])
+
+
+class DiscoveryCacheTests(unittest.TestCase):
+    BULBS = [
+        {
+            "ip": "10.0.0.2",
+            "port": 55443,
+            "capabilities": {"id": "0x1", "model": "color", "name": "bed", "support": ""},
+        },
+        {
+            "ip": "10.0.0.3",
+            "port": 55443,
+            "capabilities": {"id": "0x2", "model": "mono", "name": "hall", "support": ""},
+        },
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bulbs.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_persists_and_skips_discovery(self):
+        with mock.patch("yeelight.cache.discover_bulbs", return_value=self.BULBS) as discover:
+            self.assertEqual(DiscoveryCache(self.path).discover(expected_names=["bed"]), self.BULBS)
+            self.assertEqual(DiscoveryCache(self.path).discover(expected_names=["bed", "hall"]), self.BULBS)
+        self.assertEqual(discover.call_count, 1)
+
+    def test_stale_entries_are_refreshed_in_background(self):
+        cache = DiscoveryCache(self.path, ttl=0)
+        cache.update(self.BULBS)
+        time.sleep(0.01)
+        with mock.patch("yeelight.cache.discover_bulbs", return_value=self.BULBS) as discover:
+            self.assertEqual(cache.discover(expected_count=2), self.BULBS)
+            cache.close()
+        self.assertEqual(discover.call_count, 1)
+        self.assertTrue(cache._refresher.daemon)
+        self.assertFalse(cache._refresher.is_alive())
+
+
+class BulbRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = BulbRegistry(DiscoveryCacheTests.BULBS, auto_on=True)
+
+    def test_shared_instances(self):
+        bulb = self.registry.get("bed")
+        self.assertIs(bulb, self.registry.get("bed"))
+        self.assertIs(bulb, self.registry.by_id("0x1"))
+        self.assertIs(bulb, self.registry.by_ip("10.0.0.2"))
+        self.assertEqual(bulb.model, "color")
+        self.assertTrue(bulb.auto_on)
+
+    def test_lookups(self):
+        self.assertEqual(len(self.registry), 2)
+        self.assertIn("hall", self.registry)
+        self.assertEqual(self.registry.by_model("mono"), [self.registry.get("hall")])
+        replaced = dict(DiscoveryCacheTests.BULBS[0], capabilities=dict(DiscoveryCacheTests.BULBS[0]["capabilities"]))
+        replaced["capabilities"]["model"] = "mono"
+        self.registry.add([replaced])
+        self.assertEqual(self.registry.by_model("color"), [])
+        self.assertEqual(len(self.registry.by_model("mono")), 2)
+        self.assertIsNone(self.registry.get("attic"))
+
+    def test_slow_connection_doesnt_block_other_lookups(self):
+        connecting = threading.Event()
+        release = threading.Event()
+
+        class SlowBulb(Bulb):
+            @property
+            def _socket(self):
+                if self._ip == "10.0.0.2":
+                    connecting.set()
+                    release.wait(5)
+
+        registry = BulbRegistry(DiscoveryCacheTests.BULBS, cache=mock.Mock())
+        with mock.patch("yeelight.registry.Bulb", SlowBulb):
+            thread = threading.Thread(target=registry.get, args=("bed",))
+            thread.start()
+            self.assertTrue(connecting.wait(5))
+            self.assertIsNotNone(registry.get("hall"))
+            self.assertTrue(thread.is_alive())
+            release.set()
+            thread.join()
+        self.assertIs(registry.get("bed"), registry.by_ip("10.0.0.2"))
+
+    def test_moved_bulb_gets_new_instance(self):
+        bulb = self.registry.get("bed")
+        moved = dict(DiscoveryCacheTests.BULBS[0], ip="10.0.0.9")
+        self.registry.add([moved])
+        self.assertIsNot(bulb, self.registry.get("bed"))
+        self.assertIsNone(self.registry.by_ip("10.0.0.2"))
+
+
+class BulbGroupTests(unittest.TestCase):
+    def test_fan_out(self):
+        bulbs = [Bulb(ip="") for _ in range(3)]
+        for bulb in bulbs:
+            bulb._Bulb__socket = SocketMock()
+        bulbs[2]._Bulb__socket = SocketMock(received=b'{"id": 0, "error": {"code": -1, "message": "unsupported"}}')
+
+        with BulbGroup(bulbs + [None]) as group:
+            result = group.set_color_temp(2700, duration=1000)
+
+        self.assertEqual(result.results, {bulbs[0]: "ok", bulbs[1]: "ok"})
+        self.assertIsInstance(result.errors[bulbs[2]], BulbException)
+        self.assertFalse(result.ok)
+        for bulb in bulbs:
+            self.assertEqual(bulb._Bulb__socket.sent["params"], [2700, "smooth", 1000])
+
+
+class AsyncTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sent = []
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.bulb = AsyncBulb("127.0.0.1", port=port)
+
+    async def asyncTearDown(self):
+        await self.bulb.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = json.loads(line.decode("utf8"))
+            self.sent.append(command)
+            result = [command["method"]] + command["params"]
+            writer.write((json.dumps({"id": command["id"], "result": result}) + "\r\n").encode("utf8"))
+        writer.close()
+
+    async def test_set_rgb(self):
+        result = await self.bulb.set_rgb(255, 255, 0)
+        self.assertEqual(result, "set_rgb")
+        self.assertEqual(self.sent[-1]["params"], [16776960, "smooth", 300])
+
+    async def test_concurrent_commands(self):
+        results = await asyncio.gather(self.bulb.turn_on(), self.bulb.set_brightness(10), self.bulb.toggle())
+        self.assertEqual(results, ["set_power", "set_bright", "toggle"])
+
+    async def test_send_commands(self):
+        responses = await self.bulb.send_commands([("set_bright", [10, "smooth", 300]), ("toggle", [])])
+        self.assertEqual([response["result"][0] for response in responses], ["set_bright", "toggle"])
+        self.assertRaises(TypeError, self.bulb.start_listening)
+        self.assertRaises(TypeError, self.bulb.stop_listening)
+
 
 if __name__ == "__main__":
     unittest.main()
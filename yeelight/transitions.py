@@ -1,11 +1,29 @@
 """Pre-made transitions, for your strobing pleasure."""
 
+import functools
 import random
 
 from .flow import HSVTransition, RGBTransition, SleepTransition, TemperatureTransition
 from .utils import _clamp
 
 
+def _memoized(preset):
+    """
+    Build the transitions of a deterministic preset once per set of arguments.
+
+    Transitions can't be changed, so every call can share them, along with
+    their encoding. Each call still gets its own list.
+    """
+    cached = functools.lru_cache(maxsize=128)(lambda *args, **kwargs: tuple(preset(*args, **kwargs)))
+
+    @functools.wraps(preset)
+    def wrapper(*args, **kwargs):
+        return list(cached(*args, **kwargs))
+
+    return wrapper
+
+
+@_memoized
 def disco(bpm=120):
     """
     Color changes to the beat.
@@ -29,6 +47,7 @@ def disco(bpm=120):
     return transitions
 
 
+@_memoized
 def temp():
     """
     Slowly-changing color temperature.
@@ -40,6 +59,7 @@ def temp():
     return transitions
 
 
+@_memoized
 def strobe():
     """
     Rapid flashing on and off.
@@ -51,6 +71,7 @@ def strobe():
     return transitions
 
 
+@_memoized
 def pulse(red, green, blue, duration=250, brightness=100):
     """
     Pulse a single color once (mainly to be used for notifications).
@@ -75,6 +96,7 @@ def pulse(red, green, blue, duration=250, brightness=100):
     return transitions
 
 
+@_memoized
 def strobe_color(brightness=100):
     """
     Rapid flashing colors.
@@ -95,6 +117,7 @@ def strobe_color(brightness=100):
     return transitions
 
 
+@_memoized
 def alarm(duration=250):
     """
     Red alarm; flashing bright red to dark red.
@@ -111,6 +134,7 @@ def alarm(duration=250):
     return transitions
 
 
+@_memoized
 def police(duration=300, brightness=100):
     """
     Color changes from red to blue, like police lights.
@@ -128,6 +152,7 @@ def police(duration=300, brightness=100):
     return transitions
 
 
+@_memoized
 def police2(duration=250, brightness=100):
     """
     Color flashes red and then blue, like urgent police lights.
@@ -151,6 +176,7 @@ def police2(duration=250, brightness=100):
     return transitions
 
 
+@_memoized
 def lsd(duration=3000, brightness=100):
     """
     Gradual changes to a pleasing, trippy palette.
@@ -164,6 +190,7 @@ def lsd(duration=3000, brightness=100):
     return [HSVTransition(hue, saturation, duration=duration, brightness=brightness) for hue, saturation in hs_values]
 
 
+@_memoized
 def christmas(duration=250, brightness=100, sleep=3000):
     """
     Color changes from red to green, like christmas lights.
@@ -184,6 +211,7 @@ def christmas(duration=250, brightness=100, sleep=3000):
     return transitions
 
 
+@_memoized
 def rgb(duration=250, brightness=100, sleep=3000):
     """
     Color changes from red to green to blue.